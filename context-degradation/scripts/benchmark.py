@@ -0,0 +1,328 @@
+"""
+Context Degradation Benchmarks
+
+Benchmark and regression harness for the analyzers in degradation_detector.
+
+Synthetic contexts are generated at fixed sizes (10K/100K/1M tokens) with
+controllable error-marker density and section counts. Each analyzer is timed
+over several runs, then run once more under tracemalloc to record peak memory
+and the number of memory blocks it retains. Results can be saved as a baseline JSON
+and later runs compared against it, so slowdowns show up automatically.
+
+Usage:
+    python benchmark.py --sizes 10K,100K --save-baseline baseline.json
+    python benchmark.py --sizes 10K,100K --baseline baseline.json
+    python benchmark.py --sizes 150K --analyzers poisoning,poisoning_reference
+    python benchmark.py --parity
+
+--parity checks the single-pass marker scanner against the per-pattern
+reference implementation on random texts, including non-ASCII case folds.
+
+NOTE: Wall times depend on the machine. Compare against baselines recorded
+on the same hardware, and keep the tolerance loose enough for noise.
+"""
+
+from typing import Callable, Dict, List
+from io import StringIO
+import argparse
+import json
+import platform
+import random
+import re
+import statistics
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+from degradation_detector import (
+    ContextHealthAnalyzer,
+    IncrementalContextHealthAnalyzer,
+    PoisoningDetector,
+    analyze_context_structure,
+    analyze_context_structure_stream,
+    detect_lost_in_middle,
+    measure_attention_profile
+)
+
+
+# Token counts; 150K tokens is about 1 MB of text
+SIZES = {"10K": 10_000, "100K": 100_000, "150K": 150_000, "1M": 1_000_000}
+
+
+# Synthetic Contexts
+
+FILLER_WORDS = (
+    "the agent reviewed configuration output and recorded results for each "
+    "step of the task including files requests responses tools and notes"
+).split()
+
+MARKER_PHRASES = (
+    PoisoningDetector().error_patterns
+    + [p for pair in PoisoningDetector.CONFLICT_PATTERNS for p in pair]
+    + PoisoningDetector.HALLUCINATION_MARKERS
+)
+
+
+def generate_context(tokens: int, error_density: float = 0.005,
+                     sections: int = 20, seed: int = 0) -> str:
+    """
+    Build a synthetic context of roughly `tokens` whitespace tokens.
+    
+    `error_density` is the fraction of tokens replaced by error, conflict or
+    hallucination phrases; `sections` markdown headers are spread evenly.
+    Lines hold 12 tokens and end in a period so sentence-level checks apply.
+    """
+    rng = np.random.default_rng(seed)
+    words = np.array(FILLER_WORDS, dtype=object)[rng.integers(0, len(FILLER_WORDS), tokens)]
+    
+    markers = rng.random(tokens) < error_density
+    words[markers] = np.array(MARKER_PHRASES, dtype=object)[
+        rng.integers(0, len(MARKER_PHRASES), int(markers.sum()))
+    ]
+    
+    section_every = max(tokens // max(sections, 1), 1)
+    out = StringIO()
+    for start in range(0, tokens, 12):
+        if sections and start % section_every < 12 and start // section_every < sections:
+            level = "#" * (1 + (start // section_every) % 3)
+            out.write(f"{level} Section {start // section_every + 1}\n")
+        out.write(" ".join(words[start:start + 12]))
+        out.write(".\n")
+    return out.getvalue()
+
+
+# Analyzers
+
+def _incremental(context: str) -> Dict:
+    analyzer = IncrementalContextHealthAnalyzer(context_limit=len(context) // 4 + 1)
+    result = None
+    for start in range(0, len(context), 16_000):
+        result = analyzer.append(context[start:start + 16_000])
+    return result
+
+
+ANALYZERS: Dict[str, Callable[[str], object]] = {
+    "health_analyze": lambda context: ContextHealthAnalyzer(
+        context_limit=len(context) // 4 + 1).analyze(context),
+    "incremental_append": _incremental,
+    "poisoning": lambda context: PoisoningDetector().detect_poisoning(context),
+    "poisoning_reference": lambda context: reference_poisoning(context),
+    "structure": analyze_context_structure,
+    "structure_stream": lambda context: analyze_context_structure_stream(StringIO(context)),
+    "lost_in_middle": lambda context: detect_lost_in_middle(
+        list(range(10)), measure_attention_profile(len(context.split())))
+}
+
+
+# Marker Scanner Parity
+
+def reference_poisoning(context: str, error_patterns: List[str] = None) -> Dict:
+    """Poisoning report from one regex search per pattern, as before MarkerScanner."""
+    detector = PoisoningDetector()
+    if error_patterns is not None:
+        detector.error_patterns = list(error_patterns)
+    error_count = sum(
+        1 for pattern in detector.error_patterns
+        if re.search(pattern, context, re.IGNORECASE)
+    )
+    
+    contradictions = []
+    for pattern1, pattern2 in detector.CONFLICT_PATTERNS:
+        if re.search(pattern1, context, re.IGNORECASE) and re.search(pattern2, context, re.IGNORECASE):
+            for sentence in context.split('.'):
+                if re.search(pattern1, sentence, re.IGNORECASE) or \
+                   re.search(pattern2, sentence, re.IGNORECASE):
+                    if sentence.strip() and len(sentence.strip()) < 200:
+                        contradictions.append(sentence.strip()[:100])
+    
+    markers = [m for m in detector.HALLUCINATION_MARKERS if m in context.lower()]
+    return PoisoningDetector.build_report(error_count, contradictions[:5], markers)
+
+
+# Characters where lowercasing and re.IGNORECASE disagree, or lower() changes length
+NON_ASCII_WORDS = ["\u0130t", "fa\u0130led", "\u0131", "\u017f", "\u212a", "\u00df", "na\u00efve", "\u03a3\u039f\u03a6"]
+
+# Error patterns where one literal is a prefix of another at the same offset
+PREFIX_ERROR_PATTERNS = ["fail", "failed", "err", "error", "x", "y"]
+
+
+def check_marker_parity(trials: int = 2000, seed: int = 0) -> List[str]:
+    """
+    Compare detect_poisoning with reference_poisoning on random texts.
+    
+    Texts mix markers, sentence breaks, upper case and the non-ASCII words
+    above (also spliced into markers). Every text is checked with the
+    default error patterns and with PREFIX_ERROR_PATTERNS. Returns the
+    texts that disagree.
+    """
+    rng = random.Random(seed)
+    vocabulary = list(MARKER_PHRASES) + FILLER_WORDS[:8] + NON_ASCII_WORDS + \
+        PREFIX_ERROR_PATTERNS + [".", "x. y", "\n"]
+    detector = PoisoningDetector()
+    prefix_detector = PoisoningDetector()
+    prefix_detector.error_patterns = list(PREFIX_ERROR_PATTERNS)
+    mismatches = []
+    for _ in range(trials):
+        words = []
+        for word in rng.choices(vocabulary, k=rng.randint(0, 60)):
+            if rng.random() < 0.2:
+                word = word.upper()
+            elif rng.random() < 0.1:
+                word = word.replace("i", "\u0130")
+            words.append(word)
+        text = " ".join(words)
+        if detector.detect_poisoning(text) != reference_poisoning(text) or \
+                prefix_detector.detect_poisoning(text) != reference_poisoning(text, PREFIX_ERROR_PATTERNS):
+            mismatches.append(text)
+    return mismatches
+
+
+# Measurement
+
+def measure(fn: Callable[[str], object], context: str, repeat: int = 3) -> Dict:
+    """
+    Time fn(context) and record its memory behaviour.
+    
+    Wall times come from untraced runs. A final run under tracemalloc gives
+    the peak traced memory and retained_blocks: the net number of traced
+    memory blocks still held when the call returned (including its result).
+    Temporaries allocated and freed during the call do not show up there;
+    peak memory is the measure of working-set size.
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(context)
+        times.append(time.perf_counter() - start)
+    
+    tracemalloc.start()
+    try:
+        before = tracemalloc.take_snapshot()
+        tracemalloc.reset_peak()
+        result = fn(context)
+        _, peak = tracemalloc.get_traced_memory()
+        after = tracemalloc.take_snapshot()
+    finally:
+        tracemalloc.stop()
+    del result
+    
+    retained_blocks = len(after.traces) - len(before.traces)
+    return {
+        "wall_time_min": min(times),
+        "wall_time_median": statistics.median(times),
+        "peak_memory_bytes": peak,
+        "retained_blocks": retained_blocks
+    }
+
+
+def run_benchmarks(sizes: List[str], analyzers: List[str] = None,
+                   repeat: int = 3, error_density: float = 0.005,
+                   sections: int = 20, seed: int = 0) -> Dict:
+    """Run each analyzer on a synthetic context of each size."""
+    analyzers = analyzers or list(ANALYZERS)
+    results = {}
+    for size in sizes:
+        context = generate_context(SIZES[size], error_density, sections, seed)
+        for name in analyzers:
+            results[f"{name}@{size}"] = measure(ANALYZERS[name], context, repeat)
+    
+    return {
+        "meta": {
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "machine": platform.machine(),
+            "error_density": error_density,
+            "sections": sections,
+            "repeat": repeat,
+            "timestamp": time.time()
+        },
+        "results": results
+    }
+
+
+def compare_to_baseline(current: Dict, baseline: Dict, time_tolerance: float = 0.25,
+                        memory_tolerance: float = 0.25) -> List[Dict]:
+    """
+    List benchmarks that regressed against a baseline run.
+    
+    A benchmark regresses when its minimum wall time or peak memory exceeds
+    the baseline by more than the given fraction. Benchmarks missing from
+    the baseline are skipped.
+    """
+    regressions = []
+    for key, result in current["results"].items():
+        reference = baseline.get("results", {}).get(key)
+        if reference is None:
+            continue
+        for metric, tolerance in (("wall_time_min", time_tolerance),
+                                  ("peak_memory_bytes", memory_tolerance)):
+            if reference[metric] <= 0:
+                continue
+            ratio = result[metric] / reference[metric]
+            if ratio > 1 + tolerance:
+                regressions.append({
+                    "benchmark": key,
+                    "metric": metric,
+                    "baseline": reference[metric],
+                    "current": result[metric],
+                    "ratio": ratio
+                })
+    return regressions
+
+
+def format_results(report: Dict) -> str:
+    """Render a results table."""
+    lines = [f"{'benchmark':<32}{'min (s)':>10}{'median (s)':>12}{'peak (MB)':>11}{'retained':>10}"]
+    for key, result in report["results"].items():
+        lines.append(
+            f"{key:<32}{result['wall_time_min']:>10.4f}{result['wall_time_median']:>12.4f}"
+            f"{result['peak_memory_bytes'] / 1e6:>11.1f}{result['retained_blocks']:>10}"
+        )
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark context degradation analyzers")
+    parser.add_argument("--sizes", default="10K,100K", help=f"Comma-separated from {', '.join(SIZES)}")
+    parser.add_argument("--analyzers", default=None, help=f"Comma-separated from {', '.join(ANALYZERS)}")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--error-density", type=float, default=0.005)
+    parser.add_argument("--sections", type=int, default=20)
+    parser.add_argument("--baseline", help="Baseline JSON to compare against")
+    parser.add_argument("--save-baseline", help="Write this run's results to a JSON file")
+    parser.add_argument("--time-tolerance", type=float, default=0.25)
+    parser.add_argument("--memory-tolerance", type=float, default=0.25)
+    parser.add_argument("--parity", action="store_true", help="Only run the marker scanner parity check")
+    
+    args = parser.parse_args()
+    
+    if args.parity:
+        mismatches = check_marker_parity()
+        for text in mismatches[:5]:
+            print(f"MISMATCH {text!r}")
+        print(f"marker parity: {len(mismatches)} mismatches")
+        sys.exit(1 if mismatches else 0)
+    
+    report = run_benchmarks(
+        args.sizes.upper().split(","),
+        args.analyzers.split(",") if args.analyzers else None,
+        args.repeat, args.error_density, args.sections
+    )
+    print(format_results(report))
+    
+    if args.save_baseline:
+        with open(args.save_baseline, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare_to_baseline(
+                report, json.load(f), args.time_tolerance, args.memory_tolerance
+            )
+        for regression in regressions:
+            print(f"REGRESSION {regression['benchmark']} {regression['metric']}: "
+                  f"{regression['baseline']:.4g} -> {regression['current']:.4g} "
+                  f"({regression['ratio']:.2f}x)")
+        sys.exit(1 if regressions else 0)
@@ -14,40 +14,93 @@ PRODUCTION NOTES:
 """
 
 import numpy as np
-from typing import List, Dict
+from typing import Dict, List, Optional, Union
+from bisect import bisect_right
+from collections import deque
+from functools import lru_cache
+from array import array
+import argparse
+import codecs
+import csv
+import hashlib
+import heapq
+import json
+import multiprocessing
+import os
 import re
+import time
+import zlib
 
 
-def measure_attention_distribution(context_tokens: List[str], query: str) -> List[Dict]:
+REGION_NAMES = ("beginning", "middle", "end")
+
+
+def classify_positions(positions: np.ndarray, n: int) -> np.ndarray:
+    """Region code per position (0 = beginning, 1 = middle, 2 = end)."""
+    region = np.ones(len(positions), dtype=np.int8)
+    region[positions < n * 0.1] = 0
+    region[positions > n * 0.9] = 2
+    return region
+
+
+def measure_attention_profile(n: int, seed: int = 0) -> Dict:
+    """
+    Compute the attention curve for an n-token context as NumPy arrays.
+    
+    Returns:
+        attention: float array of length n
+        region: int8 array of length n (0 = beginning, 1 = middle, 2 = end)
+        favored: bool array, True where attention is favored (beginning/end)
+        region_mean, region_count: per-region aggregates, indexed like REGION_NAMES
+    """
+    rng = np.random.default_rng(seed)
+    attention = _estimate_attention_curve(n, rng)
+    
+    region = classify_positions(np.arange(n), n)
+    
+    region_count = np.bincount(region, minlength=3)
+    region_sum = np.bincount(region, weights=attention, minlength=3)
+    region_mean = np.divide(
+        region_sum, region_count,
+        out=np.zeros(3), where=region_count > 0
+    )
+    
+    return {
+        "n": n,
+        "attention": attention,
+        "region": region,
+        "favored": region != 1,
+        "region_mean": region_mean,
+        "region_count": region_count
+    }
+
+
+def measure_attention_distribution(context_tokens: List[str], query: str,
+                                   seed: int = 0) -> List[Dict]:
     """
     Measure how attention varies across context positions.
     
-    Returns distribution showing attention weight by position.
+    Returns distribution showing attention weight by position. This builds
+    one dict per token; use measure_attention_profile for large contexts.
     """
     n = len(context_tokens)
-    attention_by_position = []
+    profile = measure_attention_profile(n, seed)
+    favored = profile["favored"].tolist()
     
-    for position in range(n):
-        is_beginning = position < n * 0.1
-        is_end = position > n * 0.9
-        
-        # Simulated attention measurement
-        # In production, this would use actual model attention weights
-        attention = _estimate_attention(position, n, is_beginning, is_end)
-        
-        attention_by_position.append({
+    return [
+        {
             "position": position,
             "attention": attention,
-            "region": "attention_favored" if (is_beginning or is_end) else "attention_degraded",
+            "region": "attention_favored" if favored[position] else "attention_degraded",
             "tokens": context_tokens[position][:50] if position < 5 or position > n - 5 else None
-        })
-    
-    return attention_by_position
+        }
+        for position, attention in enumerate(profile["attention"].tolist())
+    ]
 
 
-def _estimate_attention(position: int, total: int, is_beginning: bool, is_end: bool) -> float:
+def _estimate_attention_curve(n: int, rng: np.random.Generator) -> np.ndarray:
     """
-    Estimate attention weight for position.
+    Estimate attention weight for every position.
     
     Simulates U-shaped attention curve based on research findings.
     
@@ -62,24 +115,139 @@ def _estimate_attention(position: int, total: int, is_beginning: bool, is_end: b
     - End tokens receive high attention (recency effect)
     - Middle tokens receive degraded attention (lost-in-middle)
     """
-    if is_beginning:
-        return 0.8 + np.random.random() * 0.2
-    elif is_end:
-        return 0.7 + np.random.random() * 0.3
-    else:
-        # Middle positions get reduced attention
-        middle_progress = (position - total * 0.1) / (total * 0.8)
-        base_attention = 0.3 * (1 - middle_progress) + 0.1 * middle_progress
-        return base_attention + np.random.random() * 0.1
+    positions = np.arange(n, dtype=np.float64)
+    noise = rng.random(n)
+    
+    # Middle positions get reduced attention
+    middle_progress = (positions - n * 0.1) / (n * 0.8) if n else positions
+    attention = 0.3 * (1 - middle_progress) + 0.1 * middle_progress + noise * 0.1
+    
+    is_beginning = positions < n * 0.1
+    is_end = positions > n * 0.9
+    attention[is_beginning] = 0.8 + noise[is_beginning] * 0.2
+    attention[is_end] = 0.7 + noise[is_end] * 0.3
+    return attention
+
+
+# Measured Attention
+
+def load_attention_weights(path: str, reduce: str = "mean",
+                           max_chunk_bytes: int = 64 * 1024 * 1024) -> np.ndarray:
+    """
+    Load an attention dump and reduce it to one weight per token position.
+    
+    The .npy file must have shape (layers, heads, seq). It is memory-mapped
+    and reduced across layers and heads in sequence chunks sized to
+    max_chunk_bytes, so the full tensor is never loaded.
+    """
+    weights = np.load(path, mmap_mode="r")
+    if weights.ndim != 3:
+        raise ValueError(f"Expected (layers, heads, seq) array, got shape {weights.shape}")
+    if reduce not in ("mean", "max"):
+        raise ValueError(f"Unknown reduction: {reduce}")
+    
+    layers, heads, seq = weights.shape
+    chunk = max(1, max_chunk_bytes // (heads * 8))
+    reduced = np.zeros(seq, dtype=np.float64) if reduce == "mean" else np.full(seq, -np.inf)
+    
+    for start in range(0, seq, chunk):
+        end = min(seq, start + chunk)
+        # One layer at a time keeps the working set at heads * chunk values
+        for layer in range(layers):
+            block = np.asarray(weights[layer, :, start:end], dtype=np.float64)
+            if reduce == "mean":
+                reduced[start:end] += block.sum(axis=0)
+            else:
+                np.maximum(reduced[start:end], block.max(axis=0), out=reduced[start:end])
+    
+    if reduce == "mean":
+        reduced /= layers * heads
+    return reduced
+
+
+def attention_profile_from_weights(attention: np.ndarray, threshold: float = 0.5) -> Dict:
+    """
+    Build an attention profile (as from measure_attention_profile) from real weights.
+    
+    A position is attention-degraded when it receives less than
+    threshold * the mean attention across the context.
+    """
+    attention = np.asarray(attention, dtype=np.float64)
+    n = len(attention)
+    region = classify_positions(np.arange(n), n)
+    
+    region_count = np.bincount(region, minlength=3)
+    region_sum = np.bincount(region, weights=attention, minlength=3)
+    region_mean = np.divide(
+        region_sum, region_count,
+        out=np.zeros(3), where=region_count > 0
+    )
+    
+    return {
+        "n": n,
+        "attention": attention,
+        "region": region,
+        "favored": attention >= threshold * attention.mean() if n else np.zeros(0, dtype=bool),
+        "region_mean": region_mean,
+        "region_count": region_count,
+        "source": "measured"
+    }
+
+
+def spans_from_token_counts(items: List[tuple]) -> List[Dict]:
+    """
+    Turn (span_id, token_count) pairs, in context order, into token spans.
+    
+    Token counts must come from the same tokenizer as the attention dump.
+    """
+    spans = []
+    start = 0
+    for span_id, count in items:
+        spans.append({"id": span_id, "start": start, "end": start + count})
+        start += count
+    return spans
+
+
+def attention_by_span(profile: Dict, spans: List[Dict]) -> List[Dict]:
+    """
+    Map a per-position attention profile back onto message or section spans.
+    
+    Each span is {"id", "start", "end"} in token positions (end exclusive).
+    Returns mean attention and the fraction of degraded positions per span,
+    computed from prefix sums in O(n + number of spans).
+    """
+    n = profile["n"]
+    attention_cumsum = np.concatenate(([0.0], np.cumsum(profile["attention"])))
+    degraded_cumsum = np.concatenate(([0], np.cumsum(~profile["favored"])))
+    
+    results = []
+    for span in spans:
+        start = min(max(span["start"], 0), n)
+        end = min(max(span["end"], start), n)
+        length = end - start
+        degraded = int(degraded_cumsum[end] - degraded_cumsum[start])
+        results.append({
+            "id": span["id"],
+            "start": start,
+            "end": end,
+            "mean_attention": float(attention_cumsum[end] - attention_cumsum[start]) / length if length else 0.0,
+            "degraded_fraction": degraded / length if length else 0.0,
+            "at_risk": bool(length) and degraded / length > 0.5
+        })
+    return results
 
 
 # Lost-in-Middle Detection
 
 def detect_lost_in_middle(critical_positions: List[int], 
-                          attention_distribution: List[Dict]) -> Dict:
+                          attention_distribution: Union[List[Dict], Dict]) -> Dict:
     """
     Check if critical information is in attention-degraded positions.
     
+    Accepts either the per-position list from measure_attention_distribution
+    or the array profile from measure_attention_profile. A profile without a
+    "favored" array is classified from its length "n" alone.
+    
     Returns detection results and recommendations.
     """
     results = {
@@ -89,17 +257,28 @@ def detect_lost_in_middle(critical_positions: List[int],
         "degradation_score": 0.0
     }
     
-    at_risk_count = 0
     total_critical = len(critical_positions)
     
-    for pos in critical_positions:
-        if pos < len(attention_distribution):
-            region = attention_distribution[pos]["region"]
-            if region == "attention_degraded":
-                results["at_risk"].append(pos)
-                at_risk_count += 1
-            else:
-                results["safe"].append(pos)
+    if isinstance(attention_distribution, dict):
+        # Array profile from measure_attention_profile
+        positions = np.asarray(critical_positions, dtype=np.int64)
+        positions = positions[(positions >= 0) & (positions < attention_distribution["n"])]
+        if "favored" in attention_distribution:
+            favored = attention_distribution["favored"][positions]
+        else:
+            favored = classify_positions(positions, attention_distribution["n"]) != 1
+        results["at_risk"] = positions[~favored].tolist()
+        results["safe"] = positions[favored].tolist()
+    else:
+        for pos in critical_positions:
+            if pos < len(attention_distribution):
+                region = attention_distribution[pos]["region"]
+                if region == "attention_degraded":
+                    results["at_risk"].append(pos)
+                else:
+                    results["safe"].append(pos)
+    
+    at_risk_count = len(results["at_risk"])
     
     # Calculate degradation score
     if total_critical > 0:
@@ -117,54 +296,671 @@ def detect_lost_in_middle(critical_positions: List[int],
     return results
 
 
-def analyze_context_structure(context: str) -> Dict:
+# Critical Information Placement
+
+def _attention_prefix(attention: Union[np.ndarray, Dict, None], total: int,
+                      seed: int) -> np.ndarray:
+    """Prefix sums of an attention curve resampled to `total` positions, normalized to 1."""
+    if attention is None:
+        curve = measure_attention_profile(total, seed)["attention"]
+    elif isinstance(attention, dict):
+        curve = np.asarray(attention["attention"], dtype=np.float64)
+    else:
+        curve = np.asarray(attention, dtype=np.float64)
+    
+    if total and len(curve) != total:
+        curve = np.interp(
+            np.linspace(0, len(curve) - 1, total), np.arange(len(curve)), curve
+        )
+    mass = curve.sum()
+    return np.concatenate(([0.0], np.cumsum(curve / mass if mass > 0 else curve)))
+
+
+def optimize_critical_placement(sections: List[Dict],
+                                attention: Union[np.ndarray, Dict, None] = None,
+                                constraints: List[tuple] = None,
+                                seed: int = 0, polish_passes: int = 2) -> Dict:
     """
-    Analyze context structure for degradation risk factors.
+    Order context sections so critical content lands where attention is high.
+    
+    Sections are {"id", "tokens", "criticality", "pin"?} where pin is "start"
+    or "end". `attention` is a per-position curve (array or profile dict, e.g.
+    from attention_profile_from_weights), resampled to the total token count;
+    by default the simulated curve is used. `constraints` are
+    (before_id, after_id) pairs that must keep their relative order.
+    
+    Sections are placed greedily from both ends of the context: the most
+    critical section that may go first (all predecessors placed) or last
+    (all successors placed) takes the better of those ends. A few passes of
+    adjacent swaps then polish the order. O(n log n + constraints), so
+    hundreds of sections are handled interactively.
+    
+    Returns the order, per-section spans and the criticality-weighted
+    attention share before and after reordering.
     """
-    lines = context.split('\n')
-    sections = []
-    
-    current_section = {"start": 0, "type": "unknown", "length": 0}
-    
-    for i, line in enumerate(lines):
-        # Detect section headers
-        if line.startswith('#'):
-            if current_section["length"] > 0:
-                sections.append(current_section)
-            current_section = {
-                "start": i,
-                "type": "header",
-                "length": 1,
-                "header": line.lstrip('#').strip()
-            }
+    ids = [section["id"] for section in sections]
+    index = {section_id: i for i, section_id in enumerate(ids)}
+    lengths = [int(section["tokens"]) for section in sections]
+    weights = [float(section.get("criticality", 0.0)) for section in sections]
+    n = len(sections)
+    total = sum(lengths)
+    prefix = _attention_prefix(attention, total, seed)
+    
+    # Precedence edges from explicit constraints. Pins go through two
+    # zero-length barrier nodes, n after every "start" pin and n + 1 before
+    # every "end" pin, so they add O(n) edges rather than O(n^2)
+    edges = {(index[a], index[b]) for a, b in (constraints or [])}
+    pins = [section.get("pin") for section in sections]
+    start_barrier, end_barrier = n, n + 1
+    for i, pin in enumerate(pins):
+        edges.add((i, start_barrier) if pin == "start" else (start_barrier, i))
+        edges.add((end_barrier, i) if pin == "end" else (i, end_barrier))
+    lengths += [0, 0]
+    # Barriers are taken as soon as they are free; they never reach the order
+    weights += [float("inf"), float("inf")]
+    successors = [[] for _ in range(n + 2)]
+    predecessors = [[] for _ in range(n + 2)]
+    for a, b in edges:
+        successors[a].append(b)
+        predecessors[b].append(a)
+    
+    indegree = [len(p) for p in predecessors]
+    outdegree = [len(s) for s in successors]
+    front = [(-weights[i], i) for i in range(n + 2) if indegree[i] == 0]
+    back = [(-weights[i], i) for i in range(n + 2) if outdegree[i] == 0]
+    heapq.heapify(front)
+    heapq.heapify(back)
+    
+    placed = [False] * (n + 2)
+    front_order, back_order = [], []
+    lo, hi = 0, total
+    
+    def mean_at(i: int, start: int) -> float:
+        return (prefix[start + lengths[i]] - prefix[start]) / lengths[i] if lengths[i] else 0.0
+    
+    for _ in range(n + 2):
+        while front and placed[front[0][1]]:
+            heapq.heappop(front)
+        while back and placed[back[0][1]]:
+            heapq.heappop(back)
+        if not front or not back:
+            raise ValueError("Placement constraints contain a cycle")
+        
+        first, last = front[0][1], back[0][1]
+        if weights[first] > weights[last]:
+            candidate, at_front = first, True
+        elif weights[last] > weights[first]:
+            candidate, at_front = last, False
+        else:
+            # Equal criticality: take whichever placement sees more attention
+            front_mean = mean_at(first, lo)
+            back_mean = mean_at(last, hi - lengths[last])
+            candidate, at_front = (first, True) if front_mean >= back_mean else (last, False)
+        
+        placed[candidate] = True
+        if at_front:
+            front_order.append(candidate)
+            lo += lengths[candidate]
+            for j in successors[candidate]:
+                indegree[j] -= 1
+                if indegree[j] == 0:
+                    heapq.heappush(front, (-weights[j], j))
         else:
-            current_section["length"] += 1
+            back_order.append(candidate)
+            hi -= lengths[candidate]
+            for j in predecessors[candidate]:
+                outdegree[j] -= 1
+                if outdegree[j] == 0:
+                    heapq.heappush(back, (-weights[j], j))
     
-    sections.append(current_section)
+    order = [i for i in front_order + back_order[::-1] if i < n]
+    tiers = [0 if pin == "start" else 2 if pin == "end" else 1 for pin in pins]
     
-    # Analyze section distribution
-    n = len(lines)
-    middle_start = int(n * 0.3)
-    middle_end = int(n * 0.7)
+    def share(start: int, length: int) -> float:
+        return prefix[start + length] - prefix[start]
     
-    middle_content = sum(
-        s["length"] for s in sections 
-        if s["start"] >= middle_start and s["start"] <= middle_end
-    )
+    # Adjacent swaps only ever conflict with a direct constraint edge or a pin
+    for _ in range(polish_passes):
+        improved = False
+        start = 0
+        for k in range(n - 1):
+            a, b = order[k], order[k + 1]
+            if (a, b) not in edges and tiers[a] == tiers[b]:
+                current = weights[a] * share(start, lengths[a]) + \
+                    weights[b] * share(start + lengths[a], lengths[b])
+                swapped = weights[b] * share(start, lengths[b]) + \
+                    weights[a] * share(start + lengths[b], lengths[a])
+                if swapped > current + 1e-12:
+                    order[k], order[k + 1] = b, a
+                    improved = True
+            start += lengths[order[k]]
+        if not improved:
+            break
+    
+    def weighted_share(sequence: List[int]) -> float:
+        start, value = 0, 0.0
+        for i in sequence:
+            value += weights[i] * share(start, lengths[i])
+            start += lengths[i]
+        return value
+    
+    spans = []
+    start = 0
+    for i in order:
+        end = start + lengths[i]
+        spans.append({
+            "id": ids[i],
+            "start": start,
+            "end": end,
+            "criticality": weights[i],
+            "attention_share": float(share(start, lengths[i])),
+            # Mean attention relative to the context average (1.0)
+            "relative_attention": float(mean_at(i, start)) * total
+        })
+        start = end
     
+    before = weighted_share(list(range(n)))
+    after = weighted_share(order)
     return {
-        "total_lines": n,
-        "sections": sections,
-        "middle_content_ratio": middle_content / n if n > 0 else 0,
-        "degradation_risk": "high" if middle_content / n > 0.5 else "medium" if middle_content / n > 0.3 else "low"
+        "order": [ids[i] for i in order],
+        "spans": spans,
+        "weighted_attention": float(after),
+        "original_weighted_attention": float(before),
+        "improvement": float(after - before)
     }
 
 
+class _StructureTracker:
+    """
+    Incremental line/section bookkeeping behind analyze_context_structure.
+    
+    Text can be fed in arbitrary chunks; only the trailing partial line is
+    buffered. Header lines are located with a multiline regex and lines are
+    counted with str.count, so the per-line work happens in C. Sections are
+    kept as compact arrays of (start line, header level), plus header text
+    only when keep_headers is set, so memory is O(number of sections).
+    """
+    
+    _HEADER = re.compile(r"^#[^\n]*", re.MULTILINE)
+    
+    def __init__(self, keep_headers: bool = True):
+        self.keep_headers = keep_headers
+        # Start line and '#' level of every header section, in order
+        self.header_starts = array("q")
+        self.header_levels = array("b")
+        self.headers: List[str] = []
+        self.completed_lines = 0
+        self.partial_line = ""
+    
+    def _add_header(self, line: str, index: int):
+        self.header_starts.append(index)
+        self.header_levels.append(min(len(line) - len(line.lstrip('#')), 127))
+        if self.keep_headers:
+            self.headers.append(line.lstrip('#').strip())
+    
+    def feed(self, text: str):
+        buffer = self.partial_line + text
+        cut = buffer.rfind('\n') + 1
+        complete, self.partial_line = buffer[:cut], buffer[cut:]
+        
+        line = self.completed_lines
+        position = 0
+        for match in self._HEADER.finditer(complete):
+            line += complete.count('\n', position, match.start())
+            position = match.start()
+            self._add_header(match.group(), line)
+        self.completed_lines += complete.count('\n')
+    
+    def section_count(self) -> int:
+        has_leading = not self.header_starts or self.header_starts[0] > 0
+        return len(self.header_starts) + (1 if has_leading else 0)
+    
+    def result(self, include_sections: bool = True) -> Dict:
+        # The trailing partial line counts as a line, as in str.split
+        n = self.completed_lines + 1
+        starts = list(self.header_starts)
+        levels = list(self.header_levels)
+        headers = list(self.headers)
+        if self.partial_line.startswith('#'):
+            starts.append(self.completed_lines)
+            levels.append(len(self.partial_line) - len(self.partial_line.lstrip('#')))
+            headers.append(self.partial_line.lstrip('#').strip())
+        
+        # Content before the first header forms an untitled section
+        leading = starts[0] if starts else n
+        bounds = starts + [n]
+        lengths = [bounds[i + 1] - bounds[i] for i in range(len(starts))]
+        
+        middle_start = int(n * 0.3)
+        middle_end = int(n * 0.7)
+        middle_content = sum(
+            length for start, length in zip(starts, lengths)
+            if middle_start <= start <= middle_end
+        )
+        if middle_start == 0 and (leading > 0 or not starts):
+            middle_content += leading
+        
+        result = {
+            "total_lines": n,
+            "middle_content_ratio": middle_content / n if n > 0 else 0,
+            "degradation_risk": "high" if middle_content / n > 0.5 else "medium" if middle_content / n > 0.3 else "low",
+            "section_count": len(starts) + (1 if leading > 0 or not starts else 0),
+            "header_stats": {
+                "headers": len(starts),
+                "levels": {level: levels.count(level) for level in sorted(set(levels))},
+                "mean_section_lines": sum(lengths) / len(lengths) if lengths else 0,
+                "max_section_lines": max(lengths) if lengths else 0
+            }
+        }
+        
+        if include_sections:
+            sections = []
+            if leading > 0 or not starts:
+                sections.append({"start": 0, "type": "unknown", "length": leading})
+            for i, (start, length) in enumerate(zip(starts, lengths)):
+                section = {"start": start, "type": "header", "length": length}
+                if self.keep_headers:
+                    section["header"] = headers[i]
+                sections.append(section)
+            result["sections"] = sections
+        
+        return result
+
+
+def analyze_context_structure(context: str) -> Dict:
+    """
+    Analyze context structure for degradation risk factors.
+    """
+    tracker = _StructureTracker()
+    tracker.feed(context)
+    return tracker.result()
+
+
+def analyze_context_structure_stream(source, chunk_size: int = 1 << 20,
+                                     include_sections: bool = False) -> Dict:
+    """
+    Analyze the structure of a context too large to hold in memory.
+    
+    `source` is a file-like object (text or binary, read in chunk_size
+    pieces) or an iterable of str/bytes chunks. Section boundaries, the
+    middle-region ratio and header statistics are computed in one pass with
+    O(number of sections) memory. Per-section dicts are only built when
+    include_sections is set.
+    """
+    tracker = _StructureTracker(keep_headers=include_sections)
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    
+    if hasattr(source, "read"):
+        chunks = iter(lambda: source.read(chunk_size), source.read(0))
+    else:
+        chunks = source
+    
+    for chunk in chunks:
+        tracker.feed(decoder.decode(chunk) if isinstance(chunk, bytes) else chunk)
+    tracker.feed(decoder.decode(b"", final=True))
+    
+    return tracker.result(include_sections)
+
+
 # Context Poisoning Detection
 
+_REGEX_METACHARACTERS = set(".^$*+?{}[]|()")
+
+# Non-ASCII characters that re.IGNORECASE matches to an ASCII letter although
+# lower() does not map them to it ("\u0130" even lowers to two characters)
+_ASCII_CASE_FOLDS = str.maketrans({"\u0130": "i", "\u0131": "i", "\u017f": "s"})
+
+
+def _fold_case(text: str) -> str:
+    """Lowercase text like re.IGNORECASE does for ASCII patterns, keeping every offset."""
+    if text.isascii():
+        return text.lower()
+    return text.translate(_ASCII_CASE_FOLDS).lower()
+
+
+def _regex_literal(pattern: str) -> Optional[str]:
+    """Return the literal text a regex matches, or None if it uses regex syntax."""
+    chars = []
+    i = 0
+    while i < len(pattern):
+        ch = pattern[i]
+        if ch == "\\":
+            if i + 1 < len(pattern) and not pattern[i + 1].isalnum():
+                chars.append(pattern[i + 1])
+                i += 2
+                continue
+            return None
+        if ch in _REGEX_METACHARACTERS:
+            return None
+        chars.append(ch)
+        i += 1
+    return "".join(chars)
+
+
+def _trie_regex(literals: List[str]) -> str:
+    """Build a prefix-factored alternation that matches any of the literals."""
+    trie: Dict = {}
+    for literal in literals:
+        node = trie
+        for ch in literal:
+            node = node.setdefault(ch, {})
+        node[""] = True
+    
+    def build(node: Dict) -> str:
+        branches = [re.escape(ch) + build(child) for ch, child in sorted(node.items()) if ch]
+        if not branches:
+            return ""
+        body = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        # Prefer the longer literal when a shorter one ends here
+        return f"(?:{body})?" if "" in node else body
+    
+    return build(trie)
+
+
+class MarkerScanner:
+    """
+    Single-pass scanner for error, conflict and hallucination markers.
+    
+    ASCII literal patterns (all the defaults) are compiled into one
+    prefix-factored regex that runs once over the case-folded text (same
+    length as the original, so offsets line up), inside a lookahead so
+    overlapping markers are all found. The automaton reports the longest
+    literal at each offset; literals that are prefixes of it (e.g. 'fail'
+    of 'failed') are reported with it. Sentence boundaries ('.') are part
+    of the same automaton, so every hit carries its sentence without a
+    second pass. Patterns that use regex syntax are scanned separately.
+    """
+    
+    def __init__(self, error_patterns: List[str], conflict_patterns: List[tuple],
+                 hallucination_markers: List[str]):
+        self.error_patterns = list(error_patterns)
+        self.conflict_patterns = list(conflict_patterns)
+        self.markers = list(hallucination_markers)
+        
+        # (kind, pattern index, regex); hallucination markers are plain strings
+        entries = [("error", i, p) for i, p in enumerate(self.error_patterns)]
+        for i, (p1, p2) in enumerate(self.conflict_patterns):
+            entries.append(("conflict", (i, 0), p1))
+            entries.append(("conflict", (i, 1), p2))
+        entries.extend(
+            ("hallucination", i, re.escape(m)) for i, m in enumerate(self.markers)
+        )
+        
+        # lowercased literal -> roles it plays; "." marks sentence ends
+        self.literal_roles: Dict[str, List[tuple]] = {".": []}
+        self.regex_entries = []
+        for kind, index, pattern in entries:
+            literal = _regex_literal(pattern)
+            if literal and literal.isascii():
+                self.literal_roles.setdefault(literal.lower(), []).append((kind, index))
+            else:
+                self.regex_entries.append(
+                    (kind, index, re.compile(pattern, re.IGNORECASE))
+                )
+        
+        # literal -> (length, kind, index) for it and every literal that is a prefix of it
+        self.match_roles: Dict[str, List[tuple]] = {
+            literal: [
+                (length, kind, index)
+                for length in range(1, len(literal) + 1)
+                for kind, index in self.literal_roles.get(literal[:length], ())
+            ]
+            for literal in self.literal_roles
+        }
+        self.automaton = re.compile(f"(?=({_trie_regex(list(self.literal_roles))}))")
+    
+    def scan(self, text: str) -> Dict:
+        """
+        Find every marker in one pass.
+        
+        Returns:
+            hits: list of (offset, sentence_index, kind, pattern_index)
+            sentence_ends: offsets of the '.' that ends each sentence
+        """
+        folded = _fold_case(text)
+        verify = not text.isascii()
+        hits = []
+        sentence_ends = []
+        roles = self.match_roles
+        
+        for match in self.automaton.finditer(folded):
+            literal = match.group(1)
+            offset = match.start()
+            for length, kind, index in roles[literal]:
+                # Hallucination markers follow str.lower(), which folds fewer characters
+                if verify and kind == "hallucination" and \
+                        not text[offset:offset + length].lower().startswith(literal[:length]):
+                    continue
+                hits.append((offset, len(sentence_ends), kind, index))
+            if literal[0] == ".":
+                sentence_ends.append(offset)
+        
+        if self.regex_entries:
+            for kind, index, regex in self.regex_entries:
+                for match in regex.finditer(text):
+                    offset = match.start()
+                    hits.append((offset, bisect_right(sentence_ends, offset - 1), kind, index))
+            hits.sort(key=lambda h: h[0])
+        
+        return {"hits": hits, "sentence_ends": sentence_ends, "text": text}
+    
+    @staticmethod
+    def sentence(scan: Dict, index: int) -> str:
+        """Text of the index-th '.'-delimited sentence of a scanned text."""
+        ends = scan["sentence_ends"]
+        start = ends[index - 1] + 1 if index > 0 else 0
+        end = ends[index] if index < len(ends) else len(scan["text"])
+        return scan["text"][start:end]
+    
+    def error_count(self, scan: Dict) -> int:
+        """Number of distinct error patterns present."""
+        return len({index for _, _, kind, index in scan["hits"] if kind == "error"})
+    
+    def contradictions(self, scan: Dict, limit: int = 5) -> List[str]:
+        """Sentences containing conflict markers, for pairs present in the text."""
+        present = set()
+        sentences_by_pair: Dict[int, List[int]] = {}
+        for _, sentence, kind, index in scan["hits"]:
+            if kind != "conflict":
+                continue
+            pair, _ = index
+            present.add(index)
+            pair_sentences = sentences_by_pair.setdefault(pair, [])
+            if not pair_sentences or pair_sentences[-1] != sentence:
+                pair_sentences.append(sentence)
+        
+        contradictions = []
+        for pair in range(len(self.conflict_patterns)):
+            if (pair, 0) not in present or (pair, 1) not in present:
+                continue
+            for index in sentences_by_pair[pair]:
+                sentence = self.sentence(scan, index).strip()
+                if sentence and len(sentence) < 200:
+                    contradictions.append(sentence[:100])
+                    if len(contradictions) >= limit:
+                        return contradictions
+        return contradictions
+    
+    def hallucination_markers(self, scan: Dict) -> List[str]:
+        """Hallucination markers present, in marker-list order."""
+        found = {index for _, _, kind, index in scan["hits"] if kind == "hallucination"}
+        return [m for i, m in enumerate(self.markers) if i in found]
+
+
+@lru_cache(maxsize=32)
+def _cached_scanner(error_patterns: tuple, conflict_patterns: tuple,
+                    hallucination_markers: tuple) -> MarkerScanner:
+    return MarkerScanner(list(error_patterns), list(conflict_patterns),
+                         list(hallucination_markers))
+
+
+_NEGATIONS = {"not", "no", "never", "none", "nothing", "neither", "nor"}
+_NEGATED_CONTRACTIONS = {"can't": "can", "cannot": "can", "won't": "will", "shan't": "shall"}
+
+
+def normalize_claim(text: str) -> tuple:
+    """
+    Normalize a claim into (polarity-free tokens, negated).
+    
+    Negation words are removed from the token list and folded into a single
+    polarity flag, so "the build is not green" and "the build is green"
+    normalize to the same tokens with opposite polarity.
+    """
+    tokens = []
+    negations = 0
+    for token in re.findall(r"[a-z0-9']+", text.lower()):
+        if token in _NEGATIONS:
+            negations += 1
+        elif token in _NEGATED_CONTRACTIONS:
+            negations += 1
+            tokens.append(_NEGATED_CONTRACTIONS[token])
+        elif token.endswith("n't"):
+            negations += 1
+            tokens.append(token[:-3])
+        else:
+            tokens.append(token.strip("'"))
+    return tuple(t for t in tokens if t), negations % 2 == 1
+
+
+class ClaimIndex:
+    """
+    Index of claims for duplicate and contradiction lookup.
+    
+    - Exact duplicates: hash of the normalized claim (tokens + polarity)
+    - Near duplicates: MinHash signatures over word unigrams/bigrams,
+      bucketed with LSH banding
+    - Contradictions: near-identical polarity-free claims whose polarity
+      differs ("X is ready" vs "X is not ready")
+    
+    Adding a claim costs a signature plus a few bucket lookups, so checking
+    a new turn is proportional to its own claims, not the history.
+    """
+    
+    _PRIME = (1 << 31) - 1
+    
+    def __init__(self, num_perm: int = 64, bands: int = 16,
+                 threshold: float = 0.7, max_bucket_size: int = 64, seed: int = 1):
+        if num_perm % bands:
+            raise ValueError("num_perm must be divisible by bands")
+        
+        rng = np.random.default_rng(seed)
+        self._a = rng.integers(1, self._PRIME, num_perm, dtype=np.uint64)
+        self._b = rng.integers(0, self._PRIME, num_perm, dtype=np.uint64)
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.threshold = threshold
+        self.max_bucket_size = max_bucket_size
+        
+        self.claims: List[Dict] = []
+        self.signatures: List[np.ndarray] = []
+        self.exact: Dict[str, int] = {}
+        self.buckets: List[Dict[bytes, List[int]]] = [{} for _ in range(bands)]
+    
+    def _signature(self, tokens: tuple) -> np.ndarray:
+        shingles = set(tokens) | {f"{a} {b}" for a, b in zip(tokens, tokens[1:])}
+        hashes = np.fromiter(
+            (zlib.crc32(s.encode()) for s in shingles), dtype=np.uint64, count=len(shingles)
+        )
+        permuted = (np.outer(hashes, self._a) + self._b) % self._PRIME
+        return permuted.min(axis=0)
+    
+    def _band_keys(self, signature: np.ndarray) -> List[bytes]:
+        return [
+            signature[i * self.rows:(i + 1) * self.rows].tobytes()
+            for i in range(self.bands)
+        ]
+    
+    def add(self, text: str, source: str = None) -> Dict:
+        """
+        Add a claim and report what it duplicates or contradicts.
+        
+        Returns the stored claim record with duplicate_of, near_duplicates
+        and contradicts (lists of (claim_id, similarity)).
+        """
+        tokens, negated = normalize_claim(text)
+        key = hashlib.sha1(
+            (("!" if negated else "") + " ".join(tokens)).encode()
+        ).hexdigest()
+        
+        record = {
+            "claim_id": len(self.claims),
+            "text": text,
+            "source": source,
+            "negated": negated,
+            "duplicate_of": self.exact.get(key),
+            "near_duplicates": [],
+            "contradicts": []
+        }
+        
+        if not tokens:
+            self.claims.append(record)
+            self.signatures.append(None)
+            return record
+        
+        signature = self._signature(tokens)
+        band_keys = self._band_keys(signature)
+        
+        candidates = set()
+        for band, band_key in zip(self.buckets, band_keys):
+            candidates.update(band.get(band_key, ()))
+        
+        for claim_id in sorted(candidates):
+            if claim_id == record["duplicate_of"]:
+                continue
+            similarity = float(np.mean(self.signatures[claim_id] == signature))
+            if similarity < self.threshold:
+                continue
+            if self.claims[claim_id]["negated"] == negated:
+                record["near_duplicates"].append((claim_id, similarity))
+            else:
+                record["contradicts"].append((claim_id, similarity))
+        
+        self.claims.append(record)
+        self.signatures.append(signature)
+        if record["duplicate_of"] is None:
+            self.exact[key] = record["claim_id"]
+            # Exact duplicates are reachable through their original
+            for band, band_key in zip(self.buckets, band_keys):
+                bucket = band.setdefault(band_key, [])
+                if len(bucket) < self.max_bucket_size:
+                    bucket.append(record["claim_id"])
+        
+        return record
+    
+    def contradictions(self) -> List[tuple]:
+        """All (claim_id, other_claim_id, similarity) contradiction pairs found so far."""
+        return [
+            (claim["claim_id"], other, similarity)
+            for claim in self.claims
+            for other, similarity in claim["contradicts"]
+        ]
+
+
 class PoisoningDetector:
+    # Conflict markers; a pair is reported when both occur in the context
+    CONFLICT_PATTERNS = [
+        (r"however", r"but"),
+        (r"on the other hand", r"instead"),
+        (r"although", r"yet"),
+        (r"despite", r"nevertheless")
+    ]
+    
+    HALLUCINATION_MARKERS = [
+        "may have been",
+        "might have",
+        "could potentially",
+        "possibly",
+        "apparently",
+        "reportedly",
+        "it is said that",
+        "sources suggest",
+        "believed to be",
+        "thought to be"
+    ]
+    
     def __init__(self):
         self.claims = []
+        self.claim_index = ClaimIndex()
         self.error_patterns = [
             r"error",
             r"failed",
@@ -175,8 +971,13 @@ class PoisoningDetector:
             r"not found"
         ]
     
-    def extract_claims(self, text: str) -> List[Dict]:
-        """Extract claims from text for verification tracking."""
+    def extract_claims(self, text: str, source: str = None) -> List[Dict]:
+        """
+        Extract claims from text for verification tracking.
+        
+        Each claim is checked against the claim index; only claims that are
+        not exact duplicates of earlier ones are added to self.claims.
+        """
         # Simple claim extraction - in production use NER and fact extraction
         sentences = text.split('.')
         claims = []
@@ -186,30 +987,52 @@ class PoisoningDetector:
             if len(sentence) < 10:
                 continue
             
+            indexed = self.claim_index.add(sentence, source)
             claims.append({
                 "id": i,
+                "claim_id": indexed["claim_id"],
                 "text": sentence,
                 "verified": None,
                 "has_error_indicator": any(
                     re.search(pattern, sentence, re.IGNORECASE) 
                     for pattern in self.error_patterns
-                )
+                ),
+                "duplicate_of": indexed["duplicate_of"],
+                "near_duplicates": indexed["near_duplicates"],
+                "contradicts": indexed["contradicts"]
             })
         
-        self.claims.extend(claims)
+        self.claims.extend(c for c in claims if c["duplicate_of"] is None)
         return claims
     
+    def scanner(self) -> MarkerScanner:
+        """Marker scanner for the current patterns (compiled once per pattern set)."""
+        return _cached_scanner(
+            tuple(self.error_patterns),
+            tuple(self.CONFLICT_PATTERNS),
+            tuple(self.HALLUCINATION_MARKERS)
+        )
+    
     def detect_poisoning(self, context: str) -> Dict:
         """
         Detect potential context poisoning indicators.
+        
+        All markers are found in a single pass over the context.
         """
-        indicators = []
+        scanner = self.scanner()
+        scan = scanner.scan(context)
         
-        # Check for error accumulation
-        error_count = sum(
-            1 for pattern in self.error_patterns 
-            if re.search(pattern, context, re.IGNORECASE)
+        return self.build_report(
+            scanner.error_count(scan),
+            scanner.contradictions(scan),
+            scanner.hallucination_markers(scan)
         )
+    
+    @staticmethod
+    def build_report(error_count: int, contradictions: List[str],
+                     hallucination_markers: List[str]) -> Dict:
+        """Turn raw poisoning signals into indicators and an overall risk."""
+        indicators = []
         
         if error_count > 3:
             indicators.append({
@@ -220,7 +1043,6 @@ class PoisoningDetector:
             })
         
         # Check for contradiction patterns
-        contradictions = self._detect_contradictions(context)
         if contradictions:
             indicators.append({
                 "type": "contradictions",
@@ -231,7 +1053,6 @@ class PoisoningDetector:
             })
         
         # Check for hallucination markers
-        hallucination_markers = self._detect_hallucination_markers(context)
         if hallucination_markers:
             indicators.append({
                 "type": "hallucination_markers",
@@ -248,82 +1069,63 @@ class PoisoningDetector:
     
     def _detect_contradictions(self, text: str) -> List[str]:
         """Detect potential contradictions in text."""
-        contradictions = []
-        
-        # Look for conflict markers
-        conflict_patterns = [
-            (r"however", r"but"),
-            (r"on the other hand", r"instead"),
-            (r"although", r"yet"),
-            (r"despite", r"nevertheless")
-        ]
-        
-        for pattern1, pattern2 in conflict_patterns:
-            if re.search(pattern1, text, re.IGNORECASE) and re.search(pattern2, text, re.IGNORECASE):
-                # Find sentences containing these patterns
-                sentences = text.split('.')
-                for sentence in sentences:
-                    if re.search(pattern1, sentence, re.IGNORECASE) or \
-                       re.search(pattern2, sentence, re.IGNORECASE):
-                        if sentence.strip() and len(sentence.strip()) < 200:
-                            contradictions.append(sentence.strip()[:100])
-        
-        return contradictions[:5]
+        scanner = self.scanner()
+        return scanner.contradictions(scanner.scan(text))
     
     def _detect_hallucination_markers(self, text: str) -> List[str]:
         """Detect phrases associated with uncertain or hallucinated claims."""
-        markers = [
-            "may have been",
-            "might have",
-            "could potentially",
-            "possibly",
-            "apparently",
-            "reportedly",
-            "it is said that",
-            "sources suggest",
-            "believed to be",
-            "thought to be"
-        ]
-        
-        found = []
-        for marker in markers:
-            if marker in text.lower():
-                found.append(marker)
-        
-        return found
+        scanner = self.scanner()
+        return scanner.hallucination_markers(scanner.scan(text))
 
 
 # Context Health Score
 
 class ContextHealthAnalyzer:
-    def __init__(self, context_limit: int = 100000):
+    def __init__(self, context_limit: int = 100000,
+                 trend_tracker: "HealthTrendTracker" = None,
+                 session_id: str = "default"):
         self.context_limit = context_limit
         self.metrics_history = []
+        # Optional per-session time series (see HealthTrendTracker)
+        self.trend_tracker = trend_tracker
+        self.session_id = session_id
     
-    def analyze(self, context: str, critical_positions: List[int] = None) -> Dict:
+    def analyze(self, context: str, critical_positions: List[int] = None,
+                attention_profile: Dict = None) -> Dict:
         """
         Perform comprehensive context health analysis.
+        
+        Pass attention_profile (e.g. from attention_profile_from_weights) to
+        score against measured attention instead of the simulated curve;
+        critical positions are then in that profile's token positions.
         """
         tokens = context.split()
         
-        # Basic metrics
         token_count = len(tokens)
-        utilization = token_count / self.context_limit
         
-        # Attention analysis
-        attention_dist = measure_attention_distribution(
-            tokens[:1000],  # Sample for efficiency
-            "current_task"
-        )
+        # Attention analysis over the full context
+        if attention_profile is None:
+            attention_profile = measure_attention_profile(token_count)
         
         degradation = detect_lost_in_middle(
             critical_positions or list(range(10)),
-            attention_dist
+            attention_profile
         )
         
         # Poisoning check
         poisoning = PoisoningDetector().detect_poisoning(context)
         
+        result = self._build_result(token_count, degradation, poisoning)
+        self.metrics_history.append(result)
+        if self.trend_tracker is not None:
+            result["trend_alerts"] = self.trend_tracker.record(self.session_id, result)
+        return result
+    
+    def _build_result(self, token_count: int, degradation: Dict,
+                      poisoning: Dict) -> Dict:
+        """Combine component analyses into the health report."""
+        utilization = token_count / self.context_limit
+        
         # Calculate health score
         health_score = self._calculate_health_score(
             utilization=utilization,
@@ -348,8 +1150,6 @@ class ContextHealthAnalyzer:
                 utilization, degradation, poisoning
             )
         }
-        
-        self.metrics_history.append(result)
         return result
     
     def _calculate_health_score(self, utilization: float, 
@@ -399,6 +1199,453 @@ class ContextHealthAnalyzer:
         return recommendations
 
 
+class IncrementalContextHealthAnalyzer(ContextHealthAnalyzer):
+    """
+    Stateful health analyzer for append-only agent transcripts.
+    
+    `append` takes only the newly added text and updates token counts,
+    poisoning signals and section structure incrementally, so the cost of
+    each call is proportional to the appended text rather than the whole
+    transcript. Compact metric snapshots are kept in a bounded ring buffer.
+    """
+    
+    def __init__(self, context_limit: int = 100000, history_size: int = 256,
+                 trend_tracker: "HealthTrendTracker" = None,
+                 session_id: str = "default"):
+        super().__init__(context_limit, trend_tracker, session_id)
+        self.metrics_history = deque(maxlen=history_size)
+        
+        detector = PoisoningDetector()
+        self._scanner = detector.scanner()
+        # Enough trailing characters to catch a pattern split across appends
+        self._overlap = max(
+            len(p) for p in detector.error_patterns + detector.HALLUCINATION_MARKERS
+            + [p for pair in detector.CONFLICT_PATTERNS for p in pair]
+        ) - 1
+        self.reset()
+    
+    def reset(self):
+        """Forget the transcript (snapshots in metrics_history are kept)."""
+        self.token_count = 0
+        self.turns = 0
+        self.structure = _StructureTracker()
+        self._ends_in_token = False
+        self._tail = ""
+        self._partial_sentence = ""
+        # Pattern indices (as reported by MarkerScanner) seen so far, by kind
+        self._seen = {"error": set(), "conflict": set(), "hallucination": set()}
+        # Up to 5 example sentences per conflict pair, in transcript order
+        self._conflict_sentences: List[List[str]] = [
+            [] for _ in self._scanner.conflict_patterns
+        ]
+    
+    def _count_tokens(self, text: str) -> int:
+        count = len(text.split())
+        # A token split across two appends was already counted once
+        if self._ends_in_token and not text[0].isspace() and count:
+            count -= 1
+        self._ends_in_token = not text[-1].isspace()
+        return count
+    
+    def _scan_patterns(self, text: str):
+        window = self._tail + text
+        for _, _, kind, index in self._scanner.scan(window)["hits"]:
+            self._seen[kind].add(index)
+        self._tail = window[-self._overlap:]
+    
+    def _conflict_examples(self, sentence: str) -> List[int]:
+        """Indices of conflict pairs whose pattern appears in sentence."""
+        stripped = sentence.strip()
+        if not stripped or len(stripped) >= 200:
+            return []
+        return sorted({
+            index[0] for _, _, kind, index in self._scanner.scan(sentence)["hits"]
+            if kind == "conflict"
+        })
+    
+    def _scan_sentences(self, text: str):
+        sentences = (self._partial_sentence + text).split('.')
+        self._partial_sentence = sentences.pop()
+        for sentence in sentences:
+            for i in self._conflict_examples(sentence):
+                if len(self._conflict_sentences[i]) < 5:
+                    self._conflict_sentences[i].append(sentence.strip()[:100])
+    
+    def _poisoning(self) -> Dict:
+        contradictions = []
+        pending = self._conflict_examples(self._partial_sentence)
+        conflicts_seen = self._seen["conflict"]
+        for i in range(len(self._conflict_sentences)):
+            if (i, 0) in conflicts_seen and (i, 1) in conflicts_seen:
+                contradictions.extend(self._conflict_sentences[i])
+                if i in pending:
+                    contradictions.append(self._partial_sentence.strip()[:100])
+        
+        return PoisoningDetector.build_report(
+            len(self._seen["error"]),
+            contradictions[:5],
+            [m for i, m in enumerate(self._scanner.markers) if i in self._seen["hallucination"]]
+        )
+    
+    def append(self, text: str, critical_positions: List[int] = None) -> Dict:
+        """
+        Add newly appended transcript text and return the updated health report.
+        """
+        if text:
+            self.token_count += self._count_tokens(text)
+            self._scan_patterns(text)
+            self._scan_sentences(text)
+            self.structure.feed(text)
+        self.turns += 1
+        
+        degradation = detect_lost_in_middle(
+            critical_positions or list(range(10)),
+            {"n": self.token_count}
+        )
+        poisoning = self._poisoning()
+        result = self._build_result(self.token_count, degradation, poisoning)
+        
+        self.metrics_history.append({
+            "turn": self.turns,
+            "timestamp": time.time(),
+            "token_count": self.token_count,
+            "utilization": result["metrics"]["utilization"],
+            "health_score": result["health_score"],
+            "degradation_score": degradation["degradation_score"],
+            "poisoning_indicators": len(poisoning["indicators"]),
+            "sections": self.structure.section_count()
+        })
+        if self.trend_tracker is not None:
+            result["trend_alerts"] = self.trend_tracker.record(
+                self.session_id, self.metrics_history[-1]
+            )
+        return result
+    
+    def structure_report(self) -> Dict:
+        """Section structure of the transcript so far (see analyze_context_structure)."""
+        return self.structure.result()
+
+
+# Health Trends
+
+TREND_METRICS = ("utilization", "health_score", "degradation_score", "poisoning_indicators")
+
+DEFAULT_TREND_RULES = [
+    {"metric": "health_score", "falling": 0.05, "label": "health"},
+    {"metric": "utilization", "rising": 0.05, "label": "utilization"},
+    {"metric": "health_score", "ewma_below": 0.5, "label": "health"}
+]
+
+
+def _trend_metrics(result: Dict) -> List[float]:
+    """Metric vector from an analyze() result or an incremental snapshot."""
+    if "metrics" in result:
+        return [
+            result["metrics"]["utilization"],
+            result["health_score"],
+            result["metrics"]["degradation_score"],
+            len(result["issues"]["poisoning"]["indicators"])
+        ]
+    return [result[name] for name in TREND_METRICS]
+
+
+class _TrendSeries:
+    """Fixed-size ring buffers and running sums for one session."""
+    
+    def __init__(self, capacity: int, width: int):
+        self.values = np.zeros((capacity, width))
+        self.turns = np.zeros(capacity, dtype=np.int64)
+        self.timestamps = np.zeros(capacity)
+        self.count = 0
+        self.ewma = np.zeros(width)
+        # Least-squares sums over the slope window; x is the record number
+        self.sx = 0.0
+        self.sxx = 0.0
+        self.sy = np.zeros(width)
+        self.sxy = np.zeros(width)
+
+
+class HealthTrendTracker:
+    """
+    Compact per-session time series of context health metrics.
+    
+    Each session keeps the last `capacity` records in NumPy ring buffers.
+    EWMA and least-squares slope over the last `window` records are
+    maintained with running sums, so `record` is O(1) regardless of
+    history length. Rules raise alerts such as "health dropping 6.2%/turn".
+    """
+    
+    def __init__(self, capacity: int = 512, window: int = 10, alpha: float = 0.3,
+                 rules: List[Dict] = None, min_points: int = 3):
+        if not 2 <= window <= capacity:
+            raise ValueError("window must be between 2 and capacity")
+        self.capacity = capacity
+        self.window = window
+        self.alpha = alpha
+        self.rules = DEFAULT_TREND_RULES if rules is None else rules
+        self.min_points = min_points
+        self.series: Dict[str, _TrendSeries] = {}
+        self._columns = {name: i for i, name in enumerate(TREND_METRICS)}
+    
+    def record(self, session_id: str, result: Dict, turn: int = None,
+               timestamp: float = None) -> List[Dict]:
+        """Add one health result for a session and return any alerts it triggers."""
+        series = self.series.get(session_id)
+        if series is None:
+            series = self.series[session_id] = _TrendSeries(self.capacity, len(TREND_METRICS))
+        
+        y = np.asarray(_trend_metrics(result), dtype=float)
+        k = series.count
+        slot = k % self.capacity
+        
+        # Drop the record leaving the slope window before it can be overwritten
+        if k >= self.window:
+            old = (k - self.window) % self.capacity
+            x_old = float(k - self.window)
+            series.sx -= x_old
+            series.sxx -= x_old * x_old
+            series.sy -= series.values[old]
+            series.sxy -= x_old * series.values[old]
+        
+        series.values[slot] = y
+        series.turns[slot] = result.get("turn", k + 1) if turn is None else turn
+        series.timestamps[slot] = (
+            result.get("timestamp", time.time()) if timestamp is None else timestamp
+        )
+        series.ewma = y if k == 0 else self.alpha * y + (1 - self.alpha) * series.ewma
+        series.sx += k
+        series.sxx += float(k) * k
+        series.sy += y
+        series.sxy += k * y
+        series.count += 1
+        
+        return self._check_rules(session_id, series)
+    
+    def _slopes(self, series: _TrendSeries) -> np.ndarray:
+        n = min(series.count, self.window)
+        denominator = n * series.sxx - series.sx * series.sx
+        if n < 2 or denominator == 0:
+            return np.zeros_like(series.sy)
+        return (n * series.sxy - series.sx * series.sy) / denominator
+    
+    def _check_rules(self, session_id: str, series: _TrendSeries) -> List[Dict]:
+        if series.count < self.min_points:
+            return []
+        slopes = self._slopes(series)
+        turn = int(series.turns[(series.count - 1) % self.capacity])
+        
+        alerts = []
+        for rule in self.rules:
+            column = self._columns[rule["metric"]]
+            slope, ewma = float(slopes[column]), float(series.ewma[column])
+            label = rule.get("label", rule["metric"])
+            
+            if "falling" in rule and slope <= -rule["falling"]:
+                message = f"{label} dropping {-slope * 100:.1f}%/turn"
+            elif "rising" in rule and slope >= rule["rising"]:
+                message = f"{label} rising {slope * 100:.1f}%/turn"
+            elif "ewma_below" in rule and ewma < rule["ewma_below"]:
+                message = f"{label} averaging {ewma:.2f} (below {rule['ewma_below']})"
+            elif "ewma_above" in rule and ewma > rule["ewma_above"]:
+                message = f"{label} averaging {ewma:.2f} (above {rule['ewma_above']})"
+            else:
+                continue
+            alerts.append({
+                "session_id": session_id,
+                "turn": turn,
+                "metric": rule["metric"],
+                "slope": slope,
+                "ewma": ewma,
+                "message": message
+            })
+        return alerts
+    
+    def trend(self, session_id: str) -> Dict:
+        """Current EWMA and per-turn slope of every metric for a session."""
+        series = self.series[session_id]
+        slopes = self._slopes(series)
+        return {
+            name: {"ewma": float(series.ewma[i]), "slope": float(slopes[i])}
+            for i, name in enumerate(TREND_METRICS)
+        }
+    
+    def history(self, session_id: str) -> Dict[str, np.ndarray]:
+        """Buffered records for a session as chronological column arrays."""
+        series = self.series[session_id]
+        n = min(series.count, self.capacity)
+        order = (np.arange(series.count - n, series.count)) % self.capacity
+        columns = {"turn": series.turns[order], "timestamp": series.timestamps[order]}
+        for i, name in enumerate(TREND_METRICS):
+            columns[name] = series.values[order, i]
+        return columns
+    
+    def export(self, path: str):
+        """
+        Write all buffered records to `path` for dashboards.
+        
+        A .npz path produces a compressed columnar file (one array per
+        column, with session ids as a string column); anything else is CSV.
+        """
+        sessions = list(self.series)
+        histories = [self.history(session_id) for session_id in sessions]
+        
+        if path.endswith(".npz"):
+            columns = {
+                "session_id": np.array([
+                    session_id for session_id, h in zip(sessions, histories)
+                    for _ in range(len(h["turn"]))
+                ], dtype=str)
+            }
+            for name in ("turn", "timestamp") + TREND_METRICS:
+                columns[name] = (
+                    np.concatenate([h[name] for h in histories]) if histories
+                    else np.zeros(0)
+                )
+            np.savez_compressed(path, **columns)
+            return
+        
+        with open(path, "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow(("session_id", "turn", "timestamp") + TREND_METRICS)
+            for session_id, h in zip(sessions, histories):
+                for i in range(len(h["turn"])):
+                    writer.writerow(
+                        [session_id, int(h["turn"][i]), f"{h['timestamp'][i]:.3f}"]
+                        + [f"{h[name][i]:.6g}" for name in TREND_METRICS]
+                    )
+
+
+# Batch Analysis
+
+CONTEXT_FILE_SUFFIXES = (".txt", ".md", ".log")
+
+
+def collect_context_jobs(source: str) -> List[tuple]:
+    """
+    List analysis jobs for a directory of context files or a JSONL file.
+    
+    JSONL lines are {"id": ..., "context": ...}. Jobs are
+    (job_id, path, offset, length) so workers read their own input and
+    nothing large is pickled between processes.
+    """
+    jobs = []
+    if os.path.isdir(source):
+        for root, _, files in os.walk(source):
+            for name in sorted(files):
+                if name.endswith(CONTEXT_FILE_SUFFIXES):
+                    path = os.path.join(root, name)
+                    jobs.append((os.path.relpath(path, source), path, 0, os.path.getsize(path)))
+    else:
+        with open(source, "rb") as f:
+            offset = 0
+            for line in f:
+                if line.strip():
+                    jobs.append((None, source, offset, len(line)))
+                offset += len(line)
+    return jobs
+
+
+def _read_job(job: tuple) -> tuple:
+    job_id, path, offset, length = job
+    with open(path, "rb") as f:
+        f.seek(offset)
+        data = f.read(length).decode("utf-8", errors="replace")
+    if job_id is not None:
+        return job_id, data
+    record = json.loads(data)
+    # Malformed records are reported per job instead of failing the whole pool
+    if not isinstance(record, dict):
+        raise ValueError(f"expected a JSON object, got {type(record).__name__}")
+    context = record.get("context", "")
+    if not isinstance(context, str):
+        raise ValueError(f"\"context\" must be a string, got {type(context).__name__}")
+    return str(record.get("id", f"{path}:{offset}")), context
+
+
+def _chunk_jobs(jobs: List[tuple], target_bytes: int) -> List[List[tuple]]:
+    """
+    Group jobs into chunks of roughly target_bytes, largest sessions first.
+    
+    Long sessions are dispatched early and alone so they don't end up as the
+    tail of the run; short ones are batched to amortize dispatch overhead.
+    """
+    chunks = []
+    current, current_bytes = [], 0
+    for job in sorted(jobs, key=lambda j: j[3], reverse=True):
+        if current and current_bytes + job[3] > target_bytes:
+            chunks.append(current)
+            current, current_bytes = [], 0
+        current.append(job)
+        current_bytes += job[3]
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def _analyze_chunk(args: tuple) -> List[Dict]:
+    chunk, context_limit = args
+    analyzer = ContextHealthAnalyzer(context_limit=context_limit)
+    results = []
+    for job in chunk:
+        try:
+            job_id, context = _read_job(job)
+            result = analyzer.analyze(context, list(range(5)))
+            analyzer.metrics_history.clear()
+            results.append({
+                "id": job_id,
+                "health_score": result["health_score"],
+                "status": result["status"],
+                "metrics": result["metrics"],
+                "poisoning_indicators": [
+                    i["type"] for i in result["issues"]["poisoning"]["indicators"]
+                ],
+                "recommendations": result["recommendations"]
+            })
+        except (OSError, ValueError) as e:
+            results.append({"id": job[0] or f"{job[1]}:{job[2]}", "error": str(e)})
+    return results
+
+
+def analyze_contexts_batch(source: str, output_path: str, workers: int = None,
+                           context_limit: int = 80000,
+                           chunk_bytes: int = 4_000_000) -> Dict:
+    """
+    Run ContextHealthAnalyzer over many sessions in a process pool.
+    
+    Results are streamed to output_path as JSONL in completion order.
+    Returns aggregate counts, a status histogram and a health-score histogram.
+    """
+    jobs = collect_context_jobs(source)
+    chunks = _chunk_jobs(jobs, chunk_bytes)
+    
+    status_counts = {"healthy": 0, "warning": 0, "degraded": 0, "critical": 0}
+    score_bins = np.zeros(10, dtype=np.int64)
+    errors = 0
+    
+    with open(output_path, "w", encoding="utf-8") as out, \
+            multiprocessing.Pool(workers) as pool:
+        for results in pool.imap_unordered(
+            _analyze_chunk, [(chunk, context_limit) for chunk in chunks]
+        ):
+            for result in results:
+                out.write(json.dumps(result) + "\n")
+                if "error" in result:
+                    errors += 1
+                    continue
+                status_counts[result["status"]] += 1
+                score_bins[min(int(result["health_score"] * 10), 9)] += 1
+    
+    return {
+        "sessions": len(jobs),
+        "errors": errors,
+        "status_histogram": status_counts,
+        "health_score_histogram": {
+            f"{i / 10:.1f}-{(i + 1) / 10:.1f}": int(count)
+            for i, count in enumerate(score_bins)
+        }
+    }
+
+
 # Usage Example
 
 def analyze_agent_context(context: str) -> Dict:
@@ -417,3 +1664,19 @@ def analyze_agent_context(context: str) -> Dict:
         print(f"  - {rec}")
     
     return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Batch context health analysis")
+    parser.add_argument("source", help="Directory of context files or JSONL of {id, context}")
+    parser.add_argument("--output", "-o", default="health_results.jsonl")
+    parser.add_argument("--workers", "-w", type=int, default=None)
+    parser.add_argument("--context-limit", type=int, default=80000)
+    parser.add_argument("--chunk-bytes", type=int, default=4_000_000)
+    
+    args = parser.parse_args()
+    
+    summary = analyze_contexts_batch(
+        args.source, args.output, args.workers, args.context_limit, args.chunk_bytes
+    )
+    print(json.dumps(summary, indent=2))
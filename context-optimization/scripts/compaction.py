@@ -20,8 +20,14 @@ PRODUCTION NOTES:
   with actual inference infrastructure metrics.
 """
 
-from typing import List, Dict
+from typing import Callable, Iterable, Iterator, List, Dict, Optional
+from collections import OrderedDict, deque
+from collections.abc import Sequence
+from difflib import SequenceMatcher
+from string import Formatter
 import hashlib
+import json
+import re
 import time
 
 
@@ -239,9 +245,125 @@ class ObservationStore:
         return content[:50] + "..."
 
 
+class MaskedHistoryView(Sequence):
+    """Read-only view of a HistoryMasker's masked history; list(view) copies it."""
+    
+    def __init__(self, messages: List[Dict]):
+        self._messages = messages
+    
+    def __getitem__(self, index):
+        return self._messages[index]
+    
+    def __len__(self) -> int:
+        return len(self._messages)
+
+
+class HistoryMasker:
+    """
+    Observation masking pass over a full, append-only message history.
+    
+    Keeps the last `keep_last` tool outputs verbatim and replaces older ones
+    with [Obs:...] references. Masked forms are memoized by content hash and
+    the masked history is maintained incrementally, so calling `apply` with
+    the whole history every turn only does work for the new messages.
+    """
+    
+    def __init__(self, store: ObservationStore = None, keep_last: int = 3,
+                 max_length: int = 200):
+        self.store = store or ObservationStore()
+        self.keep_last = keep_last
+        self.max_length = max_length
+        # content hash -> (masked content, observation ref or None)
+        self.memo: "OrderedDict[str, tuple]" = OrderedDict()
+        self.turn = 0
+        self._reset()
+    
+    def _reset(self):
+        self.source: List[Dict] = []
+        self.output: List[Dict] = []
+        self.view = MaskedHistoryView(self.output)
+        self.verbatim: deque = deque()  # indices of unmasked tool outputs
+        self.history_tokens_saved = 0
+    
+    @staticmethod
+    def _is_tool_output(msg: Dict) -> bool:
+        return msg.get("role") == "tool" or "tool" in msg.get("type", "")
+    
+    def _masked_content(self, content: str) -> str:
+        key = hashlib.sha1(content.encode()).hexdigest()
+        entry = self.memo.get(key)
+        # The store evicts on its own schedule; never hand out a dangling ref
+        if entry is None or (entry[1] is not None and entry[1] not in self.store.observations):
+            entry = self.store.mask(content, self.max_length)
+            self.memo[key] = entry
+            if len(self.memo) > self.store.max_size:
+                self.memo.popitem(last=False)
+        self.memo.move_to_end(key)
+        return entry[0]
+    
+    def apply(self, messages: List[Dict]) -> tuple:
+        """
+        Mask stale tool outputs in the history.
+        
+        Returns (masked_messages, report). masked_messages is a read-only
+        view that later calls keep updating in place, so each turn costs only
+        the new messages; take list() of it for a snapshot. The report lists
+        the indices masked this turn and gives the tokens saved by those masks
+        and the total saved on this turn's request compared to sending the
+        raw history.
+        """
+        processed = len(self.source)
+        if processed > len(messages) or (
+            processed and messages[processed - 1] is not self.source[-1]
+        ):
+            # History was rewritten rather than appended to: start over
+            self._reset()
+            processed = 0
+        
+        tokens_saved = 0
+        masked_indices = []
+        for msg in messages[processed:]:
+            self.source.append(msg)
+            self.output.append(msg)
+            if not self._is_tool_output(msg):
+                continue
+            
+            self.verbatim.append(len(self.output) - 1)
+            while len(self.verbatim) > self.keep_last:
+                index = self.verbatim.popleft()
+                original = self.output[index]
+                content = original.get("content", "")
+                masked = self._masked_content(content)
+                if masked == content:
+                    continue
+                self.output[index] = {**original, "content": masked, "masked": True}
+                tokens_saved += estimate_token_count(content) - estimate_token_count(masked)
+                masked_indices.append(index)
+        
+        self.turn += 1
+        self.history_tokens_saved += tokens_saved
+        
+        return self.view, {
+            "turn": self.turn,
+            "new_messages": len(messages) - processed,
+            "newly_masked": len(masked_indices),
+            "masked_indices": masked_indices,
+            "tokens_saved": tokens_saved,
+            "history_tokens_saved": self.history_tokens_saved
+        }
+
+
 # Context Budget Management
 
 class ContextBudget:
+    """
+    Ledger-based token budget.
+    
+    Allocations can be tagged with an item ID so they can later be released
+    or resized. Running totals are kept per category and overall, so every
+    operation is O(1) regardless of how many items have been allocated.
+    """
+    
     def __init__(self, total_limit: int):
         self.total_limit = total_limit
         self.allocated = {
@@ -254,35 +376,135 @@ class ContextBudget:
         }
         self.reserved = 5000  # Reserved buffer
         self.reservation_limit = total_limit - self.reserved
+        
+        # item_id -> {"category": str, "amount": int}
+        self.ledger: Dict[str, Dict] = {}
+        self.used = 0
+        
+        # category -> token threshold; listeners receive threshold events
+        self.thresholds: Dict[str, int] = {}
+        self.listeners: List[Callable[[Dict], None]] = []
+    
+    def _resolve_category(self, category: str) -> str:
+        return category if category in self.allocated else "other"
+    
+    def allocate(self, category: str, amount: int, item_id: str = None) -> bool:
+        """
+        Allocate budget to category. Returns success status.
+        
+        When item_id is given the allocation is recorded in the ledger and
+        can later be released or resized.
+        """
+        category = self._resolve_category(category)
+        
+        if item_id is not None and item_id in self.ledger:
+            raise ValueError(f"Item already allocated: {item_id}")
+        
+        if self.used + amount > self.reservation_limit:
+            return False
+        
+        if item_id is not None:
+            self.ledger[item_id] = {"category": category, "amount": amount}
+        self._apply(category, amount, item_id)
+        return True
+    
+    def release(self, item_id: str) -> int:
+        """Release an item's allocation. Returns the number of tokens freed."""
+        entry = self.ledger.pop(item_id, None)
+        if entry is None:
+            return 0
+        
+        self._apply(entry["category"], -entry["amount"], item_id)
+        return entry["amount"]
     
-    def allocate(self, category: str, amount: int) -> bool:
-        """Allocate budget to category. Returns success status."""
-        if category not in self.allocated:
-            category = "other"
+    def resize(self, item_id: str, new_amount: int) -> bool:
+        """
+        Change the size of an existing allocation (e.g. after compaction).
         
-        current = sum(self.allocated.values())
-        proposed = current + amount
+        Returns False if growing the item would exceed the budget.
+        """
+        if item_id not in self.ledger:
+            raise KeyError(f"Unknown item: {item_id}")
         
-        if proposed > self.reservation_limit:
+        entry = self.ledger[item_id]
+        delta = new_amount - entry["amount"]
+        if delta > 0 and self.used + delta > self.reservation_limit:
             return False
         
-        self.allocated[category] += amount
+        entry["amount"] = new_amount
+        self._apply(entry["category"], delta, item_id)
         return True
     
+    def _apply(self, category: str, delta: int, item_id: Optional[str]):
+        """Update running totals and emit threshold events."""
+        before = self.allocated[category]
+        after = before + delta
+        self.allocated[category] = after
+        self.used += delta
+        
+        threshold = self.thresholds.get(category)
+        if threshold is None or not self.listeners:
+            return
+        
+        if before < threshold <= after:
+            direction = "above"
+        elif after < threshold <= before:
+            direction = "below"
+        else:
+            return
+        
+        event = {
+            "category": category,
+            "direction": direction,
+            "threshold": threshold,
+            "used": after,
+            "item_id": item_id,
+            "timestamp": time.time()
+        }
+        for listener in self.listeners:
+            listener(event)
+    
+    def set_threshold(self, category: str, tokens: int):
+        """Emit an event whenever category usage crosses `tokens`."""
+        self.thresholds[self._resolve_category(category)] = tokens
+    
+    def subscribe(self, listener: Callable[[Dict], None]):
+        """Register a callback for threshold events."""
+        self.listeners.append(listener)
+    
     def remaining(self) -> int:
         """Get remaining unallocated budget."""
-        current = sum(self.allocated.values())
-        return self.reservation_limit - current
+        return self.reservation_limit - self.used
+    
+    def reconcile(self) -> dict:
+        """
+        Compare running totals against the ledger.
+        
+        Returns per-category token counts allocated without an item ID
+        (which cannot be released) and whether the overall total is consistent.
+        """
+        tracked = {category: 0 for category in self.allocated}
+        for entry in self.ledger.values():
+            tracked[entry["category"]] += entry["amount"]
+        
+        return {
+            "consistent": self.used == sum(self.allocated.values()),
+            "untracked": {
+                category: self.allocated[category] - tracked[category]
+                for category in self.allocated
+                if self.allocated[category] != tracked[category]
+            },
+            "tracked_items": len(self.ledger)
+        }
     
     def get_usage(self) -> dict:
         """Get current usage breakdown."""
-        total = sum(self.allocated.values())
         return {
-            "total_used": total,
+            "total_used": self.used,
             "total_limit": self.total_limit,
             "remaining": self.remaining(),
             "by_category": dict(self.allocated),
-            "utilization_ratio": total / self.total_limit
+            "utilization_ratio": self.used / self.total_limit
         }
     
     def should_optimize(self, current_usage: int, metrics: dict = None) -> tuple:
@@ -308,6 +530,185 @@ class ContextBudget:
         
         should_optimize = len(reasons) > 0
         return should_optimize, reasons
+    
+    def plan_packing(self, items: List[Dict], exact_threshold: int = 32) -> dict:
+        """Plan which items to keep, compact or drop to fit the usable budget."""
+        return plan_context_packing(items, self.reservation_limit, exact_threshold)
+
+
+# Context Packing
+
+# Fraction of an item's priority retained under each compaction option
+PACKING_RETENTION = {
+    "full": 1.0,
+    "summarized": 0.6,
+    "masked": 0.25,
+    "dropped": 0.0
+}
+
+
+def _packing_options(item: Dict, retention: Dict[str, float]) -> List[tuple]:
+    """
+    Build (cost, value, option) choices for an item, sorted by cost.
+    
+    Item format:
+        {"id": "msg_12", "tokens": 1800, "priority": 0.7,
+         "options": {"summarized": 300, "masked": 40}, "required": False}
+    """
+    priority = item.get("priority", 1.0)
+    costs = {"full": item["tokens"]}
+    costs.update(item.get("options", {}))
+    if not item.get("required", False):
+        costs["dropped"] = 0
+    
+    options = [
+        (cost, priority * retention.get(option, 0.0), option)
+        for option, cost in costs.items()
+    ]
+    options.sort(key=lambda o: (o[0], -o[1]))
+    return options
+
+
+def _upper_hull(options: List[tuple]) -> List[tuple]:
+    """Keep only choices on the upper convex hull of (cost, value)."""
+    hull = []
+    for option in options:
+        # Dominated: costs at least as much but retains no more
+        if hull and option[1] <= hull[-1][1]:
+            continue
+        while len(hull) >= 2:
+            (c1, v1, _), (c2, v2, _) = hull[-2], hull[-1]
+            # Drop the middle point if it lies on or below the new segment
+            if (v2 - v1) * (option[0] - c1) <= (option[1] - v1) * (c2 - c1):
+                hull.pop()
+            else:
+                break
+        hull.append(option)
+    return hull
+
+
+def _pack_greedy(choices: List[List[tuple]], budget: int) -> Optional[List[int]]:
+    """
+    Greedy-by-density packing.
+    
+    Every item starts at its cheapest choice; upgrade steps along each item's
+    convex hull are then applied in order of value gained per token.
+    """
+    selected = [0] * len(choices)
+    used = sum(c[0][0] for c in choices)
+    if used > budget:
+        return None
+    
+    steps = []
+    for i, hull in enumerate(choices):
+        for j in range(1, len(hull)):
+            extra_cost = hull[j][0] - hull[j - 1][0]
+            extra_value = hull[j][1] - hull[j - 1][1]
+            density = extra_value / extra_cost if extra_cost > 0 else float("inf")
+            steps.append((-density, i, j, extra_cost))
+    steps.sort()
+    
+    blocked = set()
+    for _, i, j, extra_cost in steps:
+        if i in blocked:
+            continue
+        # Hull steps of one item have decreasing density, so they arrive in order
+        if used + extra_cost <= budget:
+            used += extra_cost
+            selected[i] = j
+        else:
+            blocked.add(i)
+    
+    return selected
+
+
+def _pack_exact(choices: List[List[tuple]], budget: int) -> Optional[List[int]]:
+    """
+    Exact multiple-choice knapsack via a Pareto front of (cost, value) states.
+    
+    Only practical for small instances; the front is pruned of dominated
+    states after every item.
+    """
+    # Each state: (cost, value, parent_state_index, choice_index)
+    fronts = [[(0, 0.0, -1, -1)]]
+    for options in choices:
+        candidates = []
+        for parent, (cost, value, _, _) in enumerate(fronts[-1]):
+            for j, (c, v, _) in enumerate(options):
+                if cost + c <= budget:
+                    candidates.append((cost + c, value + v, parent, j))
+        if not candidates:
+            return None
+        
+        candidates.sort(key=lambda s: (s[0], -s[1]))
+        front = []
+        for state in candidates:
+            if not front or state[1] > front[-1][1]:
+                front.append(state)
+        fronts.append(front)
+    
+    best = max(range(len(fronts[-1])), key=lambda k: fronts[-1][k][1])
+    selected = [0] * len(choices)
+    for level in range(len(choices), 0, -1):
+        _, _, parent, j = fronts[level][best]
+        selected[level - 1] = j
+        best = parent
+    return selected
+
+
+def plan_context_packing(items: List[Dict], budget: int,
+                         exact_threshold: int = 32,
+                         retention: Dict[str, float] = None) -> dict:
+    """
+    Choose a compaction option per item that maximizes retained priority.
+    
+    Each item may be kept in full, summarized, masked or dropped; the value
+    retained is priority * retention[option]. Instances with at most
+    exact_threshold items are solved exactly, larger ones with the greedy
+    density heuristic (O(n log n)).
+    
+    Returns dict with per-item assignments, tokens used and retained priority.
+    """
+    retention = retention or PACKING_RETENTION
+    
+    options = [_packing_options(item, retention) for item in items]
+    
+    if len(items) <= exact_threshold:
+        method = "exact"
+        choices = options
+        selected = _pack_exact(choices, budget)
+    else:
+        method = "greedy"
+        choices = [_upper_hull(o) for o in options]
+        selected = _pack_greedy(choices, budget)
+    
+    if selected is None:
+        return {
+            "feasible": False,
+            "method": method,
+            "assignments": {},
+            "tokens_used": 0,
+            "retained_priority": 0.0,
+            "total_priority": sum(item.get("priority", 1.0) for item in items)
+        }
+    
+    assignments = {}
+    tokens_used = 0
+    retained = 0.0
+    for item, item_choices, j in zip(items, choices, selected):
+        cost, value, option = item_choices[j]
+        assignments[item["id"]] = option
+        tokens_used += cost
+        retained += value
+    
+    return {
+        "feasible": True,
+        "method": method,
+        "assignments": assignments,
+        "tokens_used": tokens_used,
+        "retained_priority": retained,
+        "total_priority": sum(item.get("priority", 1.0) for item in items)
+    }
 
 
 # Cache Optimization
@@ -320,8 +721,13 @@ def design_stable_prompt(template: str, dynamic_values: dict) -> str:
     """
     result = template
     
+    # Replace known dynamic values first, longest first so substrings don't clash
+    for key, value in sorted((dynamic_values or {}).items(),
+                             key=lambda kv: len(str(kv[1])), reverse=True):
+        if str(value):
+            result = result.replace(str(value), f"[{key.upper()}_STABLE]")
+    
     # Replace timestamps
-    import re
     date_pattern = r'\d{4}-\d{2}-\d{2}'
     result = re.sub(date_pattern, '[DATE_STABLE]', result)
     
@@ -336,6 +742,208 @@ def design_stable_prompt(template: str, dynamic_values: dict) -> str:
     return result
 
 
+def _common_prefix_length(token_lists: List[List[str]]) -> int:
+    """Length of the longest token prefix shared by every sequence."""
+    if not token_lists:
+        return 0
+    shortest = min(token_lists, key=len)
+    for i, token in enumerate(shortest):
+        if any(tokens[i] != token for tokens in token_lists):
+            return i
+    return len(shortest)
+
+
+def _template_fields(template: str) -> List[str]:
+    return [field for _, field, _, _ in Formatter().parse(template) if field]
+
+
+def _normalize_template(template: str) -> tuple:
+    """
+    Rewrite a format template with synthetic field names f0, f1, ...
+    
+    Positional ("{0}") and automatically numbered ("{}") fields cannot be
+    used as regex group names or filled by format_map, so every distinct
+    field gets a synthetic name. Returns the rewritten template, a map from
+    synthetic name to field name ("{}" fields take the index str.format
+    gives them) and a map from synthetic name to the replacement field to
+    write back, with automatic numbering made explicit so lines can be
+    reordered.
+    """
+    parts = []
+    names: Dict[str, str] = {}
+    fields: Dict[str, str] = {}
+    originals: Dict[str, str] = {}
+    auto_index = 0
+    for literal, field, spec, conversion in Formatter().parse(template):
+        parts.append(literal.replace("{", "{{").replace("}", "}}"))
+        if field is None:
+            continue
+        if field == "" or field[0] in ".[":
+            field = f"{auto_index}{field}"
+            auto_index += 1
+        key = (field, spec, conversion)
+        if key not in names:
+            names[key] = f"f{len(names)}"
+            fields[names[key]] = field
+            originals[names[key]] = "{" + field + (f"!{conversion}" if conversion else "") + \
+                (f":{spec}" if spec else "") + "}"
+        parts.append("{" + names[key] + "}")
+    return "".join(parts), fields, originals
+
+
+def _denormalize_template(template: str, originals: Dict[str, str]) -> str:
+    """Put the original replacement fields back into a normalized template."""
+    parts = []
+    for literal, field, _, _ in Formatter().parse(template):
+        parts.append(literal.replace("{", "{{").replace("}", "}}"))
+        if field is not None:
+            parts.append(originals[field])
+    return "".join(parts)
+
+
+def _extract_field_values(template: str, prompt: str) -> Optional[Dict[str, str]]:
+    """
+    Recover the text each field of a normalized template (see
+    _normalize_template) took in a rendered prompt.
+    """
+    pattern = []
+    seen = set()
+    for literal, field, _, _ in Formatter().parse(template):
+        pattern.append(re.escape(literal))
+        if field is None:
+            continue
+        if field in seen:
+            pattern.append(f"(?P={field})")
+        else:
+            pattern.append(f"(?P<{field}>.*?)")
+            seen.add(field)
+    
+    match = re.fullmatch("".join(pattern), prompt, re.DOTALL)
+    if not match:
+        return None
+    return {field: match.group(field) for field in seen}
+
+
+def _reorder_template_lines(template: str, volatile_fields: set) -> str:
+    """Move template lines that contain volatile fields after the stable ones."""
+    stable, volatile = [], []
+    for line in template.split("\n"):
+        if volatile_fields & set(_template_fields(line)):
+            volatile.append(line)
+        else:
+            stable.append(line)
+    return "\n".join(stable + volatile)
+
+
+def analyze_prompt_stability(prompts: List[str], template: str = None) -> dict:
+    """
+    Diff a corpus of rendered prompts token by token to find cache breakers.
+    
+    Reports the longest prefix shared by all prompts, the segments of the
+    first prompt that vary across the corpus (and how early they appear),
+    and a reordered template that moves volatile lines after the stable
+    prefix, with the projected prefix-cache hit rate.
+    
+    If `template` ({field} format string) is given, volatile fields are
+    identified by the values they took in each prompt; positional and "{}"
+    fields are reported by index. Otherwise a template
+    is inferred from the first prompt with {var_N} placeholders and the
+    projection is an estimate.
+    """
+    if not prompts:
+        raise ValueError("At least one prompt is required")
+    
+    token_lists = [tokenize_for_cache(p) for p in prompts]
+    reference = token_lists[0]
+    avg_tokens = sum(len(t) for t in token_lists) / len(token_lists)
+    stable_prefix = _common_prefix_length(token_lists)
+    
+    # Per reference token: number of prompts in which it has no counterpart
+    differs = [0] * len(reference)
+    for tokens in token_lists[1:]:
+        matched = bytearray(len(reference))
+        matcher = SequenceMatcher(None, reference, tokens, autojunk=False)
+        for a, _, size in matcher.get_matching_blocks():
+            matched[a:a + size] = b"\x01" * size
+        for i, hit in enumerate(matched):
+            if not hit:
+                differs[i] += 1
+    
+    segments = []
+    i = 0
+    while i < len(reference):
+        if not differs[i]:
+            i += 1
+            continue
+        start = i
+        while i < len(reference) and differs[i]:
+            i += 1
+        segments.append({
+            "start_token": start,
+            "end_token": i,
+            "position_ratio": start / len(reference),
+            "variability": max(differs[start:i]) / max(1, len(prompts) - 1),
+            "text": "".join(reference[start:i])[:80]
+        })
+    
+    volatile_fields = []
+    if template is not None:
+        normalized, field_names, originals = _normalize_template(template)
+        field_values = [_extract_field_values(normalized, p) for p in prompts]
+        if any(v is None for v in field_values):
+            raise ValueError("Some prompts do not match the template")
+        volatile = {
+            name for name in field_names
+            if len({values[name] for values in field_values}) > 1
+        }
+        volatile_fields = list(dict.fromkeys(field_names[name] for name in field_names if name in volatile))
+        
+        reordered_normalized = _reorder_template_lines(normalized, volatile)
+        reordered = _denormalize_template(reordered_normalized, originals)
+        projected_prefix = _common_prefix_length([
+            tokenize_for_cache(reordered_normalized.format_map(values)) for values in field_values
+        ])
+    else:
+        # Infer a template from the reference prompt
+        parts = []
+        cursor = 0
+        for n, segment in enumerate(segments):
+            literal = "".join(reference[cursor:segment["start_token"]])
+            parts.append(literal.replace("{", "{{").replace("}", "}}"))
+            parts.append(f"{{var_{n}}}")
+            volatile_fields.append(f"var_{n}")
+            cursor = segment["end_token"]
+        parts.append("".join(reference[cursor:]).replace("{", "{{").replace("}", "}}"))
+        inferred = "".join(parts)
+        
+        reordered = _reorder_template_lines(inferred, set(volatile_fields))
+        # Estimate: every token before the first volatile line stays cached
+        stable_text = []
+        for line in reordered.split("\n"):
+            if set(_template_fields(line)) & set(volatile_fields):
+                break
+            stable_text.append(line.replace("{{", "{").replace("}}", "}"))
+        projected_prefix = max(
+            stable_prefix, len(tokenize_for_cache("\n".join(stable_text)))
+        )
+    
+    current_hit_rate = stable_prefix / avg_tokens if avg_tokens else 0
+    projected_hit_rate = projected_prefix / avg_tokens if avg_tokens else 0
+    
+    return {
+        "prompts": len(prompts),
+        "avg_prompt_tokens": avg_tokens,
+        "stable_prefix_tokens": stable_prefix,
+        "volatile_segments": segments,
+        "volatile_fields": volatile_fields,
+        "reordered_template": reordered,
+        "projected_stable_prefix_tokens": projected_prefix,
+        "current_hit_rate": current_hit_rate,
+        "projected_hit_rate": projected_hit_rate,
+        "projected_gain": projected_hit_rate - current_hit_rate
+    }
+
+
 def calculate_cache_metrics(requests: list, cache: dict) -> dict:
     """
     Calculate KV-cache hit metrics for request sequence.
@@ -362,6 +970,253 @@ def calculate_cache_metrics(requests: list, cache: dict) -> dict:
     }
 
 
+# Prefix Cache Simulation
+
+def tokenize_for_cache(text: str) -> List[str]:
+    """
+    Split text into cache tokens (word plus leading whitespace).
+    
+    Approximates a real tokenizer closely enough for prefix matching; swap in
+    a model tokenizer for exact token counts.
+    """
+    return re.findall(r"\s*\S+", text)
+
+
+def _request_tokens(record: Dict) -> List[str]:
+    """Extract the prompt token sequence from a request log record."""
+    if "tokens" in record:
+        return [str(t) for t in record["tokens"]]
+    if "messages" in record:
+        return tokenize_for_cache("\n".join(
+            f"{m.get('role', 'user')}: {m.get('content', '')}"
+            for m in record["messages"]
+        ))
+    return tokenize_for_cache(record.get("prompt", record.get("text", "")))
+
+
+def iter_request_log(path: str) -> Iterator[Dict]:
+    """Stream request records from a JSONL log without loading it in memory."""
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+
+class _TrieNode:
+    __slots__ = ("children", "parent", "edge", "start")
+    
+    def __init__(self, parent=None, edge: List = None, start: int = 0):
+        self.children = None  # first block of child edge -> child
+        self.parent = parent
+        self.edge = edge or []  # blocks on the edge leading into this node
+        self.start = start  # block offset where the edge begins
+
+
+class PrefixCacheSimulator:
+    """
+    Replay a request stream against a simulated prefix (KV/prompt) cache.
+    
+    Cached prefixes live in a radix trie of token blocks, so a long shared
+    system prompt is a single edge and each request touches only a handful
+    of nodes. Nodes are kept in one recency-ordered dict; ancestors are always
+    touched after their descendants, so the least recent entry is always a
+    leaf and evicting (or trimming) it never orphans cached content. Memory
+    is bounded by `capacity_tokens`.
+    
+    Policies:
+    - "lru": evict least recently used blocks when over capacity
+    - "ttl": additionally expire blocks not used within `ttl_seconds`
+    """
+    
+    def __init__(self, capacity_tokens: int = 1_000_000, policy: str = "lru",
+                 ttl_seconds: float = 300.0, block_size: int = 1,
+                 max_divergences: int = 20):
+        if policy not in ("lru", "ttl"):
+            raise ValueError(f"Unknown eviction policy: {policy}")
+        
+        self.capacity_blocks = max(1, capacity_tokens // block_size)
+        self.block_size = block_size
+        self.policy = policy
+        self.ttl_seconds = ttl_seconds
+        self.max_divergences = max_divergences
+        
+        self.root = _TrieNode()
+        self.recency: "OrderedDict[_TrieNode, float]" = OrderedDict()
+        self.cached_blocks = 0
+        
+        self.requests = 0
+        self.total_tokens = 0
+        self.reused_tokens = 0
+        self.requests_with_reuse = 0
+        self.evicted_tokens = 0
+        self.expired_tokens = 0
+        self.peak_cached_tokens = 0
+        # (position, cached_token, request_token) -> miss count, pruned to stay bounded
+        self.divergences: Dict[tuple, int] = {}
+    
+    def _blocks(self, tokens: List[str]) -> List:
+        if self.block_size == 1:
+            return tokens
+        # Partial trailing blocks are never cached, as in paged KV caches
+        n = len(tokens) - len(tokens) % self.block_size
+        return [tuple(tokens[i:i + self.block_size]) for i in range(0, n, self.block_size)]
+    
+    def _remove_leaf(self, node: _TrieNode) -> int:
+        del self.recency[node]
+        del node.parent.children[node.edge[0]]
+        self.cached_blocks -= len(node.edge)
+        return len(node.edge)
+    
+    def _expire(self, now: float):
+        cutoff = now - self.ttl_seconds
+        while self.recency:
+            node, last_access = next(iter(self.recency.items()))
+            if last_access >= cutoff:
+                break
+            self.expired_tokens += self._remove_leaf(node) * self.block_size
+    
+    def _evict(self):
+        while self.cached_blocks > self.capacity_blocks:
+            leaf = next(iter(self.recency))
+            excess = self.cached_blocks - self.capacity_blocks
+            if excess < len(leaf.edge):
+                # Trim the tail of the edge instead of dropping it entirely
+                del leaf.edge[-excess:]
+                self.cached_blocks -= excess
+                self.evicted_tokens += excess * self.block_size
+            else:
+                self.evicted_tokens += self._remove_leaf(leaf) * self.block_size
+    
+    def _split(self, node: _TrieNode, at: int) -> _TrieNode:
+        """Split node's edge after `at` blocks; returns the new upper node."""
+        upper = _TrieNode(node.parent, node.edge[:at], node.start)
+        upper.children = {node.edge[at]: node}
+        node.parent.children[upper.edge[0]] = upper
+        node.parent = upper
+        node.edge = node.edge[at:]
+        node.start += at
+        return upper
+    
+    def _record_divergence(self, position: int, cached, requested):
+        key = (position * self.block_size, _block_text(cached), _block_text(requested))
+        self.divergences[key] = self.divergences.get(key, 0) + 1
+        
+        if len(self.divergences) > self.max_divergences * 10:
+            top = sorted(self.divergences.items(), key=lambda kv: kv[1], reverse=True)
+            self.divergences = dict(top[:self.max_divergences])
+    
+    def process(self, tokens: List[str], timestamp: float) -> int:
+        """Replay one request. Returns the number of prefix tokens reused."""
+        if self.policy == "ttl":
+            self._expire(timestamp)
+        
+        blocks = self._blocks(tokens)
+        node = self.root
+        path = []
+        matched = 0
+        
+        while matched < len(blocks):
+            child = node.children.get(blocks[matched]) if node.children else None
+            if child is None:
+                if node.children:
+                    self._record_divergence(matched, next(iter(node.children)), blocks[matched])
+                break
+            
+            edge = child.edge
+            if blocks[matched:matched + len(edge)] == edge:
+                matched += len(edge)
+                path.append(child)
+                node = child
+                continue
+            
+            # Partial match along the edge: find where the request diverges
+            offset = 1
+            limit = min(len(edge), len(blocks) - matched)
+            while offset < limit and edge[offset] == blocks[matched + offset]:
+                offset += 1
+            if offset < len(edge) and matched + offset < len(blocks):
+                self._record_divergence(matched + offset, edge[offset], blocks[matched + offset])
+            node = self._split(child, offset)
+            path.append(node)
+            matched += offset
+            break
+        
+        # Insert the unmatched suffix so later requests can reuse it
+        suffix = blocks[matched:matched + max(0, self.capacity_blocks - matched)]
+        if suffix:
+            leaf = _TrieNode(node, list(suffix), matched)
+            if node.children is None:
+                node.children = {}
+            node.children[suffix[0]] = leaf
+            self.cached_blocks += len(suffix)
+            path.append(leaf)
+        
+        # Touch deepest first so every ancestor is more recent than its descendants
+        for visited in reversed(path):
+            self.recency[visited] = timestamp
+            self.recency.move_to_end(visited)
+        
+        self._evict()
+        
+        reused = matched * self.block_size
+        self.requests += 1
+        self.total_tokens += len(tokens)
+        self.reused_tokens += reused
+        if reused:
+            self.requests_with_reuse += 1
+        self.peak_cached_tokens = max(
+            self.peak_cached_tokens, self.cached_blocks * self.block_size
+        )
+        return reused
+    
+    def replay(self, records: Iterable[Dict]) -> dict:
+        """Replay a stream of request records and return the report."""
+        for index, record in enumerate(records):
+            timestamp = record.get("timestamp", float(index))
+            self.process(_request_tokens(record), timestamp)
+        return self.report()
+    
+    def report(self) -> dict:
+        """Summarize hit rates, reuse and the most common miss divergences."""
+        misses = self.total_tokens - self.reused_tokens
+        top = sorted(self.divergences.items(), key=lambda kv: kv[1], reverse=True)
+        
+        return {
+            "requests": self.requests,
+            "hit_rate": self.reused_tokens / self.total_tokens if self.total_tokens else 0,
+            "request_hit_rate": self.requests_with_reuse / self.requests if self.requests else 0,
+            "cache_hits": self.reused_tokens,
+            "cache_misses": misses,
+            "cached_tokens": self.cached_blocks * self.block_size,
+            "peak_cached_tokens": self.peak_cached_tokens,
+            "evicted_tokens": self.evicted_tokens,
+            "expired_tokens": self.expired_tokens,
+            "top_divergences": [
+                {"position": pos, "cached": cached, "requested": requested, "count": count}
+                for (pos, cached, requested), count in top[:self.max_divergences]
+            ],
+            "recommendations": generate_cache_recommendations(self.reused_tokens, misses)
+        }
+
+
+def _block_text(block) -> str:
+    text = block if isinstance(block, str) else "".join(block)
+    return text[:40]
+
+
+def simulate_cache_metrics(log_path: str, **simulator_options) -> dict:
+    """
+    Calculate KV-cache hit metrics by replaying an actual request log.
+    
+    Each JSONL line holds one request with "tokens", "messages" or "prompt",
+    and an optional "timestamp". Returns the same keys as
+    calculate_cache_metrics plus simulator details.
+    """
+    simulator = PrefixCacheSimulator(**simulator_options)
+    return simulator.replay(iter_request_log(log_path))
+
+
 def generate_cache_recommendations(hits: int, misses: int) -> list:
     """Generate recommendations for cache optimization."""
     recommendations = []
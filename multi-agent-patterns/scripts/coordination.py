@@ -4,9 +4,25 @@ Multi-Agent Coordination
 This module provides utilities for implementing multi-agent coordination patterns.
 """
 
-from typing import Dict, List, Any, Optional
-from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Dict, Iterator, List, Any, Optional, Union
+from dataclasses import dataclass, field, replace
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import Executor, FIRST_COMPLETED, ThreadPoolExecutor, wait
 from enum import Enum
+import asyncio
+import hashlib
+import heapq
+import itertools
+import json
+import multiprocessing
+import os
+import queue
+import random
+import struct
+import threading
 import time
 import uuid
 
@@ -30,29 +46,176 @@ class AgentMessage:
     message_id: str = field(default_factory=lambda: str(uuid.uuid4()))
     requires_response: bool = False
     priority: int = 0  # 0 = normal, higher = more urgent
+    reply_to: Optional[str] = None  # message_id this message answers
+    
+    def to_dict(self) -> Dict[str, Any]:
+        """JSON-serializable form of the message."""
+        return {
+            "sender": self.sender,
+            "receiver": self.receiver,
+            "message_type": self.message_type.value,
+            "content": self.content,
+            "timestamp": self.timestamp,
+            "message_id": self.message_id,
+            "requires_response": self.requires_response,
+            "priority": self.priority,
+            "reply_to": self.reply_to
+        }
+    
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "AgentMessage":
+        """Rebuild a message produced by to_dict."""
+        return cls(**{**data, "message_type": MessageType(data["message_type"])})
 
 
 class AgentCommunication:
-    """Communication channel for multi-agent systems."""
+    """
+    Communication channel for multi-agent systems.
     
-    def __init__(self):
-        self.inbox: Dict[str, List[AgentMessage]] = {}
-        self.outbox: List[AgentMessage] = []
-        self.message_history: List[AgentMessage] = []
+    Each agent's inbox is a heap ordered by priority (highest first), then
+    timestamp, then send order, so urgent ALERT and HANDOVER messages are
+    delivered ahead of bulk traffic. Sending and receiving one message are
+    O(log n) in the inbox size. outbox and message_history keep only the
+    last history_size messages; pass history_path to also append every
+    message to a JSONL log on disk, or message_log for an indexed,
+    replayable MessageLog. Inbox operations are guarded by one condition
+    variable, so agents on different threads can share a channel and
+    wait_reply wakes as soon as the reply is sent.
+    """
     
-    def send(self, message: AgentMessage):
-        """Send a message to an agent."""
-        if message.receiver not in self.inbox:
-            self.inbox[message.receiver] = []
-        self.inbox[message.receiver].append(message)
+    def __init__(self, history_size: int = 10000, history_path: str = None,
+                 message_log: "MessageLog" = None):
+        # agent -> heap of (-priority, timestamp, sequence, message)
+        self.inbox: Dict[str, List[tuple]] = {}
+        self.outbox: deque = deque(maxlen=history_size)
+        self.message_history: deque = deque(maxlen=history_size)
+        self._sequence = itertools.count()
+        self._history_file = open(history_path, "a", encoding="utf-8") if history_path else None
+        self.message_log = message_log
+        self._lock = threading.Condition()
+        self._recording = True
+    
+    def _record(self, message: AgentMessage):
+        if not self._recording:
+            return
         self.outbox.append(message)
         self.message_history.append(message)
+        if self._history_file is not None:
+            self._history_file.write(json.dumps(message.to_dict()) + "\n")
+        if self.message_log is not None:
+            self.message_log.append(message)
+    
+    def _inbox_entry(self, message: AgentMessage) -> tuple:
+        return (-message.priority, message.timestamp, next(self._sequence), message)
+    
+    def send(self, message: AgentMessage):
+        """Send a message to an agent."""
+        with self._lock:
+            heapq.heappush(self.inbox.setdefault(message.receiver, []), self._inbox_entry(message))
+            self._record(message)
+            self._lock.notify_all()
+    
+    def reply(self, original: AgentMessage, content: Dict[str, Any],
+              message_type: MessageType = MessageType.RESPONSE) -> AgentMessage:
+        """Send a response correlated with `original` through reply_to."""
+        response = AgentMessage(
+            sender=original.receiver,
+            receiver=original.sender,
+            message_type=message_type,
+            content=content,
+            priority=original.priority,
+            reply_to=original.message_id
+        )
+        self.send(response)
+        return response
+    
+    @staticmethod
+    def _is_reply(message: AgentMessage, message_id: str,
+                  fallback: Callable[[AgentMessage], bool] = None) -> bool:
+        if message.reply_to is None:
+            return fallback is not None and fallback(message)
+        return message.reply_to == message_id
+    
+    def take_reply(self, agent_id: str, message_id: str,
+                   fallback: Callable[[AgentMessage], bool] = None) -> Optional[AgentMessage]:
+        """
+        Remove and return the reply to message_id from an inbox, leaving other messages queued.
+        
+        Messages without reply_to (from peers that don't set it) count as the
+        reply when fallback(message) is true.
+        """
+        with self._lock:
+            queue = self.inbox.get(agent_id, [])
+            for i, entry in enumerate(queue):
+                if self._is_reply(entry[3], message_id, fallback):
+                    queue[i] = queue[-1]
+                    queue.pop()
+                    heapq.heapify(queue)
+                    return entry[3]
+            return None
+    
+    def wait_reply(self, agent_id: str, message_id: str, timeout: float = None,
+                   fallback: Callable[[AgentMessage], bool] = None) -> Optional[AgentMessage]:
+        """
+        take_reply, waiting up to timeout seconds (None = forever) for the reply.
+        
+        Wakes as soon as another thread sends the reply. With no other
+        thread running nothing could deliver it, so it returns at once.
+        """
+        found = []
+        
+        def arrived() -> bool:
+            reply = self.take_reply(agent_id, message_id, fallback)
+            if reply is not None:
+                found.append(reply)
+            return bool(found)
+        
+        with self._lock:
+            if not arrived() and timeout != 0 and threading.active_count() > 1:
+                self._lock.wait_for(arrived, timeout)
+        return found[0] if found else None
+    
+    def receive(self, agent_id: str, max_n: int = None) -> List[AgentMessage]:
+        """
+        Receive messages for an agent, most urgent first.
+        
+        Returns at most max_n messages (all pending ones by default); the
+        rest stay queued for the next call.
+        """
+        with self._lock:
+            queue = self.inbox.get(agent_id)
+            if not queue:
+                return []
+            if max_n is None or max_n >= len(queue):
+                self.inbox[agent_id] = []
+                return [entry[3] for entry in sorted(queue)]
+            return [heapq.heappop(queue)[3] for _ in range(max_n)]
+    
+    def pending(self, agent_id: str) -> int:
+        """Number of messages waiting in an agent's inbox."""
+        with self._lock:
+            return len(self.inbox.get(agent_id, ()))
+    
+    def log_event(self, message: AgentMessage):
+        """Append a message to message_log, if any, without delivering it or adding it to the history."""
+        with self._lock:
+            if self._recording and self.message_log is not None:
+                self.message_log.append(message)
     
-    def receive(self, agent_id: str) -> List[AgentMessage]:
-        """Receive all messages for an agent."""
-        messages = self.inbox.get(agent_id, [])
-        self.inbox[agent_id] = []  # Clear inbox after receiving
-        return messages
+    @contextmanager
+    def unrecorded(self):
+        """Deliver messages without adding them to the history or logs, e.g. while replaying them."""
+        recording, self._recording = self._recording, False
+        try:
+            yield self
+        finally:
+            self._recording = recording
+    
+    def close(self):
+        """Flush and close the on-disk history log, if any."""
+        if self._history_file is not None:
+            self._history_file.close()
+            self._history_file = None
     
     def broadcast(self, sender: str, message_type: MessageType, 
                   content: Dict[str, Any], receivers: List[str]):
@@ -66,8 +229,813 @@ class AgentCommunication:
             ))
 
 
+class AsyncAgentCommunication(AgentCommunication):
+    """
+    asyncio-native communication channel.
+    
+    Each agent has an asyncio.PriorityQueue with the same ordering as the
+    synchronous inboxes. `request` sends a message and awaits the reply
+    correlated by message_id, so callers resume as soon as the reply is sent
+    instead of after a fixed sleep. Replies to pending requests resolve the
+    waiting future directly and are not queued. All methods must be used
+    from the event loop's thread, so the inherited lock is not taken.
+    """
+    
+    def __init__(self, history_size: int = 10000, history_path: str = None,
+                 message_log: "MessageLog" = None):
+        super().__init__(history_size, history_path, message_log)
+        # Same role as the synchronous inbox heaps
+        self.inbox: Dict[str, asyncio.PriorityQueue] = {}
+        self._pending: Dict[str, asyncio.Future] = {}
+    
+    def _queue(self, agent_id: str) -> asyncio.PriorityQueue:
+        queue = self.inbox.get(agent_id)
+        if queue is None:
+            queue = self.inbox[agent_id] = asyncio.PriorityQueue()
+        return queue
+    
+    def send(self, message: AgentMessage):
+        """Deliver a message, resolving a pending request if it is the reply."""
+        self._record(message)
+        future = self._pending.pop(message.reply_to, None) if message.reply_to else None
+        if future is not None and not future.done():
+            future.set_result(message)
+            return
+        self._queue(message.receiver).put_nowait(self._inbox_entry(message))
+    
+    def receive(self, agent_id: str, max_n: int = None) -> List[AgentMessage]:
+        """Take queued messages without waiting, most urgent first."""
+        queue = self._queue(agent_id)
+        count = queue.qsize() if max_n is None else min(max_n, queue.qsize())
+        return [queue.get_nowait()[3] for _ in range(count)]
+    
+    def pending(self, agent_id: str) -> int:
+        return self._queue(agent_id).qsize()
+    
+    def take_reply(self, agent_id: str, message_id: str,
+                   fallback: Callable[[AgentMessage], bool] = None) -> Optional[AgentMessage]:
+        queue = self._queue(agent_id)
+        entries = [queue.get_nowait() for _ in range(queue.qsize())]
+        found = None
+        for entry in entries:
+            if found is None and self._is_reply(entry[3], message_id, fallback):
+                found = entry[3]
+            else:
+                queue.put_nowait(entry)
+        return found
+    
+    async def get(self, agent_id: str, timeout: float = None) -> AgentMessage:
+        """Wait for the next message for an agent; raises asyncio.TimeoutError."""
+        entry = await asyncio.wait_for(self._queue(agent_id).get(), timeout)
+        return entry[3]
+    
+    async def request(self, message: AgentMessage, timeout: float = None) -> AgentMessage:
+        """
+        Send a message and wait for its reply.
+        
+        Raises asyncio.TimeoutError when no reply arrives within timeout.
+        Cancelling the awaiting task also abandons the request; a late reply
+        is then queued like any other message.
+        """
+        future = asyncio.get_running_loop().create_future()
+        self._pending[message.message_id] = future
+        try:
+            self.send(message)
+            return await asyncio.wait_for(future, timeout)
+        finally:
+            self._pending.pop(message.message_id, None)
+    
+    async def serve(self, agent_id: str,
+                    handler: Callable[[AgentMessage], Union[Dict, Awaitable[Dict]]]):
+        """
+        Run an agent loop: hand each message to handler and reply with its
+        result when the message requires a response. Runs until cancelled.
+        """
+        while True:
+            message = await self.get(agent_id)
+            result = handler(message)
+            if asyncio.iscoroutine(result):
+                result = await result
+            if message.requires_response:
+                self.reply(message, result or {})
+
+
+# Message Log
+
+class MessageLog:
+    """
+    Append-only, segment-rotated on-disk log of AgentMessages.
+    
+    Messages are written as JSON lines to segment files named by the offset
+    of their first message; a new segment starts once the current one
+    reaches segment_bytes. Offsets are global sequence numbers. In-memory
+    indexes (rebuilt by scanning the segments when an existing directory is
+    opened) map offsets to file positions and receivers, message types and
+    timestamps to offsets, so reads and queries seek directly to matching
+    records. Checkpoints of supervisor state let replay fast-forward.
+    """
+    
+    def __init__(self, directory: str, segment_bytes: int = 64 << 20):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        os.makedirs(directory, exist_ok=True)
+        
+        self.segments: List[int] = []  # first offset of each segment
+        self._segment_of = array("i")
+        self._positions = array("q")
+        self._timestamps = array("d")
+        self._receivers = array("i")
+        self._types = array("b")
+        self._receiver_codes: Dict[str, int] = {}
+        self._by_receiver: Dict[str, array] = {}
+        self._by_type: Dict[MessageType, array] = {}
+        self._time_ordered = True
+        self._readers: Dict[int, Any] = {}
+        self._writer = None
+        self._load()
+    
+    def _segment_path(self, first_offset: int) -> str:
+        return os.path.join(self.directory, f"segment-{first_offset:020d}.jsonl")
+    
+    def _checkpoint_path(self, offset: int) -> str:
+        return os.path.join(self.directory, f"checkpoint-{offset:020d}.json")
+    
+    def _index(self, segment: int, position: int, message: AgentMessage):
+        offset = len(self._positions)
+        if self._timestamps and message.timestamp < self._timestamps[-1]:
+            self._time_ordered = False
+        receiver = self._receiver_codes.setdefault(message.receiver, len(self._receiver_codes))
+        self._segment_of.append(segment)
+        self._positions.append(position)
+        self._timestamps.append(message.timestamp)
+        self._receivers.append(receiver)
+        self._types.append(_MESSAGE_TYPE_CODES[message.message_type])
+        self._by_receiver.setdefault(message.receiver, array("q")).append(offset)
+        self._by_type.setdefault(message.message_type, array("q")).append(offset)
+        return offset
+    
+    def _load(self):
+        names = sorted(
+            name for name in os.listdir(self.directory)
+            if name.startswith("segment-") and name.endswith(".jsonl")
+        )
+        for name in names:
+            self.segments.append(int(name[len("segment-"):-len(".jsonl")]))
+            path = os.path.join(self.directory, name)
+            with open(path, "rb") as f:
+                position = 0
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        break
+                    self._index(len(self.segments) - 1, position,
+                                AgentMessage.from_dict(json.loads(line)))
+                    position += len(line)
+            # Drop a record left half-written by a crash
+            if os.path.getsize(path) > position:
+                os.truncate(path, position)
+    
+    def __len__(self) -> int:
+        return len(self._positions)
+    
+    def append(self, message: AgentMessage) -> int:
+        """Append a message and return its offset."""
+        line = (json.dumps(message.to_dict(), separators=(",", ":")) + "\n").encode()
+        if self._writer is None or (self._writer.tell() > 0 and
+                                    self._writer.tell() + len(line) > self.segment_bytes):
+            if self._writer is not None:
+                self._writer.close()
+            if not self.segments or self._writer is not None:
+                self.segments.append(len(self))
+            self._writer = open(self._segment_path(self.segments[-1]), "ab")
+        position = self._writer.tell()
+        self._writer.write(line)
+        return self._index(len(self.segments) - 1, position, message)
+    
+    def flush(self):
+        if self._writer is not None:
+            self._writer.flush()
+    
+    def close(self):
+        """Close all open segment files."""
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        for reader in self._readers.values():
+            reader.close()
+        self._readers.clear()
+    
+    def read(self, offset: int) -> AgentMessage:
+        """Read the message at an offset."""
+        if not 0 <= offset < len(self):
+            raise IndexError(f"Offset out of range: {offset}")
+        self.flush()
+        segment = self._segment_of[offset]
+        reader = self._readers.get(segment)
+        if reader is None:
+            reader = self._readers[segment] = open(self._segment_path(self.segments[segment]), "rb")
+        reader.seek(self._positions[offset])
+        return AgentMessage.from_dict(json.loads(reader.readline()))
+    
+    def scan(self, start: int = 0, end: int = None) -> Iterator[tuple]:
+        """Yield (offset, message) for offsets in [start, end) in order."""
+        end = len(self) if end is None else min(end, len(self))
+        if start >= end:
+            return
+        self.flush()
+        offset = start
+        while offset < end:
+            segment = self._segment_of[offset]
+            with open(self._segment_path(self.segments[segment]), "rb") as f:
+                f.seek(self._positions[offset])
+                for line in f:
+                    yield offset, AgentMessage.from_dict(json.loads(line))
+                    offset += 1
+                    if offset >= end or self._segment_of[offset] != segment:
+                        break
+    
+    def query(self, receiver: str = None, message_type: MessageType = None,
+              since: float = None, until: float = None,
+              start: int = 0, end: int = None) -> Iterator[tuple]:
+        """
+        Yield (offset, message) for messages matching all given filters.
+        
+        The smallest applicable index is walked and other filters are
+        checked against per-offset columns before any record is read.
+        Time bounds are inclusive.
+        """
+        end = len(self) if end is None else min(end, len(self))
+        if receiver is not None:
+            if receiver not in self._by_receiver:
+                return
+            candidates = self._by_receiver[receiver]
+        elif message_type is not None:
+            candidates = self._by_type.get(message_type, array("q"))
+        else:
+            candidates = range(len(self))
+            if self._time_ordered:
+                if since is not None:
+                    start = max(start, bisect_left(self._timestamps, since))
+                if until is not None:
+                    end = min(end, bisect_right(self._timestamps, until))
+        
+        receiver_code = self._receiver_codes.get(receiver)
+        type_code = None if message_type is None else _MESSAGE_TYPE_CODES[message_type]
+        for offset in candidates[bisect_left(candidates, start):]:
+            if offset >= end:
+                break
+            if receiver is not None and self._receivers[offset] != receiver_code:
+                continue
+            if type_code is not None and self._types[offset] != type_code:
+                continue
+            timestamp = self._timestamps[offset]
+            if (since is not None and timestamp < since) or (until is not None and timestamp > until):
+                continue
+            yield offset, self.read(offset)
+    
+    def save_checkpoint(self, offset: int, state: Dict):
+        """Store state as of just before `offset` (after offsets [0, offset))."""
+        with open(self._checkpoint_path(offset), "w", encoding="utf-8") as f:
+            json.dump(state, f)
+    
+    def latest_checkpoint(self, at_or_before: int = None) -> tuple:
+        """(offset, state) of the newest checkpoint not after at_or_before, or (0, None)."""
+        offsets = sorted(
+            int(name[len("checkpoint-"):-len(".json")])
+            for name in os.listdir(self.directory)
+            if name.startswith("checkpoint-") and name.endswith(".json")
+        )
+        if at_or_before is not None:
+            offsets = offsets[:bisect_right(offsets, at_or_before)]
+        if not offsets:
+            return 0, None
+        with open(self._checkpoint_path(offsets[-1]), encoding="utf-8") as f:
+            return offsets[-1], json.load(f)
+
+
+# Multi-Process Transport
+
+_MESSAGE_TYPES = list(MessageType)
+_MESSAGE_TYPE_CODES = {message_type: i for i, message_type in enumerate(_MESSAGE_TYPES)}
+
+# version, type, flags, priority, timestamp, sender/receiver/id/reply_to
+# lengths, JSON length, blob count
+_FRAME_HEADER = struct.Struct("<BBBidHHHHII")
+_FRAME_VERSION = 1
+_FLAG_REQUIRES_RESPONSE = 1
+_FLAG_HAS_REPLY_TO = 2
+# Buffers per writev call; POSIX guarantees at least 16, Linux allows 1024
+_IOV_MAX = 1024
+
+
+def _extract_blobs(value: Any, blobs: List) -> Any:
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        blobs.append(value)
+        return {"__blob__": len(blobs) - 1}
+    if isinstance(value, dict):
+        return {key: _extract_blobs(item, blobs) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_extract_blobs(item, blobs) for item in value]
+    return value
+
+
+def _restore_blobs(value: Any, blobs: List[memoryview]) -> Any:
+    if isinstance(value, dict):
+        if len(value) == 1 and "__blob__" in value:
+            return blobs[value["__blob__"]]
+        return {key: _restore_blobs(item, blobs) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_restore_blobs(item, blobs) for item in value]
+    return value
+
+
+def encode_message(message: AgentMessage) -> List:
+    """
+    Encode a message as a list of buffers forming one frame.
+    
+    The frame is a struct-packed header, the UTF-8 string fields, the JSON
+    content and then any bytes-like content values, which are appended raw
+    instead of being JSON-escaped. The buffers are returned separately so
+    large payloads are not copied while building the frame.
+    """
+    blobs: List = []
+    content = json.dumps(_extract_blobs(message.content, blobs), separators=(",", ":")).encode()
+    strings = [
+        message.sender.encode(), message.receiver.encode(),
+        message.message_id.encode(), (message.reply_to or "").encode()
+    ]
+    flags = (_FLAG_REQUIRES_RESPONSE if message.requires_response else 0) | \
+        (_FLAG_HAS_REPLY_TO if message.reply_to is not None else 0)
+    header = _FRAME_HEADER.pack(
+        _FRAME_VERSION, _MESSAGE_TYPE_CODES[message.message_type], flags,
+        message.priority, message.timestamp,
+        *(len(item) for item in strings), len(content), len(blobs)
+    )
+    sizes = struct.pack(f"<{len(blobs)}Q", *(memoryview(blob).nbytes for blob in blobs))
+    return [header, sizes, *strings, content, *blobs]
+
+
+def decode_message(frame: Union[bytes, memoryview]) -> AgentMessage:
+    """
+    Decode a frame built by encode_message.
+    
+    Bytes-like content values come back as memoryview slices of `frame`
+    rather than copies; call bytes() on them to keep them independently.
+    """
+    view = memoryview(frame)
+    (version, type_code, flags, priority, timestamp,
+     sender_len, receiver_len, id_len, reply_len, content_len, blob_count) = \
+        _FRAME_HEADER.unpack_from(view)
+    if version != _FRAME_VERSION:
+        raise ValueError(f"Unsupported frame version: {version}")
+    
+    offset = _FRAME_HEADER.size
+    sizes = struct.unpack_from(f"<{blob_count}Q", view, offset)
+    offset += 8 * blob_count
+    
+    fields = []
+    for length in (sender_len, receiver_len, id_len, reply_len):
+        fields.append(str(view[offset:offset + length], "utf-8"))
+        offset += length
+    content = json.loads(view[offset:offset + content_len].tobytes())
+    offset += content_len
+    
+    blobs = []
+    for size in sizes:
+        blobs.append(view[offset:offset + size])
+        offset += size
+    
+    return AgentMessage(
+        sender=fields[0],
+        receiver=fields[1],
+        message_type=_MESSAGE_TYPES[type_code],
+        content=_restore_blobs(content, blobs) if blobs else content,
+        timestamp=timestamp,
+        message_id=fields[2],
+        requires_response=bool(flags & _FLAG_REQUIRES_RESPONSE),
+        priority=priority,
+        reply_to=fields[3] if flags & _FLAG_HAS_REPLY_TO else None
+    )
+
+
+def _write_frame(connection, buffers: List):
+    """
+    Write buffers to a multiprocessing Connection as a single message.
+    
+    Where os.writev exists the buffers go to the pipe as they are, behind
+    the Connection's own length header, so large blobs are never copied
+    into a joined frame. Elsewhere (Windows) they are joined and sent with
+    send_bytes.
+    """
+    views = [memoryview(buffer).cast("B") for buffer in buffers]
+    total = sum(view.nbytes for view in views)
+    if not hasattr(os, "writev") or total > 0x7fffffff:
+        connection.send_bytes(b"".join(views))
+        return
+    pending = deque(view for view in [memoryview(struct.pack("!i", total))] + views if view.nbytes)
+    fd = connection.fileno()
+    while pending:
+        written = os.writev(fd, list(itertools.islice(pending, _IOV_MAX)))
+        while written:
+            if written >= pending[0].nbytes:
+                written -= pending.popleft().nbytes
+            else:
+                pending[0] = pending[0][written:]
+                written = 0
+
+
+class ProcessAgentCommunication(AgentCommunication):
+    """
+    Communication channel for agents running in separate processes.
+    
+    Every agent id is given a one-way pipe when the channel is created;
+    the channel object is then passed to each agent process (see spawn), so
+    any process can send to any agent. Each frame is written as one
+    Connection message under a per-receiver lock (see _write_frame). A process hosts its
+    agents with `host`, which starts a daemon thread that keeps reading and
+    decoding that agent's pipe, so a sender blocked on a full pipe can never
+    deadlock against a peer that is itself waiting to send back. receive
+    moves decoded messages into the usual priority inboxes. Message history
+    only covers messages sent from the local process.
+    """
+    
+    def __init__(self, agent_ids: List[str], history_size: int = 10000):
+        super().__init__(history_size)
+        self.agent_ids = list(agent_ids)
+        self._readers = {}
+        self._writers = {}
+        self._locks = {}
+        for agent_id in self.agent_ids:
+            self._readers[agent_id], self._writers[agent_id] = multiprocessing.Pipe(duplex=False)
+            self._locks[agent_id] = multiprocessing.Lock()
+        self.processes: List[multiprocessing.Process] = []
+        self._hosted: Dict[str, queue.SimpleQueue] = {}
+    
+    def __getstate__(self):
+        # Child processes start with empty local state
+        return {
+            "agent_ids": self.agent_ids,
+            "_readers": self._readers,
+            "_writers": self._writers,
+            "_locks": self._locks,
+            "history_size": self.message_history.maxlen
+        }
+    
+    def __setstate__(self, state):
+        AgentCommunication.__init__(self, state.pop("history_size"))
+        self.__dict__.update(state)
+        self.processes = []
+        self._hosted = {}
+    
+    def host(self, agent_id: str) -> queue.SimpleQueue:
+        """Start reading an agent's pipe in this process (idempotent)."""
+        received = self._hosted.get(agent_id)
+        if received is None:
+            received = self._hosted[agent_id] = queue.SimpleQueue()
+            threading.Thread(
+                target=self._read_loop, args=(self._readers[agent_id], received), daemon=True
+            ).start()
+        return received
+    
+    @staticmethod
+    def _read_loop(reader, received: queue.SimpleQueue):
+        while True:
+            try:
+                frame = reader.recv_bytes()
+            except (EOFError, OSError):
+                return
+            received.put(decode_message(frame))
+    
+    def send(self, message: AgentMessage):
+        """Send a message to an agent in any process."""
+        if message.receiver not in self._writers:
+            raise ValueError(f"Unknown agent: {message.receiver}")
+        buffers = encode_message(message)
+        with self._locks[message.receiver]:
+            _write_frame(self._writers[message.receiver], buffers)
+        self._record(message)
+    
+    def _drain(self, agent_id: str, timeout: float = 0.0):
+        received = self.host(agent_id)
+        inbox = self.inbox.setdefault(agent_id, [])
+        try:
+            if timeout != 0:
+                heapq.heappush(inbox, self._inbox_entry(received.get(timeout=timeout)))
+            while True:
+                heapq.heappush(inbox, self._inbox_entry(received.get_nowait()))
+        except queue.Empty:
+            pass
+    
+    def receive(self, agent_id: str, max_n: int = None,
+                timeout: float = 0.0) -> List[AgentMessage]:
+        """
+        Receive messages for an agent hosted in this process, most urgent first.
+        
+        Waits up to timeout seconds (None = forever) when nothing is queued.
+        The first call hosts the agent if host was not called already.
+        """
+        self._drain(agent_id, 0.0 if self.inbox.get(agent_id) else timeout)
+        return super().receive(agent_id, max_n)
+    
+    def pending(self, agent_id: str) -> int:
+        self._drain(agent_id)
+        return super().pending(agent_id)
+    
+    def take_reply(self, agent_id: str, message_id: str,
+                   fallback: Callable[[AgentMessage], bool] = None) -> Optional[AgentMessage]:
+        self._drain(agent_id)
+        return super().take_reply(agent_id, message_id, fallback)
+    
+    def wait_reply(self, agent_id: str, message_id: str, timeout: float = None,
+                   fallback: Callable[[AgentMessage], bool] = None) -> Optional[AgentMessage]:
+        """take_reply, blocking on the agent's pipe for up to timeout seconds."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            reply = self.take_reply(agent_id, message_id, fallback)
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if reply is not None or (remaining is not None and remaining <= 0):
+                return reply
+            self._drain(agent_id, remaining)
+    
+    def spawn(self, agent_id: str, target: Callable, *args) -> multiprocessing.Process:
+        """Start target(channel, agent_id, *args) in a new daemon process hosting agent_id."""
+        process = multiprocessing.Process(
+            target=_run_hosted_agent, args=(self, agent_id, target) + args, daemon=True
+        )
+        process.start()
+        self.processes.append(process)
+        return process
+    
+    def join(self, timeout: float = None):
+        """Wait for spawned agent processes to exit."""
+        for process in self.processes:
+            process.join(timeout)
+
+
+def _run_hosted_agent(channel: ProcessAgentCommunication, agent_id: str,
+                      target: Callable, *args):
+    channel.host(agent_id)
+    target(channel, agent_id, *args)
+
+
+def _echo_agent(channel: ProcessAgentCommunication, agent_id: str):
+    """Benchmark agent: reply to every request until told to stop."""
+    while True:
+        for message in channel.receive(agent_id, timeout=None):
+            if message.content.get("action") == "stop":
+                return
+            if message.requires_response:
+                channel.reply(message, {"status": "ok"})
+
+
+def benchmark_transport(num_messages: int = 20000, payload_bytes: int = 0) -> Dict:
+    """
+    Compare round-trip throughput of the in-process and multi-process channels.
+    
+    Each round trip is a request carrying a bytes payload of payload_bytes,
+    received by an echo agent, plus its reply received back by the client.
+    In process, the echo agent runs inline on AgentCommunication; across
+    processes it runs in a child process, with up to 1000 requests in
+    flight. Rates are in round trips per second.
+    """
+    payload = bytes(payload_bytes)
+    
+    local = AgentCommunication(history_size=1000)
+    start = time.perf_counter()
+    for i in range(num_messages):
+        local.send(AgentMessage("client", "echo", MessageType.REQUEST,
+                                {"i": i, "payload": payload}, requires_response=True))
+        for message in local.receive("echo", 1):
+            local.reply(message, {"status": "ok"})
+        local.receive("client", 1)
+    local_rate = num_messages / (time.perf_counter() - start)
+    
+    channel = ProcessAgentCommunication(["client", "echo"], history_size=1000)
+    channel.host("client")
+    channel.spawn("echo", _echo_agent)
+    start = time.perf_counter()
+    received = 0
+    for i in range(num_messages):
+        channel.send(AgentMessage("client", "echo", MessageType.REQUEST,
+                                  {"i": i, "payload": payload}, requires_response=True))
+        if i - received >= 1000:
+            received += len(channel.receive("client", timeout=None))
+    while received < num_messages:
+        received += len(channel.receive("client", timeout=None))
+    process_rate = num_messages / (time.perf_counter() - start)
+    channel.send(AgentMessage("client", "echo", MessageType.ALERT, {"action": "stop"}))
+    channel.join(5)
+    
+    return {
+        "messages": num_messages,
+        "payload_bytes": payload_bytes,
+        "in_process_per_second": local_rate,
+        "multi_process_per_second": process_rate
+    }
+
+
 # Supervisor Pattern Implementation
 
+class WorkerScheduler:
+    """
+    Load-aware worker selection indexed by capability.
+    
+    Each capability (plus the wildcard None for "any worker") has a min-heap
+    of available workers keyed on EWMA response time scaled by queue depth,
+    then queue depth and tasks completed; workers without a measured
+    response time score zero and are tried first, least loaded first.
+    Entries are invalidated lazily with a version that is never reused, so
+    select, begin and finish are O(k log n) for a worker with k
+    capabilities. Workers accept up to `capacity` tasks; queued tasks can be
+    stolen by idle peers that share the task's capability. A task's
+    capability is its "type" key or attribute; tasks without one can be
+    stolen by any worker. Several sources (the supervisor's worker status,
+    a circuit breaker) can take a worker out of selection independently;
+    it is selectable only while none of them does.
+    """
+    
+    def __init__(self, alpha: float = 0.3, capacity: int = 1):
+        self.alpha = alpha
+        self.capacity = capacity
+        self.workers: Dict[str, Dict] = {}
+        self.index: Dict[Optional[str], List[tuple]] = {None: []}
+        self._members: Dict[Optional[str], int] = {None: 0}
+        # Max-heap on depth, used to find steal victims
+        self._loaded: List[tuple] = []
+        self._sequence = itertools.count()
+        # Shared by all workers so a re-registered worker never reuses a version
+        self._versions = itertools.count(1)
+    
+    def register(self, worker_id: str, capabilities: List[str], capacity: int = None):
+        """Add a worker, or re-register it with new capabilities."""
+        if worker_id in self.workers:
+            self.unregister(worker_id)
+        self.workers[worker_id] = {
+            "capabilities": list(capabilities),
+            "capacity": capacity or self.capacity,
+            "ewma": 0.0,
+            "depth": 0,
+            "completed": 0,
+            "queue": deque(),
+            # Sources that take the worker out of selection, and those that
+            # only let a single task through (see admit_once)
+            "disabled": set(),
+            "admit_once": set(),
+            "version": next(self._versions),
+            "order": next(self._sequence)
+        }
+        for capability in [None] + list(capabilities):
+            self.index.setdefault(capability, [])
+            self._members[capability] = self._members.get(capability, 0) + 1
+        self._reindex(worker_id)
+    
+    def unregister(self, worker_id: str) -> List[Any]:
+        """Remove a worker, returning any tasks still queued on it."""
+        worker = self.workers.pop(worker_id)
+        for capability in [None] + worker["capabilities"]:
+            self._members[capability] -= 1
+        return list(worker["queue"])
+    
+    def set_enabled(self, worker_id: str, enabled: bool, source: str = "status"):
+        """
+        Take a worker out of (or back into) selection on behalf of `source`,
+        without forgetting its stats. Other sources' flags are unaffected.
+        """
+        worker = self.workers[worker_id]
+        if enabled:
+            worker["disabled"].discard(source)
+        else:
+            worker["disabled"].add(source)
+        worker["admit_once"].discard(source)
+        self._reindex(worker_id)
+    
+    def admit_once(self, worker_id: str, source: str):
+        """
+        Let `source` put a worker back into selection for a single task:
+        the next begin on it disables the worker for `source` again.
+        """
+        worker = self.workers[worker_id]
+        worker["disabled"].discard(source)
+        worker["admit_once"].add(source)
+        self._reindex(worker_id)
+    
+    def is_enabled(self, worker_id: str, source: str = None) -> bool:
+        """Whether `source` (any source when None) leaves the worker in selection."""
+        disabled = self.workers[worker_id]["disabled"]
+        return not disabled if source is None else source not in disabled
+    
+    def is_available(self, worker_id: str) -> bool:
+        worker = self.workers[worker_id]
+        return not worker["disabled"] and worker["depth"] < worker["capacity"]
+    
+    def _claim(self, worker: Dict):
+        worker["depth"] += 1
+        if worker["admit_once"]:
+            worker["disabled"] |= worker["admit_once"]
+            worker["admit_once"].clear()
+    
+    def _score(self, worker: Dict) -> tuple:
+        return (worker["ewma"] * (worker["depth"] + 1), worker["depth"], worker["completed"], worker["order"])
+    
+    def _reindex(self, worker_id: str):
+        worker = self.workers[worker_id]
+        worker["version"] = next(self._versions)
+        if worker["depth"]:
+            heapq.heappush(self._loaded, (-worker["depth"], worker["order"], worker["version"], worker_id))
+            # Each worker has at most one current entry; drop the stale ones
+            if len(self._loaded) > 2 * len(self.workers) + 64:
+                self._loaded = [e for e in self._loaded if self._is_loaded(e)]
+                heapq.heapify(self._loaded)
+        if not self.is_available(worker_id):
+            return
+        entry = self._score(worker) + (worker["version"], worker_id)
+        for capability in [None] + worker["capabilities"]:
+            heap = self.index[capability]
+            heapq.heappush(heap, entry)
+            # Rebuild once stale entries dominate the heap
+            if len(heap) > 4 * self._members[capability] + 64:
+                self.index[capability] = [e for e in heap if self._is_current(e)]
+                heapq.heapify(self.index[capability])
+    
+    def _is_current(self, entry: tuple) -> bool:
+        worker = self.workers.get(entry[-1])
+        return worker is not None and worker["version"] == entry[-2] and self.is_available(entry[-1])
+    
+    def _is_loaded(self, entry: tuple) -> bool:
+        worker = self.workers.get(entry[-1])
+        return worker is not None and worker["version"] == entry[2]
+    
+    @staticmethod
+    def _task_type(task: Any) -> Optional[str]:
+        if isinstance(task, dict):
+            return task.get("type")
+        return getattr(task, "type", None)
+    
+    def select(self, capability: str = None) -> Optional[str]:
+        """Least-loaded available worker with a capability (None = any), or None."""
+        heap = self.index.get(capability)
+        while heap:
+            if self._is_current(heap[0]):
+                return heap[0][-1]
+            heapq.heappop(heap)
+        return None
+    
+    def begin(self, worker_id: str, task: Any = None):
+        """Count a task against a worker; `task` is queued there when given."""
+        worker = self.workers[worker_id]
+        self._claim(worker)
+        if task is not None:
+            worker["queue"].append(task)
+        self._reindex(worker_id)
+    
+    def finish(self, worker_id: str, elapsed: float = None):
+        """Release a worker's task slot and fold its response time into the EWMA."""
+        worker = self.workers[worker_id]
+        worker["depth"] = max(worker["depth"] - 1, 0)
+        if elapsed is not None:
+            worker["completed"] += 1
+            worker["ewma"] = elapsed if worker["completed"] == 1 else \
+                self.alpha * elapsed + (1 - self.alpha) * worker["ewma"]
+        self._reindex(worker_id)
+    
+    def next_task(self, worker_id: str, steal: bool = True, max_scan: int = 16) -> Any:
+        """
+        Take the next queued task for a worker.
+        
+        When its own queue is empty and steal is set, the most loaded peers
+        (up to max_scan of them) are checked for a queued task, taken from
+        the tail, whose "type" this worker can handle. Returns None if
+        nothing is available.
+        """
+        worker = self.workers[worker_id]
+        if worker["queue"]:
+            return worker["queue"].popleft()
+        if not steal:
+            return None
+        
+        capabilities = set(worker["capabilities"]) | {None}
+        skipped = []
+        task = None
+        while self._loaded and len(skipped) < max_scan:
+            entry = heapq.heappop(self._loaded)
+            victim_id = entry[-1]
+            if not self._is_loaded(entry):
+                continue
+            victim = self.workers[victim_id]
+            skipped.append(entry)
+            if victim_id != worker_id and victim["queue"] and \
+                    self._task_type(victim["queue"][-1]) in capabilities:
+                task = victim["queue"].pop()
+                victim["depth"] -= 1
+                self._reindex(victim_id)
+                self._claim(worker)
+                self._reindex(worker_id)
+                break
+        for entry in skipped:
+            if self._is_loaded(entry):
+                heapq.heappush(self._loaded, entry)
+        return task
+
+
 class SupervisorAgent:
     """
     Central supervisor agent that coordinates worker agents.
@@ -80,28 +1048,48 @@ class SupervisorAgent:
         self.task_queue: List[Dict] = []
         self.completed_tasks: List[Dict] = []
         self.current_state: Dict = {}
+        # (timestamp, worker, old status, new status, task id), most recent last
+        self.status_log: deque = deque(maxlen=1000)
+        self.scheduler = WorkerScheduler()
     
     def register_worker(self, worker_id: str, capabilities: List[str]):
-        """Register a worker agent with the supervisor."""
+        """Register a worker agent with the supervisor, logging it for replay."""
+        self._add_worker(worker_id, capabilities)
+        self.communication.log_event(AgentMessage(
+            sender=self.name,
+            receiver=self.name,
+            message_type=MessageType.REQUEST,
+            content={"action": "register_worker", "worker": worker_id,
+                     "capabilities": list(capabilities)}
+        ))
+    
+    def _add_worker(self, worker_id: str, capabilities: List[str]):
         self.workers[worker_id] = {
             "capabilities": capabilities,
             "status": "available",
             "current_task": None,
             "metrics": {"tasks_completed": 0, "avg_response_time": 0}
         }
+        self.scheduler.register(worker_id, capabilities)
     
     def decompose_task(self, task: Dict) -> List[Dict]:
         """
         Decompose a task into subtasks.
         
-        In production, this would use task analysis and planning.
+        In production, this would use task analysis and planning. A task may
+        also carry its own "subtasks" list; each subtask's "depends_on" lists
+        the ids that must finish first.
         """
         subtasks = []
         
         # Simple decomposition based on task type
         task_type = task.get("type", "general")
         
-        if task_type == "research":
+        if task.get("subtasks"):
+            subtasks = [dict(subtask) for subtask in task["subtasks"]]
+            for subtask in subtasks:
+                subtask.setdefault("depends_on", [])
+        elif task_type == "research":
             subtasks = [
                 {"type": "search", "description": "Gather information"},
                 {"type": "analyze", "description": "Analyze findings"},
@@ -119,21 +1107,53 @@ class SupervisorAgent:
             ]
         
         # Add parent task info
-        for subtask in subtasks:
+        for i, subtask in enumerate(subtasks):
+            subtask.setdefault("id", f"{task.get('id', 'task')}-{i}")
             subtask["parent_task"] = task.get("id")
-            subtask["priority"] = task.get("priority", 0)
+            subtask.setdefault("priority", task.get("priority", 0))
+            # Built-in stages only see the task itself, not each other's
+            # results, so none of them has to wait for another
+            subtask.setdefault("depends_on", [])
         
         return subtasks
     
-    def assign_task(self, subtask: Dict, worker_id: str):
+    def set_worker_status(self, worker_id: str, status: str, task_id: str = None,
+                          elapsed: float = None, timestamp: float = None):
+        """
+        Move a worker to a new status, recording the transition in status_log
+        (at timestamp, now by default) and keeping the scheduler's load in
+        step. Only "available" workers are selectable, and only while no
+        other source, such as an AgentFailureHandler's breaker, has taken
+        them out of the scheduler's selection.
+        """
+        worker = self.workers[worker_id]
+        previous = worker["status"]
+        timestamp = time.time() if timestamp is None else timestamp
+        self.status_log.append((timestamp, worker_id, previous, status, task_id))
+        worker["status"] = status
+        worker["current_task"] = task_id
+        
+        if status == "busy" and previous != "busy":
+            self.scheduler.begin(worker_id)
+        elif previous == "busy" and status != "busy":
+            self.scheduler.finish(worker_id, elapsed)
+        self.scheduler.set_enabled(worker_id, status in ("available", "busy"))
+    
+    def complete_task(self, worker_id: str, elapsed: float, timestamp: float = None):
+        """Mark a worker available again and update its response metrics."""
+        metrics = self.workers[worker_id]["metrics"]
+        metrics["tasks_completed"] += 1
+        metrics["avg_response_time"] += (elapsed - metrics["avg_response_time"]) / metrics["tasks_completed"]
+        self.set_worker_status(worker_id, "available", elapsed=elapsed, timestamp=timestamp)
+    
+    def assign_task(self, subtask: Dict, worker_id: str) -> AgentMessage:
         """Assign a subtask to a worker agent."""
         if worker_id not in self.workers:
             raise ValueError(f"Unknown worker: {worker_id}")
         
-        self.workers[worker_id]["status"] = "busy"
-        self.workers[worker_id]["current_task"] = subtask["id"]
+        self.set_worker_status(worker_id, "busy", subtask["id"])
         
-        self.send(AgentMessage(
+        message = AgentMessage(
             sender=self.name,
             receiver=worker_id,
             message_type=MessageType.REQUEST,
@@ -143,31 +1163,29 @@ class SupervisorAgent:
             },
             requires_response=True,
             priority=subtask.get("priority", 0)
-        ))
+        )
+        self.send(message)
+        return message
     
     def select_worker(self, subtask: Dict) -> str:
-        """Select the best worker for a subtask."""
-        required_capability = subtask.get("type", "general")
+        """
+        Select the best worker for a subtask.
         
-        # Find available workers with required capability
-        candidates = [
-            wid for wid, info in self.workers.items()
-            if info["status"] == "available"
-            and required_capability in info["capabilities"]
-        ]
+        Prefers available workers with the required capability, falling
+        back to any available worker; among those, the lowest EWMA response
+        time scaled by load wins (see WorkerScheduler).
+        """
+        required_capability = subtask.get("type", "general")
         
-        if not candidates:
+        worker = self.scheduler.select(required_capability)
+        if worker is None:
             # Fall back to any available worker
-            candidates = [
-                wid for wid, info in self.workers.items()
-                if info["status"] == "available"
-            ]
+            worker = self.scheduler.select(None)
         
-        if not candidates:
+        if worker is None:
             raise ValueError("No available workers")
         
-        # Select based on metrics (fewest tasks completed = most available)
-        return min(candidates, key=lambda w: self.workers[w]["metrics"]["tasks_completed"])
+        return worker
     
     def aggregate_results(self, subtask_results: List[Dict]) -> Dict:
         """Aggregate results from subtasks."""
@@ -192,17 +1210,15 @@ class SupervisorAgent:
         # Decompose task
         subtasks = self.decompose_task(task)
         
-        # Assign subtasks
+        # Assign subtasks, freeing each worker as soon as its result arrives
         results = []
+        in_flight: Dict[str, tuple] = {}
         for subtask in subtasks:
+            results.extend(self._collect_results(in_flight))
             worker = self.select_worker(subtask)
-            self.assign_task(subtask, worker)
-            
-            # Wait for result
-            messages = self.receive(self.name)
-            for msg in messages:
-                if msg.message_type == MessageType.RESPONSE:
-                    results.append(msg.content)
+            message = self.assign_task(subtask, worker)
+            in_flight[message.message_id] = (worker, time.monotonic())
+        results.extend(self._collect_results(in_flight))
         
         # Aggregate results
         final_result = self.aggregate_results(results)
@@ -214,54 +1230,629 @@ class SupervisorAgent:
             "success": final_result["quality_score"] >= 0.8
         }
     
+    def _collect_results(self, in_flight: Dict[str, tuple]) -> List[Dict]:
+        """
+        Take delivered responses to in-flight assignments and complete their
+        workers. Responses without reply_to are matched to their sender's
+        assignment.
+        """
+        results = []
+        for msg in self.communication.receive(self.name):
+            if msg.message_type != MessageType.RESPONSE:
+                continue
+            message_id = msg.reply_to
+            if message_id is None:
+                message_id = next((m for m, (w, _) in in_flight.items() if w == msg.sender), None)
+            if message_id in in_flight:
+                worker, started = in_flight.pop(message_id)
+                self.complete_task(worker, time.monotonic() - started)
+            results.append(msg.content)
+        return results
+    
+    async def run_workflow_async(self, task: Dict, timeout: float = 30.0) -> Dict:
+        """
+        Execute a workflow over an AsyncAgentCommunication channel.
+        
+        Subtasks run concurrently (asyncio.gather), each starting once its
+        depends_on subtasks have succeeded and a worker is free; its request
+        carries the dependencies' results under "inputs". A subtask that gets
+        no reply within timeout is recorded as failed and counted against
+        the worker's metrics (see record_failure), but the worker stays busy
+        until its late reply arrives, since it may still be running the task.
+        A subtask that waits longer than timeout for a free worker fails too.
+        """
+        subtasks = self.decompose_task(task)
+        by_id = {subtask["id"]: subtask for subtask in subtasks}
+        for subtask in subtasks:
+            for dependency in subtask.get("depends_on", []):
+                if dependency not in by_id:
+                    raise ValueError(f"Unknown dependency {dependency} for {subtask['id']}")
+        # Subtasks on a cycle would wait for each other forever
+        waiting = {task_id: set(subtask.get("depends_on", [])) for task_id, subtask in by_id.items()}
+        ready = [task_id for task_id, dependencies in waiting.items() if not dependencies]
+        while ready:
+            done = ready.pop()
+            for task_id, dependencies in waiting.items():
+                if done in dependencies:
+                    dependencies.discard(done)
+                    if not dependencies:
+                        ready.append(task_id)
+            del waiting[done]
+        if waiting:
+            raise ValueError("Subtask dependencies contain a cycle")
+        
+        loop = asyncio.get_running_loop()
+        finished = {task_id: loop.create_future() for task_id in by_id}
+        results: Dict[str, Dict] = {}
+        freed = asyncio.Event()
+        
+        def release(worker: str, started: float):
+            self.complete_task(worker, time.monotonic() - started)
+            freed.set()
+        
+        async def acquire(subtask: Dict) -> Optional[str]:
+            deadline = loop.time() + timeout
+            while True:
+                try:
+                    return self.select_worker(subtask)
+                except ValueError:
+                    if not any(w["status"] == "busy" for w in self.workers.values()):
+                        raise
+                freed.clear()
+                try:
+                    await asyncio.wait_for(freed.wait(), deadline - loop.time())
+                except asyncio.TimeoutError:
+                    return None
+        
+        async def run(subtask: Dict) -> Dict:
+            dependencies = subtask.get("depends_on", [])
+            await asyncio.gather(*(finished[dependency] for dependency in dependencies))
+            failed = [d for d in dependencies if not results[d].get("success")]
+            if failed:
+                return {"success": False, "error": "dependency_failed",
+                        "subtask": subtask["id"], "failed_dependencies": failed}
+            
+            worker = await acquire(subtask)
+            if worker is None:
+                return {"success": False, "error": "no_available_worker", "subtask": subtask["id"]}
+            self.set_worker_status(worker, "busy", subtask["id"])
+            started = time.monotonic()
+            request = loop.create_task(self.communication.request(AgentMessage(
+                sender=self.name,
+                receiver=worker,
+                message_type=MessageType.REQUEST,
+                content={"action": "execute_task", "task": self._with_inputs(subtask, results)},
+                requires_response=True,
+                priority=subtask.get("priority", 0)
+            )))
+            try:
+                # Shielded so the request keeps waiting for a late reply
+                reply = await asyncio.wait_for(asyncio.shield(request), timeout)
+            except asyncio.TimeoutError:
+                self.record_failure(worker, subtask["id"], "timeout")
+                
+                def late_reply(done: asyncio.Task):
+                    # Cancelled when the loop shuts down before the worker replies
+                    if not done.cancelled():
+                        done.exception()
+                        release(worker, started)
+                request.add_done_callback(late_reply)
+                return {"success": False, "error": "timeout", "subtask": subtask["id"]}
+            release(worker, started)
+            return reply.content
+        
+        async def settle(subtask: Dict):
+            try:
+                results[subtask["id"]] = await run(subtask)
+            except BaseException as e:
+                finished[subtask["id"]].set_exception(e)
+                raise
+            finished[subtask["id"]].set_result(None)
+        
+        await asyncio.gather(*(settle(subtask) for subtask in subtasks))
+        
+        subtask_results = [results[subtask["id"]] for subtask in subtasks]
+        final_result = self.aggregate_results(subtask_results)
+        
+        return {
+            "task": task,
+            "subtask_results": subtask_results,
+            "final_result": final_result,
+            "success": final_result["quality_score"] >= 0.8
+        }
+    
+    def record_failure(self, worker_id: str, task_id: str, reason: str):
+        """
+        Count a failed attempt against a worker's metrics without changing
+        its status (it may still be running the task).
+        """
+        metrics = self.workers[worker_id]["metrics"]
+        metrics["tasks_failed"] = metrics.get("tasks_failed", 0) + 1
+        metrics["last_failure"] = {"task": task_id, "reason": reason}
+    
+    def snapshot(self) -> Dict:
+        """JSON-serializable supervisor state, for replay checkpoints."""
+        return json.loads(json.dumps({
+            "workers": self.workers,
+            "completed_tasks": self.completed_tasks,
+            "current_state": self.current_state
+        }))
+    
+    def restore(self, snapshot: Dict):
+        """Replace supervisor state with a snapshot, re-registering workers."""
+        self.workers = {}
+        self.scheduler = WorkerScheduler()
+        for worker_id, worker in snapshot["workers"].items():
+            self._add_worker(worker_id, worker["capabilities"])
+            self.workers[worker_id].update(worker)
+            if worker["status"] == "busy":
+                self.scheduler.begin(worker_id)
+            elif worker["status"] != "available":
+                self.scheduler.set_enabled(worker_id, False)
+        self.completed_tasks = list(snapshot["completed_tasks"])
+        self.current_state = dict(snapshot["current_state"])
+    
+    def _is_registration(self, message: AgentMessage) -> bool:
+        return message.sender == self.name and message.receiver == self.name \
+            and message.content.get("action") == "register_worker"
+    
+    def apply_event(self, message: AgentMessage):
+        """
+        Apply the supervisor-side effect of a logged message without side effects.
+        
+        A logged registration adds its worker; a task request from this
+        supervisor marks its worker busy; a response from that worker marks
+        it available again, updates its metrics using message timestamps
+        and records the result in completed_tasks. Other messages are
+        ignored.
+        """
+        if self._is_registration(message):
+            self._add_worker(message.content["worker"], message.content["capabilities"])
+        elif message.sender == self.name and message.message_type == MessageType.REQUEST \
+                and message.content.get("action") == "execute_task" \
+                and message.receiver in self.workers:
+            self.set_worker_status(message.receiver, "busy", message.content["task"].get("id"),
+                                   timestamp=message.timestamp)
+            self.workers[message.receiver]["assigned_at"] = message.timestamp
+        elif message.receiver == self.name and message.message_type == MessageType.RESPONSE \
+                and self.workers.get(message.sender, {}).get("status") == "busy":
+            worker = self.workers[message.sender]
+            task_id = worker["current_task"]
+            self.complete_task(message.sender, message.timestamp - worker.get("assigned_at", message.timestamp),
+                               message.timestamp)
+            self.completed_tasks.append({"task": task_id, "worker": message.sender, "result": message.content})
+    
+    def replay(self, log: MessageLog, until: int = None, fast_forward: bool = True,
+               checkpoint_every: int = None, deliver: bool = False) -> int:
+        """
+        Rebuild supervisor state from a MessageLog, up to (excluding) offset `until`.
+        
+        With fast_forward, state is restored from the newest checkpoint at or
+        before `until` and only later messages are applied; without a
+        checkpoint, workers, completed_tasks and current_state are reset and
+        the whole log is applied, worker registrations included. checkpoint_every
+        writes new checkpoints while replaying. With deliver, replayed
+        messages are also sent through this supervisor's channel so inboxes
+        match the original run (registration events, never delivered, are
+        skipped); they are not recorded again, so a channel
+        writing to `log` itself is safe. Status changes carry the logged
+        message timestamps, so replays are deterministic. Returns the offset
+        replay stopped at.
+        """
+        until = len(log) if until is None else min(until, len(log))
+        start, state = log.latest_checkpoint(until) if fast_forward else (0, None)
+        self.restore(state if state is not None else
+                     {"workers": {}, "completed_tasks": [], "current_state": {}})
+        
+        with self.communication.unrecorded():
+            for offset, message in log.scan(start, until):
+                self.apply_event(message)
+                if deliver and not self._is_registration(message):
+                    self.communication.send(message)
+                if checkpoint_every and (offset + 1) % checkpoint_every == 0:
+                    log.save_checkpoint(offset + 1, self.snapshot())
+        return until
+    
+    def iter_workflow(self, task: Dict, execute: Callable[[str, Dict], Dict],
+                      executor: Executor = None, max_workers: int = None) -> Iterator[Dict]:
+        """
+        Run a task's subtasks as a dependency DAG, yielding progress as they finish.
+        
+        Every subtask whose dependencies have succeeded is dispatched to a
+        free worker (chosen by select_worker) and executed as
+        execute(worker_id, subtask) on `executor`, a thread pool by default.
+        The subtask passed to execute is a copy whose "inputs" maps each of
+        its depends_on ids to that dependency's result.
+        Independent subtasks therefore run concurrently and end-to-end time
+        follows the critical path. Subtasks whose dependencies failed are
+        skipped. Each yielded update carries the subtask result and a
+        running partial aggregate; the last one has "done": True and the
+        final result.
+        """
+        subtasks = {subtask["id"]: subtask for subtask in self.decompose_task(task)}
+        dependents: Dict[str, List[str]] = {task_id: [] for task_id in subtasks}
+        waiting: Dict[str, int] = {}
+        for task_id, subtask in subtasks.items():
+            for dependency in subtask.get("depends_on", []):
+                if dependency not in subtasks:
+                    raise ValueError(f"Unknown dependency {dependency} for {task_id}")
+                dependents[dependency].append(task_id)
+            waiting[task_id] = len(subtask.get("depends_on", []))
+        
+        order = {task_id: i for i, task_id in enumerate(subtasks)}
+        ready = [(-subtasks[t]["priority"], order[t], t) for t, n in waiting.items() if n == 0]
+        heapq.heapify(ready)
+        
+        results: Dict[str, Dict] = {}
+        finish_times: Dict[str, float] = {}
+        summaries: List[str] = []
+        successes = 0
+        start = time.monotonic()
+        
+        own_executor = executor is None
+        if own_executor:
+            executor = ThreadPoolExecutor(max_workers or max(len(self.workers), 1))
+        running = {}
+        
+        def settle(task_id: str, result: Dict) -> Dict:
+            nonlocal successes
+            results[task_id] = result
+            finish_times[task_id] = time.monotonic() - start
+            if result.get("success"):
+                successes += 1
+                summaries.append(result.get("summary", ""))
+            for dependent in dependents[task_id]:
+                waiting[dependent] -= 1
+                if waiting[dependent] == 0:
+                    heapq.heappush(ready, (-subtasks[dependent]["priority"], order[dependent], dependent))
+            return {
+                "done": False,
+                "subtask_id": task_id,
+                "result": result,
+                "completed": len(results),
+                "total": len(subtasks),
+                "partial": {
+                    "summary": " | ".join(summaries),
+                    "quality_score": successes / len(results)
+                }
+            }
+        
+        try:
+            while len(results) < len(subtasks):
+                # Dispatch ready subtasks while workers are free
+                deferred = []
+                while ready:
+                    entry = heapq.heappop(ready)
+                    subtask = subtasks[entry[2]]
+                    failed = [d for d in subtask.get("depends_on", []) if not results[d].get("success")]
+                    if failed:
+                        yield settle(subtask["id"], {
+                            "success": False, "error": "dependency_failed",
+                            "subtask": subtask["id"], "failed_dependencies": failed
+                        })
+                        continue
+                    try:
+                        worker = self.select_worker(subtask)
+                    except ValueError:
+                        deferred.append(entry)
+                        break
+                    self.set_worker_status(worker, "busy", subtask["id"])
+                    future = executor.submit(execute, worker, self._with_inputs(subtask, results))
+                    running[future] = (subtask["id"], worker, time.monotonic())
+                for entry in deferred:
+                    heapq.heappush(ready, entry)
+                
+                if not running:
+                    if len(results) == len(subtasks):
+                        break
+                    if ready:
+                        raise ValueError("No available workers")
+                    raise ValueError("Subtask dependencies contain a cycle")
+                
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    task_id, worker, started = running.pop(future)
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        result = {"success": False, "error": str(e), "subtask": task_id}
+                    self.complete_task(worker, time.monotonic() - started)
+                    yield settle(task_id, result)
+        finally:
+            if own_executor:
+                executor.shutdown(wait=False, cancel_futures=True)
+        
+        final_result = self.aggregate_results([results[task_id] for task_id in subtasks])
+        self.completed_tasks.append({"task": task.get("id"), "quality_score": final_result["quality_score"]})
+        yield {
+            "done": True,
+            "task": task,
+            "subtask_results": [results[task_id] for task_id in subtasks],
+            "final_result": final_result,
+            "success": final_result["quality_score"] >= 0.8,
+            "elapsed": time.monotonic() - start,
+            "finish_times": finish_times
+        }
+    
+    @staticmethod
+    def _with_inputs(subtask: Dict, results: Dict[str, Dict]) -> Dict:
+        """Copy of a subtask carrying its dependencies' results under "inputs"."""
+        return {**subtask, "inputs": {dependency: results[dependency]
+                                      for dependency in subtask.get("depends_on", [])}}
+    
+    def run_workflow_parallel(self, task: Dict, execute: Callable[[str, Dict], Dict],
+                              executor: Executor = None, max_workers: int = None) -> Dict:
+        """Run iter_workflow to completion and return its final result."""
+        update = None
+        for update in self.iter_workflow(task, execute, executor, max_workers):
+            pass
+        return update
+    
     def send(self, message: AgentMessage):
         """Send message through communication channel."""
         self.communication.send(message)
 
 
+def benchmark_worker_selection(num_workers: int = 10000, num_tasks: int = 100000,
+                               num_capabilities: int = 20, seed: int = 0) -> Dict:
+    """
+    Measure assignment throughput of WorkerScheduler.
+    
+    Workers get 1-3 random capabilities; each task selects a worker, starts
+    it and, once num_workers // 2 tasks are in flight, finishes the oldest
+    with a random response time. Returns assignments per second.
+    """
+    rng = random.Random(seed)
+    capabilities = [f"cap{i}" for i in range(num_capabilities)]
+    scheduler = WorkerScheduler()
+    for i in range(num_workers):
+        scheduler.register(f"worker{i}", rng.sample(capabilities, rng.randint(1, 3)))
+    
+    task_types = [rng.choice(capabilities) for _ in range(num_tasks)]
+    in_flight = deque()
+    assigned = 0
+    
+    start = time.perf_counter()
+    for task_type in task_types:
+        worker = scheduler.select(task_type) or scheduler.select(None)
+        if worker is not None:
+            scheduler.begin(worker)
+            in_flight.append(worker)
+            assigned += 1
+        if len(in_flight) >= num_workers // 2:
+            scheduler.finish(in_flight.popleft(), rng.expovariate(1.0))
+    elapsed = time.perf_counter() - start
+    
+    return {
+        "workers": num_workers,
+        "tasks": num_tasks,
+        "assigned": assigned,
+        "seconds": elapsed,
+        "assignments_per_second": assigned / elapsed if elapsed else 0.0
+    }
+
+
 # Handoff Protocol
 
+def _require_json(value: Any):
+    """Raise TypeError unless value survives a JSON round trip unchanged."""
+    if isinstance(value, dict):
+        for key, item in value.items():
+            if not isinstance(key, str):
+                raise TypeError(f"Context keys must be strings, not {type(key).__name__}")
+            _require_json(item)
+    elif isinstance(value, list):
+        for item in value:
+            _require_json(item)
+    elif not (value is None or isinstance(value, (str, int, float, bool))):
+        raise TypeError(f"Context values must be JSON types, not {type(value).__name__}")
+
+
+class ContextStore:
+    """
+    Content-addressed store for transferred contexts.
+    
+    Contexts are stored as Merkle trees: every dict becomes a node mapping
+    keys to child digests, and every other value a JSON leaf, each keyed by
+    the SHA-256 of its canonical encoding. A new version of a context only
+    adds the nodes that changed, and two versions can be diffed by walking
+    their trees while skipping identical subtrees. Scalar leaves remember
+    their digest by identity until the next put, so a new version that
+    shares strings with the previous one does not re-encode or re-hash them.
+    """
+    
+    def __init__(self):
+        self.blobs: Dict[str, bytes] = {}
+        # id(leaf) -> (leaf, digest) for scalar leaves of the last put
+        self._leaf_digests: Dict[int, tuple] = {}
+    
+    def put(self, value: Any) -> str:
+        """
+        Store a JSON value and return its digest.
+        
+        Raises TypeError for anything JSON would not round-trip unchanged,
+        such as sets, tuples or non-string keys.
+        """
+        previous, self._leaf_digests = self._leaf_digests, {}
+        return self._put(value, previous)
+    
+    def _put(self, value: Any, previous: Dict[int, tuple]) -> str:
+        if isinstance(value, dict) and value:
+            tree = {}
+            for key, item in value.items():
+                if not isinstance(key, str):
+                    raise TypeError(f"Context keys must be strings, not {type(key).__name__}")
+                tree[key] = self._put(item, previous)
+            return self._store({"tree": tree})
+        if value is None or isinstance(value, (str, int, float, bool)):
+            cached = previous.get(id(value))
+            if cached is not None and cached[0] is value:
+                digest = cached[1]
+            else:
+                digest = self._store({"value": value})
+            self._leaf_digests[id(value)] = (value, digest)
+            return digest
+        _require_json(value)
+        return self._store({"value": value})
+    
+    def _store(self, node: Dict) -> str:
+        encoded = json.dumps(node, sort_keys=True, separators=(",", ":")).encode()
+        digest = hashlib.sha256(encoded).hexdigest()
+        if digest not in self.blobs:
+            self.blobs[digest] = encoded
+        return digest
+    
+    def node(self, digest: str) -> Dict:
+        try:
+            return json.loads(self.blobs[digest])
+        except KeyError:
+            raise KeyError(f"Unknown context blob: {digest}") from None
+    
+    def get(self, digest: str) -> Any:
+        """Rebuild the value stored under a digest."""
+        node = self.node(digest)
+        if "tree" in node:
+            return {key: self.get(child) for key, child in node["tree"].items()}
+        return node["value"]
+    
+    def diff(self, old: Optional[str], new: str) -> List[list]:
+        """
+        Structural patch turning version `old` into version `new`.
+        
+        Entries are [path, digest] to set a subtree (digest None deletes
+        it); unchanged subtrees are skipped without being read.
+        """
+        if old is None:
+            return [[[], new]]
+        patch: List[list] = []
+        self._diff(old, new, [], patch)
+        return patch
+    
+    def _diff(self, old: str, new: str, path: List[str], patch: List[list]):
+        if old == new:
+            return
+        old_node, new_node = self.node(old), self.node(new)
+        if "tree" not in old_node or "tree" not in new_node:
+            patch.append([path, new])
+            return
+        old_tree, new_tree = old_node["tree"], new_node["tree"]
+        for key in old_tree.keys() - new_tree.keys():
+            patch.append([path + [key], None])
+        for key, child in new_tree.items():
+            if key not in old_tree:
+                patch.append([path + [key], child])
+            else:
+                self._diff(old_tree[key], child, path + [key], patch)
+    
+    def apply(self, base: Any, patch: List[list]) -> Any:
+        """
+        Apply a patch from diff to a materialized base version.
+        
+        Only dicts along patched paths are copied; untouched subtrees are
+        shared with `base`, so treat both as read-only.
+        """
+        for path, digest in patch:
+            if not path:
+                base = self.get(digest)
+                continue
+            base = dict(base)
+            parent = base
+            for key in path[:-1]:
+                parent[key] = dict(parent[key])
+                parent = parent[key]
+            if digest is None:
+                parent.pop(path[-1], None)
+            else:
+                parent[path[-1]] = self.get(digest)
+        return base
+
+
 class HandoffProtocol:
     """
     Protocol for agent-to-agent handoffs.
+    
+    Transferred contexts go into a content-addressed ContextStore (pass one
+    store to share it between protocols). A HANDOVER message carries the
+    new version's digest, the receiver's last-known version and a
+    structural patch of digests between them, so transfer cost scales with
+    what changed rather than with the size of the context. Contexts the
+    store rejects (sets, tuples, non-string keys) are sent inline in
+    "transferred_context" instead. accept_handoff and resolve_handoff
+    rebuild the context on the receiving side.
     """
     
-    def __init__(self, communication: AgentCommunication):
+    def __init__(self, communication: AgentCommunication, store: ContextStore = None):
         self.communication = communication
+        self.store = store if store is not None else ContextStore()
+        # agent -> (digest, materialized context) of the last version it accepted
+        self.known_contexts: Dict[str, tuple] = {}
     
     def create_handoff(self, from_agent: str, to_agent: str, 
                        context: Dict, reason: str) -> AgentMessage:
         """Create a handoff message."""
+        content = {"handoff_reason": reason}
+        try:
+            digest = self.store.put(context)
+        except TypeError:
+            content["transferred_context"] = context
+        else:
+            base = self.known_contexts.get(to_agent, (None, None))[0]
+            content["context_ref"] = digest
+            content["base_ref"] = base
+            content["context_patch"] = self.store.diff(base, digest)
+        content["handoff_timestamp"] = time.time()
         return AgentMessage(
             sender=from_agent,
             receiver=to_agent,
             message_type=MessageType.HANDOVER,
-            content={
-                "handoff_reason": reason,
-                "transferred_context": context,
-                "handoff_timestamp": time.time()
-            },
+            content=content,
             priority=1
         )
     
+    def resolve_handoff(self, agent_id: str, message: AgentMessage) -> Dict:
+        """
+        Rebuild the transferred context of a HANDOVER for its receiver.
+        
+        Records the version as the agent's last known one and leaves the
+        message untouched, since it may already be in the history or log.
+        The result shares structure with earlier versions, so treat it as
+        read-only.
+        """
+        content = message.content
+        if "context_ref" not in content:
+            return content.get("transferred_context")
+        
+        known = self.known_contexts.get(agent_id)
+        if content["base_ref"] is None:
+            base = None
+        elif known is not None and known[0] == content["base_ref"]:
+            base = known[1]
+        else:
+            base = self.store.get(content["base_ref"])
+        context = self.store.apply(base, content["context_patch"])
+        
+        self.known_contexts[agent_id] = (content["context_ref"], context)
+        return context
+    
     def accept_handoff(self, agent_id: str) -> Optional[AgentMessage]:
-        """Accept pending handoff for an agent."""
+        """
+        Accept pending handoff for an agent.
+        
+        Returns a copy of the message whose content carries the rebuilt
+        "transferred_context".
+        """
         messages = self.communication.receive(agent_id)
         
         for msg in messages:
             if msg.message_type == MessageType.HANDOVER:
-                return msg
+                context = self.resolve_handoff(agent_id, msg)
+                return replace(msg, content={**msg.content, "transferred_context": context})
         
         return None
     
-    def transfer_with_state(self, from_agent: str, to_agent: str,
-                           state: Dict, task: Dict) -> bool:
-        """
-        Transfer task state from one agent to another.
-        
-        Returns success status.
-        """
-        handoff = self.create_handoff(
+    def _state_handoff(self, from_agent: str, to_agent: str,
+                       state: Dict, task: Dict) -> AgentMessage:
+        return self.create_handoff(
             from_agent=from_agent,
             to_agent=to_agent,
             context={
@@ -271,18 +1862,50 @@ class HandoffProtocol:
             },
             reason="task_transfer"
         )
+    
+    @staticmethod
+    def _is_ack(message: Optional[AgentMessage]) -> bool:
+        return (
+            message is not None
+            and message.message_type == MessageType.RESPONSE
+            and message.content.get("status") == "handoff_received"
+        )
+    
+    def _ack_from(self, to_agent: str) -> Callable[[AgentMessage], bool]:
+        """Matcher for acks sent without reply_to."""
+        return lambda message: message.sender == to_agent and self._is_ack(message)
+    
+    def transfer_with_state(self, from_agent: str, to_agent: str,
+                           state: Dict, task: Dict, timeout: float = 0.1) -> bool:
+        """
+        Transfer task state from one agent to another.
         
+        The receiver acknowledges with communication.reply(handoff,
+        {"status": "handoff_received"}); a plain RESPONSE with that status
+        from to_agent (no reply_to) is accepted too. Returns as soon as the
+        ack is in from_agent's inbox (other messages stay queued), or False
+        after timeout; see AgentCommunication.wait_reply. Use
+        transfer_with_state_async with AsyncAgentCommunication.
+        """
+        handoff = self._state_handoff(from_agent, to_agent, state, task)
         self.communication.send(handoff)
         
-        # Wait for acknowledgment
-        time.sleep(0.1)  # In production, use async with timeout
-        ack = self.communication.receive(from_agent)
-        
-        return any(
-            m.message_type == MessageType.RESPONSE and 
-            m.content.get("status") == "handoff_received"
-            for m in ack
+        ack = self.communication.wait_reply(
+            from_agent, handoff.message_id, timeout, self._ack_from(to_agent)
         )
+        return self._is_ack(ack)
+    
+    async def transfer_with_state_async(self, from_agent: str, to_agent: str,
+                                        state: Dict, task: Dict,
+                                        timeout: float = 5.0) -> bool:
+        """Transfer task state over AsyncAgentCommunication, awaiting the ack."""
+        handoff = self._state_handoff(from_agent, to_agent, state, task)
+        try:
+            ack = await self.communication.request(handoff, timeout)
+        except asyncio.TimeoutError:
+            # An ack without reply_to is queued rather than resolving the request
+            ack = self.communication.take_reply(from_agent, handoff.message_id, self._ack_from(to_agent))
+        return self._is_ack(ack)
 
 
 # Consensus Mechanism
@@ -290,16 +1913,38 @@ class HandoffProtocol:
 class ConsensusManager:
     """
     Manager for multi-agent consensus building.
+    
+    Ballots are keyed by agent and every vote updates running weighted
+    tallies, so submitting a vote and asking for the current leader are
+    O(1) in the number of agents (a changed vote that lowers the leader
+    rescans the options only). A vote weighs confidence * expertise_factor.
+    A round is decided early once the quorum is met and the lead reaches
+    the required margin, or as soon as the outstanding votes can no longer
+    change the winner. A tie for the lead is never decided early.
     """
     
-    def __init__(self):
-        self.votes: Dict[str, List[Dict]] = {}
+    def __init__(self, expertise: Dict[str, float] = None):
+        self.votes: Dict[str, Dict[str, Dict]] = {}
+        self.tallies: Dict[str, Dict] = {}
         self.debates: Dict[str, List[Dict]] = {}
+        self.expertise: Dict[str, float] = dict(expertise or {})
+    
+    def set_expertise(self, agent_id: str, factor: float):
+        """Set an agent's expertise factor (default 1.0); applies to later votes."""
+        self.expertise[agent_id] = factor
     
     def initiate_vote(self, topic_id: str, agents: List[str], 
-                      options: List[str]):
-        """Initiate a voting round on a topic."""
-        self.votes[topic_id] = []
+                      options: List[str], quorum: float = None,
+                      margin: float = None):
+        """
+        Initiate a voting round on a topic.
+        
+        quorum is the fraction of agents that must vote before the round can
+        be decided early; margin is the lead over the runner-up, as a fraction
+        of the weight cast, required on top of it. Without either, the round
+        is only decided early when the remaining votes cannot change the result.
+        """
+        self.votes[topic_id] = {}
         
         # Request votes from agents
         for agent in agents:
@@ -309,131 +1954,434 @@ class ConsensusManager:
                 "options": options,
                 "status": "pending"
             }
-            self.votes[topic_id].append(vote_request)
+            self.votes[topic_id][agent] = vote_request
+        
+        self.tallies[topic_id] = {
+            "scores": {option: 0.0 for option in options},
+            "confidence": {option: 0.0 for option in options},
+            "counts": {option: 0 for option in options},
+            "eligible": len(self.votes[topic_id]),
+            "cast": 0,
+            "cast_weight": 0.0,
+            "pending_weight": sum(self.expertise.get(agent, 1.0) for agent in self.votes[topic_id]),
+            "leader": None,
+            "runner_up": None,
+            "quorum": quorum,
+            "margin": margin,
+            "decided": False
+        }
     
     def submit_vote(self, topic_id: str, agent_id: str, 
-                    selection: str, confidence: float):
-        """Submit a vote for a topic."""
+                    selection: str, confidence: float) -> bool:
+        """
+        Submit (or change) a vote for a topic.
+        
+        Returns False if the round was already decided and the vote was not counted.
+        """
         if topic_id not in self.votes:
             raise ValueError(f"Unknown topic: {topic_id}")
+        ballot = self.votes[topic_id].get(agent_id)
+        if ballot is None:
+            raise ValueError(f"Agent {agent_id} is not on the ballot for {topic_id}")
+        tally = self.tallies[topic_id]
+        if tally["decided"]:
+            return False
         
+        confidence = min(max(confidence, 0.0), 1.0)
         vote_record = {
             "agent": agent_id,
+            "topic": topic_id,
+            "options": ballot["options"],
+            "status": "cast",
             "selection": selection,
             "confidence": confidence,
+            "weight": confidence * self.expertise.get(agent_id, 1.0),
             "timestamp": time.time()
         }
         
-        for vote in self.votes[topic_id]:
-            if vote["agent"] == agent_id:
-                vote["status"] = "cast"
-                vote["selection"] = selection
-                vote["confidence"] = confidence
-                break
+        if ballot["status"] == "cast":
+            self._retract(tally, ballot)
+        else:
+            tally["cast"] += 1
+            tally["pending_weight"] -= self.expertise.get(agent_id, 1.0)
+        self.votes[topic_id][agent_id] = vote_record
+        
+        scores = tally["scores"]
+        scores[selection] = scores.get(selection, 0.0) + vote_record["weight"]
+        tally["confidence"][selection] = tally["confidence"].get(selection, 0.0) + confidence
+        tally["counts"][selection] = tally["counts"].get(selection, 0) + 1
+        tally["cast_weight"] += vote_record["weight"]
+        
+        leader, runner_up = tally["leader"], tally["runner_up"]
+        if selection == leader:
+            pass
+        elif leader is None or scores[selection] > scores[leader]:
+            tally["leader"], tally["runner_up"] = selection, leader
+        elif runner_up is None or selection == runner_up or scores[selection] > scores[runner_up]:
+            tally["runner_up"] = selection
+        
+        tally["decided"] = self._is_decided(tally)
+        return True
+    
+    def _retract(self, tally: Dict, vote: Dict):
+        """Remove a previous vote from the running tallies."""
+        selection = vote["selection"]
+        tally["scores"][selection] -= vote["weight"]
+        tally["confidence"][selection] -= vote["confidence"]
+        tally["counts"][selection] -= 1
+        tally["cast_weight"] -= vote["weight"]
+        if selection in (tally["leader"], tally["runner_up"]):
+            # Only options someone still votes for can lead
+            voted = [option for option, count in tally["counts"].items() if count > 0]
+            ranked = sorted(voted, key=tally["scores"].get, reverse=True)[:2]
+            ranked += [None] * (2 - len(ranked))
+            tally["leader"], tally["runner_up"] = ranked
+    
+    def _lead(self, tally: Dict) -> float:
+        if tally["leader"] is None:
+            return 0.0
+        runner_up = tally["scores"][tally["runner_up"]] if tally["runner_up"] is not None else 0.0
+        return tally["scores"][tally["leader"]] - runner_up
+    
+    def _is_decided(self, tally: Dict) -> bool:
+        lead = self._lead(tally)
+        if tally["leader"] is None:
+            return False
+        # Outstanding votes (weight at most their expertise) cannot close the gap
+        if lead > tally["pending_weight"] + 1e-12:
+            return True
+        if tally["quorum"] is None and tally["margin"] is None:
+            return False
+        if tally["quorum"] is not None and tally["cast"] < tally["quorum"] * tally["eligible"]:
+            return False
+        if lead <= 1e-12:
+            return False
+        if tally["margin"] is not None and lead < tally["margin"] * tally["cast_weight"]:
+            return False
+        return True
+    
+    def is_decided(self, topic_id: str) -> bool:
+        """Whether the round was decided early; later votes are not counted."""
+        if topic_id not in self.tallies:
+            raise ValueError(f"Unknown topic: {topic_id}")
+        return self.tallies[topic_id]["decided"]
+    
+    def leader(self, topic_id: str) -> Dict:
+        """Current leading selection, its weighted score and lead, in O(1)."""
+        if topic_id not in self.tallies:
+            raise ValueError(f"Unknown topic: {topic_id}")
+        tally = self.tallies[topic_id]
+        leader = tally["leader"]
+        return {
+            "leader": leader,
+            "weighted_score": tally["scores"][leader] if leader is not None else 0.0,
+            "lead": self._lead(tally),
+            "votes_cast": tally["cast"],
+            "eligible": tally["eligible"],
+            "decided": tally["decided"]
+        }
     
     def calculate_weighted_consensus(self, topic_id: str) -> Dict:
         """
-        votes.
+        Calculate weighted consensus from votes.
         
         Weight = confidence * expertise_factor
-        Calculate weighted consensus from """
-        if topic_id not in self.votes:
+        """
+        if topic_id not in self.tallies:
             raise ValueError(f"Unknown topic: {topic_id}")
         
-        votes = [v for v in self.votes[topic_id] if v.get("status") == "cast"]
-        
-        if not votes:
+        tally = self.tallies[topic_id]
+        if not tally["cast"]:
             return {"status": "no_votes", "result": None}
         
-        # Group by selection
-        selections: Dict[str, List[Dict]] = {}
-        for vote in votes:
-            selection = vote["selection"]
-            if selection not in selections:
-                selections[selection] = []
-            selections[selection].append(vote)
-        
-        # Calculate weighted score for each selection
         results = {}
-        for selection, selection_votes in selections.items():
-            weighted_sum = sum(v["confidence"] for v in selection_votes)
-            avg_confidence = weighted_sum / len(selection_votes) if selection_votes else 0
-            results[selection] = {
-                "weighted_score": weighted_sum,
-                "avg_confidence": avg_confidence,
-                "vote_count": len(selection_votes)
-            }
-        
-        # Select winner
-        winner = max(results.keys(), key=lambda s: results[s]["weighted_score"])
+        for selection, count in tally["counts"].items():
+            if count:
+                results[selection] = {
+                    "weighted_score": tally["scores"][selection],
+                    "avg_confidence": tally["confidence"][selection] / count,
+                    "vote_count": count
+                }
         
+        winner = tally["leader"]
+        if winner not in results:
+            # The running leader must be a voted option; recover if it is not
+            winner = max(results, key=lambda selection: results[selection]["weighted_score"])
         return {
             "status": "complete",
             "result": winner,
             "details": results,
-            "consensus_strength": results[winner]["weighted_score"] / len(votes) if votes else 0
+            "consensus_strength": results[winner]["weighted_score"] / tally["cast"],
+            "decided": tally["decided"]
         }
 
 
 # Failure Handling
 
+class TimingWheel:
+    """
+    Hierarchical timing wheel for large numbers of timers.
+    
+    Level 0 has wheel_size slots of one tick each; every higher level has
+    wheel_size slots, each spanning a full turn of the level below, whose
+    entries cascade down as time reaches them. Scheduling and cancelling
+    are O(1); advancing costs O(1) per elapsed tick plus the entries that
+    fall due or cascade.
+    """
+    
+    def __init__(self, tick: float = 0.05, wheel_size: int = 256, levels: int = 4,
+                 start: float = 0.0):
+        self.tick = tick
+        self.wheel_size = wheel_size
+        self.levels = [[[] for _ in range(wheel_size)] for _ in range(levels)]
+        self.current = int(start / tick)
+        self.pending = 0
+    
+    def _insert(self, entry: list):
+        deadline = entry[0]
+        span = 1
+        for level in self.levels:
+            if deadline - self.current < span * self.wheel_size or level is self.levels[-1]:
+                level[(deadline // span) % self.wheel_size].append(entry)
+                return
+            span *= self.wheel_size
+    
+    def schedule(self, at: float, item: Any) -> list:
+        """Schedule item for time `at`; returns a handle for cancel()."""
+        entry = [max(int(-(-at // self.tick)), self.current + 1), item, False]
+        self._insert(entry)
+        self.pending += 1
+        return entry
+    
+    def cancel(self, handle: list):
+        if not handle[2]:
+            handle[2] = True
+            self.pending -= 1
+    
+    def advance(self, now: float) -> List[Any]:
+        """Move the wheel to `now` and return items that fell due, in deadline order."""
+        target = int(now // self.tick)
+        if not self.pending:
+            self.current = max(self.current, target)
+            return []
+        
+        due = []
+        while self.current < target and self.pending:
+            self.current += 1
+            # Cascade higher levels whose slot boundary was reached
+            span = self.wheel_size
+            for level in self.levels[1:]:
+                if self.current % span:
+                    break
+                slot = (self.current // span) % self.wheel_size
+                entries, level[slot] = level[slot], []
+                for entry in entries:
+                    if not entry[2]:
+                        self._insert(entry)
+                span *= self.wheel_size
+            
+            slot = self.current % self.wheel_size
+            entries, self.levels[0][slot] = self.levels[0][slot], []
+            for entry in entries:
+                if entry[2]:
+                    continue
+                if entry[0] <= self.current:
+                    entry[2] = True
+                    self.pending -= 1
+                    due.append(entry[1])
+                else:
+                    self._insert(entry)
+        self.current = max(self.current, target)
+        return due
+
+
 class AgentFailureHandler:
     """
     Handler for agent failures in multi-agent systems.
+    
+    Retries and circuit-breaker transitions are timers on a TimingWheel, so
+    tens of thousands of pending retries are scheduled in O(1) each and
+    breakers reopen without per-call expiry checks. Breakers go closed ->
+    open after max_retries consecutive failures, then half-open after the
+    cooldown, where a single probe request decides between closed and a
+    longer open period. With a WorkerScheduler, open agents are taken out
+    of selection (independently of their worker status) and work is
+    rerouted to the best available agent with the task's capability. A
+    half-open agent re-enters selection for exactly one task, so regular
+    work can act as the probe when no retry is pending; whichever of
+    poll(), is_available() or the scheduler claims the probe first takes
+    it out again. Call poll() regularly to collect due retries.
     """
     
     def __init__(self, communication: AgentCommunication, 
-                 max_retries: int = 3):
+                 max_retries: int = 3, scheduler: WorkerScheduler = None,
+                 cooldown: float = 60.0, base_delay: float = 1.0,
+                 max_delay: float = 60.0, jitter: float = 0.5,
+                 tick: float = 0.05, clock: Callable[[], float] = time.monotonic,
+                 seed: int = None):
         self.communication = communication
         self.max_retries = max_retries
+        self.scheduler = scheduler
+        self.cooldown = cooldown
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self.clock = clock
+        self.rng = random.Random(seed)
         self.failure_counts: Dict[str, int] = {}
-        self.circuit_breakers: Dict[str, float] = {}  # agent -> unlock time
+        self.circuit_breakers: Dict[str, float] = {}  # agent -> reopen (half-open) time
+        self.breaker_state: Dict[str, str] = {}  # absent = closed
+        self._breaker_trips: Dict[str, int] = {}
+        self._probing: set = set()
+        self.wheel = TimingWheel(tick, start=clock())
+        self.ready: deque = deque()
+    
+    def backoff_delay(self, attempt: int) -> float:
+        """Exponential backoff with jitter: half fixed, half random."""
+        delay = min(self.base_delay * 2 ** attempt, self.max_delay)
+        return delay * (1 - self.jitter) + self.rng.uniform(0, delay * self.jitter)
     
     def handle_failure(self, agent_id: str, task_id: str, 
-                       error: str) -> Dict:
+                       error: str, task: Dict = None) -> Dict:
         """
         Handle a failure from an agent.
         
-        Returns action to take.
+        Returns action to take. When the task itself is given, the retry
+        (or the rerouted attempt) is also scheduled and comes out of poll().
         """
+        self._probing.discard(agent_id)
+        
         # Increment failure count
         self.failure_counts[agent_id] = self.failure_counts.get(agent_id, 0) + 1
         
         # Check if circuit breaker should activate
-        if self.failure_counts[agent_id] >= self.max_retries:
+        if self.breaker_state.get(agent_id) == "half_open" or \
+                self.failure_counts[agent_id] >= self.max_retries:
             self._activate_circuit_breaker(agent_id)
+            alternative = self._find_alternative_agent(
+                agent_id, task.get("type") if task else None
+            )
+            if task is not None and alternative is not None:
+                self._schedule(0.0, {"task": task, "task_id": task_id, "agent_id": alternative,
+                                     "attempt": 0, "rerouted_from": agent_id})
             return {
                 "action": "reroute",
                 "reason": "circuit_breaker_activated",
-                "alternative": self._find_alternative_agent(agent_id)
+                "alternative": alternative
             }
         
+        delay = self.backoff_delay(self.failure_counts[agent_id])
+        if task is not None:
+            self._schedule(delay, {"task": task, "task_id": task_id, "agent_id": agent_id,
+                                   "attempt": self.failure_counts[agent_id]})
         return {
             "action": "retry",
             "reason": error,
             "retry_count": self.failure_counts[agent_id],
-            "delay": min(2 ** self.failure_counts[agent_id], 60)  # Exponential backoff
+            "delay": delay,
+            "scheduled": task is not None
         }
     
+    def _schedule(self, delay: float, retry: Dict):
+        retry["due"] = self.clock() + delay
+        self.wheel.schedule(retry["due"], ("retry", retry))
+    
     def _activate_circuit_breaker(self, agent_id: str):
-        """Temporarily disable an agent."""
-        self.circuit_breakers[agent_id] = time.time() + 60  # 1 minute cooldown
+        """Open the breaker; it turns half-open after a cooldown that doubles on each trip."""
+        trips = self._breaker_trips[agent_id] = self._breaker_trips.get(agent_id, 0) + 1
+        reopen = self.clock() + min(self.cooldown * 2 ** (trips - 1), self.cooldown * 32)
+        self.circuit_breakers[agent_id] = reopen
+        self.breaker_state[agent_id] = "open"
+        self.wheel.schedule(reopen, ("half_open", agent_id, trips))
+        if self.scheduler is not None and agent_id in self.scheduler.workers:
+            self.scheduler.set_enabled(agent_id, False, "breaker")
+    
+    def _claim_probe(self, agent_id: str) -> bool:
+        """Claim the single probe of a half-open agent; False when it is taken."""
+        if agent_id in self._probing:
+            return False
+        if self.scheduler is not None and agent_id in self.scheduler.workers:
+            if not self.scheduler.is_enabled(agent_id, "breaker"):
+                # Already spent on work the scheduler selected
+                return False
+            self.scheduler.set_enabled(agent_id, False, "breaker")
+        self._probing.add(agent_id)
+        return True
     
-    def _find_alternative_agent(self, failed_agent: str) -> str:
+    def _find_alternative_agent(self, failed_agent: str, capability: str = None) -> Optional[str]:
         """Find an alternative agent to handle the task."""
-        # In production, this would check agent capabilities and availability
-        return "default_backup_agent"
+        if self.scheduler is None:
+            # Without a capability index there is nothing to choose from
+            return "default_backup_agent"
+        
+        exclude = failed_agent in self.scheduler.workers
+        if exclude:
+            self.scheduler.set_enabled(failed_agent, False, "reroute")
+        try:
+            return self.scheduler.select(capability) or self.scheduler.select(None)
+        finally:
+            if exclude:
+                self.scheduler.set_enabled(failed_agent, True, "reroute")
+    
+    def advance(self):
+        """Apply breaker transitions and queue retries that are due."""
+        for event in self.wheel.advance(self.clock()):
+            if event[0] == "half_open":
+                _, agent_id, trips = event
+                if self.breaker_state.get(agent_id) == "open" and self._breaker_trips[agent_id] == trips:
+                    self.breaker_state[agent_id] = "half_open"
+                    del self.circuit_breakers[agent_id]
+                    # Back into selection for one task, so ordinary work can probe it too
+                    if self.scheduler is not None and agent_id in self.scheduler.workers:
+                        self.scheduler.admit_once(agent_id, "breaker")
+            else:
+                self.ready.append(event[1])
+    
+    def poll(self) -> List[Dict]:
+        """
+        Return retries that are due, ready to dispatch.
+        
+        A retry for an open agent, or for a half-open agent already being
+        probed, is rerouted to an alternative agent. The first retry for a
+        half-open agent becomes its probe ("probe": True).
+        """
+        self.advance()
+        due = []
+        while self.ready:
+            retry = self.ready.popleft()
+            agent_id = retry["agent_id"]
+            state = self.breaker_state.get(agent_id)
+            if state == "half_open" and self._claim_probe(agent_id):
+                retry["probe"] = True
+            elif state is not None:
+                alternative = self._find_alternative_agent(agent_id, retry["task"].get("type"))
+                if alternative is None:
+                    # Nobody can take it yet; try again after the next backoff step
+                    retry["attempt"] += 1
+                    self._schedule(self.backoff_delay(retry["attempt"]), retry)
+                    continue
+                retry["rerouted_from"] = agent_id
+                retry["agent_id"] = alternative
+            due.append(retry)
+        return due
     
     def is_available(self, agent_id: str) -> bool:
-        """Check if an agent is available (circuit breaker not active)."""
-        if agent_id in self.circuit_breakers:
-            if time.time() < self.circuit_breakers[agent_id]:
-                return False
-            # Reset after cooldown
-            del self.circuit_breakers[agent_id]
-            self.failure_counts[agent_id] = 0
-        return True
+        """
+        Check if an agent is available (circuit breaker not open, no probe in flight).
+        
+        For a half-open agent this claims its probe, so only the first
+        caller gets True; send it the probe request.
+        """
+        self.advance()
+        state = self.breaker_state.get(agent_id)
+        return state is None or (state == "half_open" and self._claim_probe(agent_id))
     
     def record_success(self, agent_id: str):
         """Record a successful task completion."""
         self.failure_counts[agent_id] = 0
+        self._probing.discard(agent_id)
+        if self.breaker_state.get(agent_id) == "half_open":
+            del self.breaker_state[agent_id]
+            self._breaker_trips[agent_id] = 0
+            if self.scheduler is not None and agent_id in self.scheduler.workers:
+                self.scheduler.set_enabled(agent_id, True, "breaker")
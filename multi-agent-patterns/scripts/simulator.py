@@ -0,0 +1,477 @@
+"""
+Multi-Agent Coordination Simulator
+
+Discrete-event simulator that drives SupervisorAgent, HandoffProtocol,
+ConsensusManager and AgentFailureHandler from coordination.py with
+synthetic workers. Time is virtual: worker latencies are sampled from a
+configurable distribution and every completion is an event, so runs with
+hundreds of agents and thousands of workflows take seconds.
+
+Each workflow is decomposed by the supervisor into subtasks, which run as
+soon as their dependencies are done. Ready subtasks wait in a priority
+queue until select_worker finds a free worker, failures go through the
+failure handler's backoff retries and circuit breakers, a subtask picked
+up by a different worker than the workflow's previous one is handed the
+accumulated context, and a finished workflow is accepted by a weighted
+vote among a sample of workers.
+
+Parameter sweeps run one simulation per grid point across processes and
+come out as a capacity-planning table.
+
+Usage:
+    python simulator.py --workers 10,100,500 --failure-rate 0,0.05
+    python simulator.py --workers 200 --arrival-rate 5,10,20 --json sweep.json
+
+NOTE: Results are only as good as the latency and failure assumptions.
+Calibrate --latency and --failure-rate against measured agent behaviour.
+"""
+
+from typing import Callable, Dict, List
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+import argparse
+import heapq
+import itertools
+import json
+import math
+import random
+import time
+
+from coordination import (
+    AgentCommunication,
+    AgentFailureHandler,
+    AgentMessage,
+    ConsensusManager,
+    HandoffProtocol,
+    MessageType,
+    SupervisorAgent
+)
+
+
+DEFAULT_PARAMS = {
+    "workers": 100,
+    "workflows": 1000,
+    "arrival_rate": 0.0,  # workflows per virtual second; 0 = all arrive at once
+    "latency": "lognormal:1.0:0.5",
+    "worker_spread": 0.25,  # sigma of each worker's lognormal speed factor
+    "capabilities_per_worker": 2,
+    "failure_rate": 0.02,
+    "flaky_fraction": 0.05,
+    "flaky_failure_rate": 0.5,
+    "max_retries": 3,
+    "retry_base_delay": 0.5,
+    "breaker_cooldown": 30.0,
+    "handoff_latency": 0.05,
+    "voters": 5,
+    "quorum": 0.6,
+    "margin": 0.2,
+    "vote_latency": "exp:0.2",
+    "poll_interval": 0.1,
+    "seed": 0
+}
+
+WORKFLOW_TYPES = ("research", "create", "general")
+SUBTASK_TYPES = ("search", "analyze", "synthesize", "plan", "draft", "review", "execute")
+
+
+def parse_latency(spec: str) -> Callable[[random.Random], float]:
+    """
+    Parse a latency distribution spec into a sampler.
+    
+    Specs are "lognormal:median:sigma", "exp:mean", "uniform:low:high"
+    or "const:value", in virtual seconds.
+    """
+    kind, *args = spec.split(":")
+    values = [float(arg) for arg in args]
+    if kind == "lognormal" and len(values) == 2:
+        mu, sigma = math.log(values[0]), values[1]
+        return lambda rng: rng.lognormvariate(mu, sigma)
+    if kind == "exp" and len(values) == 1:
+        rate = 1.0 / values[0]
+        return lambda rng: rng.expovariate(rate)
+    if kind == "uniform" and len(values) == 2:
+        low, high = values
+        return lambda rng: rng.uniform(low, high)
+    if kind == "const" and len(values) == 1:
+        return lambda rng: values[0]
+    raise ValueError(f"Unknown latency spec: {spec}")
+
+
+def _percentile(values: List[float], fraction: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(int(fraction * len(ordered)), len(ordered) - 1)]
+
+
+class _CountingCommunication(AgentCommunication):
+    """AgentCommunication that counts messages by type instead of keeping history."""
+    
+    def __init__(self):
+        super().__init__(history_size=1)
+        self.counts: Counter = Counter()
+    
+    def _record(self, message: AgentMessage):
+        self.counts[message.message_type.value] += 1
+
+
+# Simulation
+
+class CoordinationSimulator:
+    """
+    Discrete-event simulation of a supervisor coordinating synthetic workers.
+    
+    Events are (time, sequence, kind, payload) tuples on a heap; the
+    coordination objects read the virtual clock through the failure
+    handler's clock hook. Call run() once per simulator.
+    """
+    
+    def __init__(self, params: Dict = None):
+        self.params = {**DEFAULT_PARAMS, **(params or {})}
+        p = self.params
+        self.rng = random.Random(p["seed"])
+        self.now = 0.0
+        self.events: List[tuple] = []
+        self._sequence = itertools.count()
+        
+        self.communication = _CountingCommunication()
+        self.supervisor = SupervisorAgent("supervisor", self.communication)
+        self.handoffs = HandoffProtocol(self.communication)
+        self.consensus = ConsensusManager()
+        self.failures = AgentFailureHandler(
+            self.communication,
+            max_retries=p["max_retries"],
+            scheduler=self.supervisor.scheduler,
+            cooldown=p["breaker_cooldown"],
+            base_delay=p["retry_base_delay"],
+            tick=p["poll_interval"] / 2,
+            clock=lambda: self.now,
+            seed=p["seed"]
+        )
+        self.latency = parse_latency(p["latency"])
+        self.vote_latency = parse_latency(p["vote_latency"])
+        
+        # Synthetic workers: capabilities, speed factor, failure rate, expertise
+        self.speed: Dict[str, float] = {}
+        self.failure_rate: Dict[str, float] = {}
+        for i in range(p["workers"]):
+            worker_id = f"worker-{i}"
+            capabilities = self.rng.sample(SUBTASK_TYPES, min(p["capabilities_per_worker"], len(SUBTASK_TYPES)))
+            self.supervisor.register_worker(worker_id, capabilities)
+            self.speed[worker_id] = self.rng.lognormvariate(0.0, p["worker_spread"])
+            flaky = self.rng.random() < p["flaky_fraction"]
+            self.failure_rate[worker_id] = p["flaky_failure_rate"] if flaky else p["failure_rate"]
+            self.consensus.set_expertise(worker_id, self.rng.uniform(0.5, 1.5))
+        self.worker_ids = list(self.speed)
+        
+        # (-priority, ready time, sequence, subtask, preferred worker)
+        self.ready: List[tuple] = []
+        self.workflows: Dict[str, Dict] = {}
+        self.finished = 0
+        self._poll_scheduled = False
+        
+        self.queue_waits: List[float] = []
+        self.workflow_latencies: List[float] = []
+        self.consensus_times: List[float] = []
+        self.votes_counted: List[int] = []
+        self.stats = Counter()
+    
+    def _push(self, at: float, kind: str, payload=None):
+        heapq.heappush(self.events, (at, next(self._sequence), kind, payload))
+    
+    def _enqueue(self, subtask: Dict, preferred: str = None):
+        heapq.heappush(self.ready, (-subtask.get("priority", 0), self.now,
+                                    next(self._sequence), subtask, preferred))
+    
+    def _schedule_poll(self):
+        pending = self.failures.wheel.pending or self.failures.ready
+        if pending and not self._poll_scheduled and self.finished < len(self.workflows):
+            self._poll_scheduled = True
+            self._push(self.now + self.params["poll_interval"], "poll")
+    
+    # Event handlers
+    
+    def _arrive(self, task: Dict):
+        subtasks = self.supervisor.decompose_task(task)
+        workflow = {
+            "arrival": self.now,
+            "waiting": {},
+            "dependents": {},
+            "remaining": len(subtasks),
+            "context": {"workflow": task["id"], "results": {}},
+            "last_worker": None,
+            "votes_outstanding": 0,
+            "done": False
+        }
+        self.workflows[task["id"]] = workflow
+        for subtask in subtasks:
+            workflow["waiting"][subtask["id"]] = set(subtask["depends_on"])
+            for dependency in subtask["depends_on"]:
+                workflow["dependents"].setdefault(dependency, []).append(subtask)
+            if not subtask["depends_on"]:
+                self._enqueue(subtask)
+    
+    def _dispatch(self):
+        while self.ready:
+            subtask, preferred = self.ready[0][3], self.ready[0][4]
+            worker_id = preferred if preferred and \
+                self.supervisor.workers[preferred]["status"] == "available" else None
+            if worker_id is None:
+                try:
+                    worker_id = self.supervisor.select_worker(subtask)
+                except ValueError:
+                    return
+            ready_time = heapq.heappop(self.ready)[1]
+            self._start(worker_id, subtask, ready_time)
+    
+    def _start(self, worker_id: str, subtask: Dict, ready_time: float):
+        self.queue_waits.append(self.now - ready_time)
+        assignment = self.supervisor.assign_task(subtask, worker_id)
+        workflow = self.workflows[subtask["parent_task"]]
+        
+        duration = self.latency(self.rng) * self.speed[worker_id]
+        previous = workflow["last_worker"]
+        if previous is not None and previous != worker_id:
+            handoff = self.handoffs.create_handoff(previous, worker_id, workflow["context"], "pipeline_stage")
+            self.communication.send(handoff)
+            self.stats["handoff_bytes"] += len(json.dumps(handoff.content["context_patch"]))
+            duration += self.params["handoff_latency"]
+        for message in self.communication.receive(worker_id):
+            if message.message_type == MessageType.HANDOVER:
+                self.handoffs.resolve_handoff(worker_id, message)
+        
+        ok = self.rng.random() >= self.failure_rate[worker_id]
+        if not ok:
+            # Failures surface part way through the attempt
+            duration *= self.rng.random()
+        self.stats["attempts"] += 1
+        self.stats["busy_time"] += duration
+        self._push(self.now + duration, "complete", (worker_id, subtask, assignment, self.now, ok))
+    
+    def _complete(self, worker_id: str, subtask: Dict, assignment: AgentMessage,
+                  started: float, ok: bool):
+        elapsed = self.now - started
+        workflow = self.workflows[subtask["parent_task"]]
+        
+        if not ok:
+            self.communication.reply(assignment, {"status": "failed", "task_id": subtask["id"]},
+                                     MessageType.ALERT)
+            self.communication.receive(self.supervisor.name)
+            self.stats["failures"] += 1
+            action = self.failures.handle_failure(worker_id, subtask["id"], "simulated failure", task=subtask)
+            # The breaker keeps a tripped worker out of selection whatever its status
+            self.supervisor.set_worker_status(worker_id, "available", elapsed=elapsed)
+            if action["action"] == "reroute":
+                self.stats["breaker_trips"] += 1
+                if action["alternative"] is None:
+                    self._enqueue(subtask)
+            else:
+                self.stats["retries"] += 1
+            self._schedule_poll()
+            return
+        
+        self.supervisor.complete_task(worker_id, elapsed)
+        self.failures.record_success(worker_id)
+        self.communication.reply(assignment, {"status": "done", "task_id": subtask["id"]})
+        self.communication.receive(self.supervisor.name)
+        
+        workflow["context"] = {
+            **workflow["context"],
+            "results": {**workflow["context"]["results"],
+                        subtask["id"]: {"worker": worker_id, "elapsed": elapsed}}
+        }
+        workflow["last_worker"] = worker_id
+        workflow["remaining"] -= 1
+        for dependent in workflow["dependents"].get(subtask["id"], []):
+            waiting = workflow["waiting"][dependent["id"]]
+            waiting.discard(subtask["id"])
+            if not waiting:
+                self._enqueue(dependent)
+        if not workflow["remaining"]:
+            self._start_vote(subtask["parent_task"])
+    
+    def _start_vote(self, workflow_id: str):
+        workflow = self.workflows[workflow_id]
+        voters = self.rng.sample(self.worker_ids, min(self.params["voters"], len(self.worker_ids)))
+        if not voters:
+            self._finish(workflow_id)
+            return
+        
+        workflow["vote_started"] = self.now
+        workflow["votes_outstanding"] = len(voters)
+        self.consensus.initiate_vote(workflow_id, voters, ["accept", "revise"],
+                                     self.params["quorum"], self.params["margin"])
+        for voter in voters:
+            selection = "accept" if self.rng.random() < 0.8 else "revise"
+            self._push(self.now + self.vote_latency(self.rng), "vote",
+                       (workflow_id, voter, selection, self.rng.uniform(0.5, 1.0)))
+    
+    def _vote(self, workflow_id: str, voter: str, selection: str, confidence: float):
+        self.communication.send(AgentMessage(
+            sender=voter,
+            receiver=self.supervisor.name,
+            message_type=MessageType.FEEDBACK,
+            content={"topic": workflow_id, "selection": selection, "confidence": confidence}
+        ))
+        self.communication.receive(self.supervisor.name)
+        
+        workflow = self.workflows[workflow_id]
+        workflow["votes_outstanding"] -= 1
+        if workflow["done"]:
+            return
+        self.consensus.submit_vote(workflow_id, voter, selection, confidence)
+        if self.consensus.is_decided(workflow_id) or not workflow["votes_outstanding"]:
+            self.consensus_times.append(self.now - workflow["vote_started"])
+            self.votes_counted.append(self.consensus.leader(workflow_id)["votes_cast"])
+            if self.consensus.calculate_weighted_consensus(workflow_id)["result"] == "accept":
+                self.stats["accepted"] += 1
+            self._finish(workflow_id)
+    
+    def _finish(self, workflow_id: str):
+        workflow = self.workflows[workflow_id]
+        workflow["done"] = True
+        self.finished += 1
+        self.workflow_latencies.append(self.now - workflow["arrival"])
+        self.stats["makespan"] = self.now
+    
+    def _poll(self):
+        self._poll_scheduled = False
+        for retry in self.failures.poll():
+            self._enqueue(retry["task"], retry["agent_id"])
+    
+    # Driver
+    
+    def run(self) -> Dict:
+        """Run the simulation to completion and return its metrics."""
+        p = self.params
+        start = time.perf_counter()
+        
+        # Separate stream, so sweeps over worker settings see the same workload
+        workload = random.Random(p["seed"])
+        arrival = 0.0
+        for i in range(p["workflows"]):
+            if p["arrival_rate"]:
+                arrival += workload.expovariate(p["arrival_rate"])
+            task = {"id": f"wf-{i}", "type": workload.choice(WORKFLOW_TYPES),
+                    "priority": workload.randint(0, 2)}
+            self._push(arrival, "arrive", task)
+        
+        events = 0
+        while self.events:
+            self.now, _, kind, payload = heapq.heappop(self.events)
+            events += 1
+            if kind == "arrive":
+                self._arrive(payload)
+            elif kind == "complete":
+                self._complete(*payload)
+            elif kind == "vote":
+                self._vote(*payload)
+            else:
+                self._poll()
+            self._dispatch()
+            self._schedule_poll()
+        
+        makespan = self.stats["makespan"]
+        messages = sum(self.communication.counts.values())
+        return {
+            "params": p,
+            "makespan": makespan,
+            "throughput": self.finished / makespan if makespan else 0.0,
+            "workflow_latency_p50": _percentile(self.workflow_latencies, 0.5),
+            "workflow_latency_p95": _percentile(self.workflow_latencies, 0.95),
+            "queue_wait_mean": sum(self.queue_waits) / len(self.queue_waits) if self.queue_waits else 0.0,
+            "queue_wait_p95": _percentile(self.queue_waits, 0.95),
+            "utilization": self.stats["busy_time"] / (p["workers"] * makespan) if makespan else 0.0,
+            "messages": messages,
+            "messages_per_workflow": messages / max(p["workflows"], 1),
+            "messages_by_type": dict(self.communication.counts),
+            "handoff_bytes_per_workflow": self.stats["handoff_bytes"] / max(p["workflows"], 1),
+            "attempts": self.stats["attempts"],
+            "failures": self.stats["failures"],
+            "retries": self.stats["retries"],
+            "breaker_trips": self.stats["breaker_trips"],
+            "consensus_time_mean":
+                sum(self.consensus_times) / len(self.consensus_times) if self.consensus_times else 0.0,
+            "votes_per_decision": sum(self.votes_counted) / len(self.votes_counted) if self.votes_counted else 0.0,
+            "accepted": self.stats["accepted"],
+            "completed": self.finished,
+            "events": events,
+            "wall_time": time.perf_counter() - start
+        }
+
+
+def simulate(params: Dict = None) -> Dict:
+    """Run one simulation; params override DEFAULT_PARAMS."""
+    return CoordinationSimulator(params).run()
+
+
+# Parameter Sweeps
+
+def sweep(grid: Dict[str, List], base: Dict = None, processes: int = None) -> List[Dict]:
+    """
+    Simulate every combination of the values in grid.
+    
+    Runs are spread over a process pool (processes=None uses every core;
+    1 runs inline) and returned in grid order.
+    """
+    points = [
+        {**(base or {}), **dict(zip(grid, values))}
+        for values in itertools.product(*grid.values())
+    ]
+    if processes == 1:
+        return [simulate(point) for point in points]
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        return list(pool.map(simulate, points))
+
+
+TABLE_METRICS = [
+    ("makespan", "makespan", ".1f"),
+    ("throughput", "wf/s", ".2f"),
+    ("workflow_latency_p95", "lat p95", ".1f"),
+    ("queue_wait_mean", "wait avg", ".2f"),
+    ("queue_wait_p95", "wait p95", ".2f"),
+    ("utilization", "util", ".0%"),
+    ("messages_per_workflow", "msg/wf", ".1f"),
+    ("retries", "retries", "d"),
+    ("breaker_trips", "trips", "d"),
+    ("votes_per_decision", "votes", ".1f")
+]
+
+
+def format_table(results: List[Dict], keys: List[str]) -> str:
+    """Render sweep results as a table: the swept parameters, then the metrics."""
+    header = [key for key in keys] + [label for _, label, _ in TABLE_METRICS]
+    rows = [
+        [str(result["params"][key]) for key in keys]
+        + [format(result[metric], spec) for metric, _, spec in TABLE_METRICS]
+        for result in results
+    ]
+    widths = [max(len(row[i]) for row in [header] + rows) + 2 for i in range(len(header))]
+    return "\n".join(
+        "".join(cell.rjust(width) for cell, width in zip(row, widths))
+        for row in [header] + rows
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Simulate multi-agent coordination at scale")
+    for key, default in DEFAULT_PARAMS.items():
+        parser.add_argument("--" + key.replace("_", "-"), default=None,
+                            help=f"Comma-separated values to sweep (default {default})")
+    parser.add_argument("--processes", type=int, default=None, help="Worker processes (default: all cores)")
+    parser.add_argument("--json", help="Write full results to a JSON file")
+    
+    args = parser.parse_args()
+    
+    grid = {}
+    for key, default in DEFAULT_PARAMS.items():
+        value = getattr(args, key)
+        if value is not None:
+            grid[key] = [type(default)(item) for item in value.split(",")]
+    
+    results = sweep(grid, processes=args.processes)
+    print(format_table(results, list(grid)))
+    
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)